@@ -0,0 +1,80 @@
+"""
+Encodes a synthetic ROM as a delta against a base it differs from in a few
+scattered places, rebuilds it, and reports how big the delta is and how long
+each direction took.
+
+    PYTHONPATH=src python bench/delta.py [--rom-mib 32] [--edits 256] [--edit-bytes 64]
+
+The base is random and every edit overwrites a run of bytes at a random
+offset, both from a fixed seed so runs from different commits encode the
+same ROM.
+"""
+
+import argparse
+import io
+import json
+import pathlib
+import random
+import tempfile
+import time
+import typing as T
+
+from linkspocket import delta, streams
+
+
+def _rom(base: bytes, edits: int, edit_bytes: int, rng: random.Random) -> bytes:
+    rom = bytearray(base)
+    for _ in range(edits):
+        at = rng.randrange(len(rom) - edit_bytes)
+        rom[at:at + edit_bytes] = rng.randbytes(edit_bytes)
+    return bytes(rom)
+
+
+def main():
+    parser = argparse.ArgumentParser("delta")
+    parser.add_argument("--rom-mib", type=int, default=32)
+    parser.add_argument("--edits", type=int, default=256,
+                        help="Number of places the ROM differs from the base")
+    parser.add_argument("--edit-bytes", type=int, default=64,
+                        help="Bytes changed at each of those places")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    base = rng.randbytes(args.rom_mib * 1024 * 1024)
+    rom = _rom(base, args.edits, args.edit_bytes, rng)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = pathlib.Path(tmp, "base.z64")
+        path.write_bytes(base)
+        b = delta.Base.from_path(path)
+
+        started = time.perf_counter()
+        with path.open("rb") as bh:
+            encoded = delta.encode(io.BytesIO(rom), T.cast(streams.Reader, bh)).read(-1)
+        encode_seconds = time.perf_counter() - started
+
+        rebuilt = io.BytesIO()
+        started = time.perf_counter()
+        with path.open("rb") as bh:
+            w = delta.decoder(T.cast(streams.Writer, rebuilt), T.cast(streams.Reader, bh))
+            w.write(encoded)
+        decode_seconds = time.perf_counter() - started
+
+    if rebuilt.getvalue() != rom:
+        raise SystemExit("rebuilt ROM doesn't match")
+
+    print(json.dumps({
+        "rom_mib": args.rom_mib,
+        "edits": args.edits,
+        "edit_bytes": args.edit_bytes,
+        "base": str(b.descriptor.digest),
+        "delta_kib": round(len(encoded) / 1024, 1),
+        "ratio": round(len(encoded) / len(rom), 6),
+        "encode_seconds": round(encode_seconds, 3),
+        "decode_seconds": round(decode_seconds, 3),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
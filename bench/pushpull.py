@@ -0,0 +1,127 @@
+"""
+Measures end to end pushes and pulls of synthetic seeds against the in-memory
+registry in registry.py, and prints the results as JSON so runs from
+different commits can be compared.
+
+    PYTHONPATH=src python bench/pushpull.py --rom-mib 1 8 32 --jobs 4 > results.json
+
+Each push and pull runs through linkspocket.main in a forked child, so peak
+RSS is that one operation's. The registry stays in this process and counts
+the requests each operation made. The blob cache is disabled and every run
+gets its own cache directory, so nothing carries over between runs.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import pathlib
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import typing as T
+
+import registry
+import seeds
+
+import linkspocket
+from linkspocket import cli
+
+
+def _child(argv: T.List[str], cache: str, results: multiprocessing.Queue) -> None:
+    os.environ["XDG_CACHE_HOME"] = cache
+    started = time.perf_counter()
+    code = linkspocket.main(cli.parser().parse_args(argv))
+    elapsed = time.perf_counter() - started
+    # KiB on Linux
+    results.put((code, elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+
+def _run(reg: registry.Registry, argv: T.List[str], cache: str) -> T.Dict[str, T.Any]:
+    ctx = multiprocessing.get_context("fork")
+    results = ctx.Queue()
+
+    reg.reset_counts()
+    p = ctx.Process(target=_child, args=(argv, cache, results))
+    p.start()
+    code, elapsed, rss = results.get()
+    p.join()
+
+    if code != 0:
+        raise SystemExit(f"linkspocket {' '.join(argv)} exited {code}")
+
+    return {"seconds": elapsed, "peak_rss_mib": rss, "requests": reg.requests()}
+
+
+def _commit() -> T.Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser("pushpull")
+    parser.add_argument("--rom-mib", type=int, nargs="+", default=[1, 8, 32],
+                        help="ROM sizes to measure, one seed each")
+    parser.add_argument("--jobs", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Runs of each operation, the fastest is reported")
+    parser.add_argument("--push-args", default="",
+                        help="Extra arguments for push, e.g. '-z gzip'")
+    args = parser.parse_args()
+
+    reg = registry.Registry()
+    results = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for mib in args.rom_mib:
+            seeddir = seeds.seed(pathlib.Path(tmp, f"seed-{mib}"), f"ROM{mib}MIB", mib * 1024 * 1024)
+            size = sum(f.stat().st_size for f in seeddir.iterdir())
+            ref = f"{reg.address}/bench:rom-{mib}"
+
+            for op in ("push", "pull"):
+                runs = []
+                for i in range(args.repeat):
+                    # a fresh repository each time, a push that finds its blobs
+                    # already there measures nothing
+                    run_ref = f"{reg.address}/bench-{op}-{mib}-{i}:rom-{mib}" if op == "push" else ref
+                    argv = ["-H", "-Q", "-R", run_ref]
+                    if op == "push":
+                        argv += ["push", "-d", str(seeddir), "-j", str(args.jobs), *args.push_args.split()]
+                    else:
+                        argv += ["pull", "-C", "-o", str(pathlib.Path(tmp, "out")), "-j", str(args.jobs), "--cache-size", "0"]
+                    runs.append(_run(reg, argv, str(pathlib.Path(tmp, f"cache-{op}-{mib}-{i}"))))
+
+                if op == "push":
+                    # pulls read what the first push left behind
+                    _run(reg, ["-H", "-Q", "-R", ref, "push", "-d", str(seeddir), *args.push_args.split()], str(pathlib.Path(tmp, "cache")))
+
+                best = min(runs, key=lambda r: r["seconds"])
+                results.append({
+                    "op": op,
+                    "rom_mib": mib,
+                    "seed_bytes": size,
+                    "seconds": best["seconds"],
+                    "mib_per_s": size / 1024 / 1024 / best["seconds"],
+                    "peak_rss_mib": max(r["peak_rss_mib"] for r in runs),
+                    "requests": best["requests"],
+                })
+
+    reg.close()
+    json.dump({
+        "commit": _commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "jobs": args.jobs,
+        "push_args": args.push_args,
+        "results": results,
+    }, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
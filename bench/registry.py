@@ -0,0 +1,228 @@
+"""
+A stand-in OCI distribution registry that keeps everything in memory. It
+covers what linkspocket uses: blob uploads (monolithic, chunked, mounts and
+upload status), blob GET/HEAD with ranges, manifest PUT/GET/HEAD and tag
+listing. Every request is counted by method.
+"""
+
+import collections
+import hashlib
+import http.server
+import json
+import re
+import threading
+import typing as T
+import urllib.parse as urlparse
+import uuid
+
+from linkspocket.oci import json as ocijson
+
+
+class _state:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.blobs: T.Dict[str, bytes] = {}
+        # (repository, digest), blobs are only visible in repositories they were pushed to
+        self.linked: T.Set[T.Tuple[str, str]] = set()
+        self.uploads: T.Dict[str, bytearray] = {}
+        self.manifests: T.Dict[T.Tuple[str, str], bytes] = {}
+        self.tags: T.Dict[str, T.Set[str]] = collections.defaultdict(set)
+        self.requests: T.Counter[str] = collections.Counter()
+
+
+class _handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state: _state
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self._route("GET")
+
+    def do_HEAD(self):
+        self._route("HEAD")
+
+    def do_POST(self):
+        self._route("POST")
+
+    def do_PUT(self):
+        self._route("PUT")
+
+    def do_PATCH(self):
+        self._route("PATCH")
+
+    def do_DELETE(self):
+        self._route("DELETE")
+
+    def _body(self) -> bytes:
+        n = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(n) if n else b""
+
+    def _send(self, code: int, headers: T.Optional[T.Dict[str, str]] = None, body: bytes = b"") -> None:
+        self.send_response(code)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        if "Content-Length" not in (headers or {}):
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body and self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _url(self, path: str) -> str:
+        return f"http://{self.headers['Host']}{path}"
+
+    def _route(self, method: str) -> None:
+        u = urlparse.urlparse(self.path)
+        query = urlparse.parse_qs(u.query)
+        body = self._body() if method in ("POST", "PUT", "PATCH") else b""
+
+        with self.state.lock:
+            self.state.requests[method] += 1
+
+        if m := re.fullmatch(r"/v2/(.+)/blobs/uploads/?", u.path):
+            return self._start_upload(m.group(1), query, body)
+        if m := re.fullmatch(r"/v2/(.+)/blobs/uploads/([^/]+)", u.path):
+            return self._upload(method, m.group(1), m.group(2), query, body)
+        if m := re.fullmatch(r"/v2/(.+)/blobs/([^/]+)", u.path):
+            return self._blob(m.group(1), m.group(2))
+        if m := re.fullmatch(r"/v2/(.+)/manifests/([^/]+)", u.path):
+            return self._manifest(method, m.group(1), m.group(2), body)
+        if m := re.fullmatch(r"/v2/(.+)/tags/list", u.path):
+            return self._tags(m.group(1), query)
+        if u.path in ("/v2", "/v2/"):
+            return self._send(200)
+        return self._send(404)
+
+    def _start_upload(self, repo: str, query: T.Dict[str, T.List[str]], body: bytes) -> None:
+        s = self.state
+
+        if "mount" in query:
+            digest = query["mount"][0]
+            if (query.get("from", [""])[0], digest) in s.linked:
+                s.linked.add((repo, digest))
+                return self._send(201, {"Location": self._url(f"/v2/{repo}/blobs/{digest}")})
+
+        if "digest" in query:
+            return self._commit(repo, query["digest"][0], body)
+
+        uid = uuid.uuid4().hex
+        s.uploads[uid] = bytearray()
+        return self._send(202, {"Location": self._url(f"/v2/{repo}/blobs/uploads/{uid}"), "Range": "0-0"})
+
+    def _upload(self, method: str, repo: str, uid: str, query: T.Dict[str, T.List[str]], body: bytes) -> None:
+        if (buf := self.state.uploads.get(uid)) is None:
+            return self._send(404)
+
+        location = self._url(f"/v2/{repo}/blobs/uploads/{uid}")
+
+        if method == "PATCH":
+            if (cr := self.headers.get("Content-Range")) and int(cr.split("-")[0]) != len(buf):
+                return self._send(416, {"Location": location, "Range": f"0-{max(len(buf) - 1, 0)}"})
+            buf += body
+            return self._send(202, {"Location": location, "Range": f"0-{max(len(buf) - 1, 0)}"})
+
+        if method == "GET":
+            return self._send(204, {"Location": location, "Range": f"0-{max(len(buf) - 1, 0)}"})
+
+        if method == "DELETE":
+            del self.state.uploads[uid]
+            return self._send(204)
+
+        if method == "PUT":
+            buf += body
+            del self.state.uploads[uid]
+            return self._commit(repo, query["digest"][0], bytes(buf))
+
+        return self._send(405)
+
+    def _commit(self, repo: str, digest: str, content: bytes) -> None:
+        if f"sha256:{hashlib.sha256(content).hexdigest()}" != digest:
+            return self._send(400, body=b"digest mismatch")
+
+        self.state.blobs[digest] = content
+        self.state.linked.add((repo, digest))
+        return self._send(201, {"Location": self._url(f"/v2/{repo}/blobs/{digest}"), "Docker-Content-Digest": digest})
+
+    def _blob(self, repo: str, digest: str) -> None:
+        if (repo, digest) not in self.state.linked:
+            return self._send(404)
+
+        content = self.state.blobs[digest]
+        if (rng := self.headers.get("Range")) and self.command == "GET":
+            start = int(rng.partition("=")[2].partition("-")[0])
+            return self._send(206, {
+                "Content-Range": f"bytes {start}-{len(content) - 1}/{len(content)}",
+                "Docker-Content-Digest": digest,
+            }, content[start:])
+
+        return self._send(200, {"Docker-Content-Digest": digest, "Content-Length": str(len(content))}, content)
+
+    def _manifest(self, method: str, repo: str, ref: str, body: bytes) -> None:
+        s = self.state
+
+        if method == "PUT":
+            digest = f"sha256:{hashlib.sha256(body).hexdigest()}"
+            s.manifests[(repo, digest)] = body
+            if not ref.startswith("sha256:"):
+                s.manifests[(repo, ref)] = body
+                s.tags[repo].add(ref)
+            return self._send(201, {"Location": self._url(f"/v2/{repo}/manifests/{digest}"), "Docker-Content-Digest": digest})
+
+        if (content := s.manifests.get((repo, ref))) is None:
+            return self._send(404)
+
+        digest = f"sha256:{hashlib.sha256(content).hexdigest()}"
+        etag = f'"{digest}"'
+        if self.headers.get("If-None-Match") == etag:
+            return self._send(304, {"ETag": etag, "Docker-Content-Digest": digest})
+
+        return self._send(200, {
+            "Content-Type": ocijson.MANIFEST_TYPE,
+            "Docker-Content-Digest": digest,
+            "ETag": etag,
+            "Content-Length": str(len(content)),
+        }, content)
+
+    def _tags(self, repo: str, query: T.Dict[str, T.List[str]]) -> None:
+        tags = sorted(self.state.tags.get(repo, ()))
+        if (last := query.get("last", [None])[0]) is not None:
+            tags = [t for t in tags if t > last]
+
+        n = int(query.get("n", ["100"])[0])
+        page, headers = tags[:n], {"Content-Type": "application/json"}
+        if len(tags) > n:
+            headers["Link"] = f'</v2/{repo}/tags/list?n={n}&last={page[-1]}>; rel="next"'
+
+        return self._send(200, headers, json.dumps({"name": repo, "tags": page}).encode())
+
+
+class Registry:
+    """
+    Serves on a free port on localhost from a background thread until closed
+    """
+
+    def __init__(self):
+        self._state = _state()
+        handler = type("handler", (_handler,), {"state": self._state})
+        self._server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    @property
+    def address(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"{host}:{port}"
+
+    def requests(self) -> T.Dict[str, int]:
+        with self._state.lock:
+            return dict(self._state.requests)
+
+    def reset_counts(self) -> None:
+        with self._state.lock:
+            self._state.requests.clear()
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
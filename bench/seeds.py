@@ -0,0 +1,41 @@
+"""
+Writes seed directories shaped like the randomizer's output, the files are
+named OoT_<settings>_<seed>[_<kind>] so zootrlib.artifacts picks them up.
+"""
+
+import json
+import os
+import pathlib
+import random
+
+
+def seed(d: pathlib.Path, name: str, rom_bytes: int, settings: str = "BENCH") -> pathlib.Path:
+    """
+    The ROM is random so it can't be deduplicated or compressed, the spoiler
+    log is repetitive JSON like the real thing.
+    """
+    d.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(name)
+    hash = [rng.choice(["Big", "Magic Beans", "Saw", "Longshot", "Bow", "Compass", "Map"]) for _ in range(5)]
+
+    prefix = f"OoT_{settings}_{name}"
+    d.joinpath(f"{prefix}_Settings.json").write_text(json.dumps({
+        ":version": "8.2",
+        ":seed": name,
+        ":settings_string": settings,
+        ":enable_distribution_file": False,
+        "file_hash": hash,
+    }))
+    d.joinpath(f"{prefix}_Spoiler.json").write_text(json.dumps({
+        "locations": {f"Location {i}": rng.choice(["Bombs (5)", "Rupees (20)", "Heart Piece"]) for i in range(5000)},
+        ":seed": name,
+    }))
+    d.joinpath(f"{prefix}_Cosmetics.json").write_text(json.dumps({"seed": name}))
+
+    with d.joinpath(f"{prefix}.z64").open("wb") as fh:
+        left = rom_bytes
+        while left > 0:
+            fh.write(os.urandom(min(left, 1024 * 1024)))
+            left -= 1024 * 1024
+
+    return d
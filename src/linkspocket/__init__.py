@@ -1,30 +1,71 @@
 import argparse
 import dataclasses as dc
+import pathlib
 import typing as T
-import urllib.request
 
 from .errors import *
-from . import console as C, cli, commands
-from .httplib import handlers
+from . import console as C, cli, commands, compression, delta, paths, progress, seedindex
+from .httplib import pool, trace
 from .oci import http as ocihttp
-from .oci.core import blob, manifest, reference
+from .oci.core import blob, cache, manifest, reference
 from .oci.core.registry import Registry
 
 
 def main(args: argparse.Namespace) -> int:
     std = C.newstd()
+    tracefile = None
+    conns = None
+    cmd = None
     try:
-        cmd = createargs(args, std)
+        tracefile = _opentrace(args.trace)
+        conns = pool.Pool(args.max_connections, trace.Tracer(tracefile) if tracefile is not None else None)
+        cmd = createargs(args, std, conns)
 
         if isinstance(cmd, cli.PullCtx):
             return commands.pull(cmd)
         elif isinstance(cmd, cli.PushCtx):
             return commands.push(cmd)
+        elif isinstance(cmd, cli.ServeCtx):
+            return commands.serve(cmd)
+        elif isinstance(cmd, cli.ExportCtx):
+            return commands.export(cmd)
+        elif isinstance(cmd, cli.ImportCtx):
+            return commands.import_(cmd)
+        elif isinstance(cmd, cli.IndexCtx):
+            return commands.index(cmd)
+        elif isinstance(cmd, cli.QueryCtx):
+            return commands.query(cmd)
+        elif isinstance(cmd, cli.InspectCtx):
+            return commands.inspect(cmd)
 
         return 1
     except PocketError as e:
         std.err.write(str(e))
         return 2
+    finally:
+        progress.close()
+        if conns is not None:
+            conns.close()
+        if tracefile is not None:
+            tracefile.close()
+        if args.stats and conns is not None:
+            print(conns.stats, file=std.err)
+            if isinstance(cmd, cli.PullCtx) and cmd.cache is not None:
+                print(cmd.cache.stats, file=std.err)
+
+
+class BadTraceFile(PocketError):
+    def __init__(self, path: pathlib.Path, reason: str):
+        super().__init__(f"Could not open {path} to trace requests to: {reason}")
+
+
+def _opentrace(path: T.Optional[pathlib.Path]) -> T.Optional[T.TextIO]:
+    if path is None:
+        return None
+    try:
+        return path.open("w")
+    except OSError as e:
+        raise BadTraceFile(path, e.strerror or str(e))
 
 
 class BadReference(PocketError):
@@ -34,49 +75,184 @@ class BadReference(PocketError):
 
 class UnknownCommand(PocketError):
     def __init__(self):
-        super().__init__("Subcommand must be 'pull' or 'push'")
+        super().__init__("Subcommand must be 'pull', 'push', 'serve', 'export', 'import', 'index', 'query' or 'inspect'")
 
 
-def registry(registry: str, proto: str) -> Registry:
-    opener = urllib.request.build_opener(handlers.DontThrowExceptions())
+def registry(
+    registry: str,
+    proto: str,
+    opener: T.Optional[pool.Opener] = None,
+    upload: ocihttp.UploadStrategy = ocihttp.UploadStrategy.Auto,
+    blobcache: T.Optional[cache.BlobCache] = None,
+    manifestcache: T.Optional[cache.ManifestCache] = None,
+    mount_from: T.Sequence[str] = (),
+) -> Registry:
+    if opener is None:
+        opener = pool.Pool()
+
+    puller: blob.Puller = ocihttp.BlobPuller(registry, opener, proto)
+    if blobcache is not None:
+        puller = cache.CachingPuller(puller, blobcache)
+
     blobs = blob.PullPusher(
-        ocihttp.BlobPuller(registry, opener, proto),
-        ocihttp.BlobPusher(registry, opener, proto),
+        puller,
+        ocihttp.BlobPusher(
+            registry,
+            opener,
+            proto,
+            upload,
+            ocihttp.FileSessions(paths.cache_dir().joinpath("uploads.json")),
+        ),
+        mount_from,
     )
 
     manifests = manifest.PullPusher(
-        ocihttp.ManifestPuller(registry, opener, proto),
+        ocihttp.ManifestPuller(registry, opener, proto, manifestcache),
         ocihttp.ManifestPusher(registry, opener, proto),
     )
 
-    return Registry(manifests, blobs)
+    return Registry(manifests, blobs, ocihttp.TagLister(registry, opener, proto))
+
+
+class BadAddress(PocketError):
+    def __init__(self, address: str):
+        super().__init__(f"Invalid address to listen on: {address}")
 
 
-Args = T.Union[cli.PullCtx, cli.PushCtx]
+Args = T.Union[cli.PullCtx, cli.PushCtx, cli.ServeCtx, cli.ExportCtx, cli.ImportCtx, cli.IndexCtx, cli.QueryCtx, cli.InspectCtx]
 
 
-def createargs(args: argparse.Namespace, std: C.Std) -> Args | None:
+def createargs(args: argparse.Namespace, std: C.Std, opener: pool.Opener) -> Args | None:
     if (ref := reference.parse(args.ref)) is None:
         raise BadReference(args.ref)
 
     proto = "https" if not args.insecure_http else "http"
+    manifestcache = cache.ManifestCache(paths.cache_dir().joinpath("manifests"))
 
-    if hasattr(args, "src"):
+    if hasattr(args, "inspect"):
+        return cli.InspectCtx(
+            ref=ref,
+            quiet=args.quiet,
+            registry=registry(ref.registry, proto, opener, manifestcache=manifestcache),
+            std=std,
+            tags=args.tags,
+            jobs=args.jobs,
+            as_json=args.as_json,
+            manifests=ocihttp.ManifestPuller(ref.registry, opener, proto, manifestcache),
+        )
+    elif hasattr(args, "recheck"):
+        return cli.IndexCtx(
+            ref=ref,
+            quiet=args.quiet,
+            registry=registry(ref.registry, proto, opener),
+            std=std,
+            db=args.db or paths.cache_dir().joinpath("index.sqlite"),
+            jobs=args.jobs,
+            recheck=args.recheck,
+            manifests=ocihttp.ManifestPuller(ref.registry, opener, proto, manifestcache),
+        )
+    elif hasattr(args, "sort"):
+        return cli.QueryCtx(
+            ref=ref,
+            quiet=args.quiet,
+            registry=registry(ref.registry, proto, opener),
+            std=std,
+            db=args.db or paths.cache_dir().joinpath("index.sqlite"),
+            query=seedindex.Query(
+                tags=args.tags,
+                versions=args.versions,
+                settings=args.settings,
+                seeds=args.seeds,
+                spoiler=args.spoiler,
+                sort=args.sort,
+                reverse=args.reverse,
+                limit=args.limit,
+            ),
+            as_json=args.as_json,
+        )
+    elif hasattr(args, "import_from"):
+        return cli.ImportCtx(
+            ref=ref,
+            quiet=args.quiet,
+            registry=registry(ref.registry, proto, opener),
+            std=std,
+            layout=args.import_from,
+            tags=args.tags,
+            jobs=args.jobs,
+            manifests=ocihttp.ManifestPusher(ref.registry, opener, proto),
+        )
+    elif hasattr(args, "export_to"):
+        return cli.ExportCtx(
+            ref=ref,
+            # the tar is what goes to stdout, nothing else can
+            quiet=args.quiet or args.export_to == "-",
+            registry=registry(ref.registry, proto, opener, manifestcache=manifestcache),
+            std=std,
+            out=args.export_to,
+            tags=args.tags,
+            jobs=args.jobs,
+            manifests=ocihttp.ManifestPuller(ref.registry, opener, proto, manifestcache),
+        )
+    elif hasattr(args, "src"):
         return cli.PushCtx(
             ref=ref,
             quiet=args.quiet,
-            registry=registry(ref.registry, proto),
+            registry=registry(
+                ref.registry,
+                proto,
+                opener,
+                ocihttp.UploadStrategy(args.upload),
+                manifestcache=manifestcache,
+                mount_from=args.mount_from,
+            ),
             std=std,
             src=args.src,
             autotag=args.autotag,
+            batch=args.batch,
+            single_pass=args.single_pass,
+            jobs=args.jobs,
+            compress=compression.parse(args.compress),
+            delta_base=delta.Base.from_path(args.delta_base) if args.delta_base else None,
         )
     elif hasattr(args, "out"):
+        blobcache = None
+        if args.cache_size > 0:
+            blobcache = cache.BlobCache(
+                paths.cache_dir().joinpath("blobs"), args.cache_size * 1024 * 1024)
+
         return cli.PullCtx(
             ref=ref,
             quiet=args.quiet,
-            registry=registry(ref.registry, proto),
+            registry=registry(
+                ref.registry,
+                proto,
+                opener,
+                blobcache=blobcache,
+                manifestcache=manifestcache,
+            ),
             std=std,
             out=args.out,
             clean=args.clean,
+            jobs=args.jobs,
+            cache=blobcache,
+            tags=args.tags,
+        )
+    elif hasattr(args, "listen"):
+        host, _, port = args.listen.rpartition(":")
+        if not port.isdigit():
+            raise BadAddress(args.listen)
+
+        store = args.store or paths.cache_dir().joinpath("serve")
+        servecache = cache.ManifestCache(store.joinpath("manifests"))
+
+        return cli.ServeCtx(
+            ref=ref,
+            quiet=args.quiet,
+            registry=registry(ref.registry, proto, opener),
+            std=std,
+            listen=(host.strip("[]") or "0.0.0.0", int(port)),
+            manifests=ocihttp.ManifestPuller(ref.registry, opener, proto, servecache),
+            manifestcache=servecache,
+            blobs=cache.BlobCache(store.joinpath("blobs"), args.cache_size * 1024 * 1024),
         )
     return None
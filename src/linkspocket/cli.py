@@ -3,8 +3,9 @@ import argparse
 import pathlib
 import typing as T
 
-from . import progress, streams, console as C
-from .oci.core import reference
+from . import compression, delta, progress, seedindex, streams, console as C
+from .oci import http as ocihttp
+from .oci.core import cache, reference
 from .oci.core.registry import Registry
 
 
@@ -36,9 +37,39 @@ def parser() -> argparse.ArgumentParser:
         action="store_true",
     )
 
+    cli.add_argument(
+        "--max-connections",
+        help="Most connections kept open to the registry at once",
+        default=8,
+        type=int,
+        dest="max_connections",
+    )
+
+    cli.add_argument(
+        "--stats",
+        help="Print transfer statistics when finished",
+        default=False,
+        dest="stats",
+        action="store_true",
+    )
+
+    cli.add_argument(
+        "--trace",
+        help="Write a line of JSON per HTTP request to this file, with its timings split into phases",
+        default=None,
+        type=pathlib.Path,
+        dest="trace",
+    )
+
     commands = cli.add_subparsers()
     _pushparser(commands)
     _pullparser(commands)
+    _serveparser(commands)
+    _exportparser(commands)
+    _importparser(commands)
+    _indexparser(commands)
+    _queryparser(commands)
+    _inspectparser(commands)
     return cli
 
 
@@ -53,12 +84,22 @@ def _pushparser(parent: _addcommand):
     cmd.add_argument(
         "-d",
         "--seed-dir",
-        help="Path to directory containing zootr artifacts",
+        help="Path to directory containing zootr artifacts, may be repeated to push several seeds",
         required=True,
         type=pathlib.Path,
+        action="append",
         dest="src",
     )
 
+    cmd.add_argument(
+        "-B",
+        "--batch",
+        help="Push every seed directory found under each --seed-dir, tagging each from its seed hash",
+        default=False,
+        dest="batch",
+        action="store_true",
+    )
+
     cmd.add_argument(
         "-A",
         "--autotag",
@@ -68,6 +109,59 @@ def _pushparser(parent: _addcommand):
         action="store_true",
     )
 
+    cmd.add_argument(
+        "-S",
+        "--single-pass",
+        help="Digest files while uploading them instead of reading them twice, skips checking if layers already exist",
+        default=False,
+        dest="single_pass",
+        action="store_true",
+    )
+
+    cmd.add_argument(
+        "-U",
+        "--upload",
+        help="How blobs are uploaded, by default small blobs are sent in one request and larger ones in chunks",
+        choices=[s.value for s in ocihttp.UploadStrategy],
+        default=ocihttp.UploadStrategy.Auto.value,
+        dest="upload",
+    )
+
+    cmd.add_argument(
+        "-z",
+        "--compress",
+        help="Compress layers before pushing them, pulling decompresses them again",
+        choices=[c.value for c in compression.Compression],
+        default=None,
+        dest="compress",
+    )
+
+    cmd.add_argument(
+        "--delta-base",
+        help="Push ROMs as a delta against this base ROM, which is pushed once per repository",
+        default=None,
+        type=pathlib.Path,
+        dest="delta_base",
+    )
+
+    cmd.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of blobs to upload at once",
+        default=1,
+        type=int,
+        dest="jobs",
+    )
+
+    cmd.add_argument(
+        "-M",
+        "--mount-from",
+        help="Repository in the same registry to mount existing blobs from instead of uploading them, may be repeated",
+        default=[],
+        action="append",
+        dest="mount_from",
+    )
+
 
 def _pullparser(parent: _addcommand):
     description = "Pull a generated seed from the registry"
@@ -88,6 +182,247 @@ def _pullparser(parent: _addcommand):
         default=False,
         dest="clean",
     )
+    cmd.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of blobs to download at once",
+        default=1,
+        type=int,
+        dest="jobs",
+    )
+    cmd.add_argument(
+        "-t",
+        "--tag",
+        help="Tag, or glob matching tags, to pull into its own directory under --output instead of the tag in --ref, may be repeated",
+        default=[],
+        action="append",
+        dest="tags",
+    )
+    cmd.add_argument(
+        "--cache-size",
+        help="Most MiB of blobs kept in the local cache, 0 disables it",
+        default=2048,
+        type=int,
+        dest="cache_size",
+    )
+
+
+def _serveparser(parent: _addcommand):
+    description = "Serve the repository in --ref and those under it read only, caching what is pulled through"
+    cmd = parent.add_parser("serve", help=description, description=description)
+    cmd.add_argument(
+        "-l",
+        "--listen",
+        help="Address to listen on, host:port",
+        default="0.0.0.0:5000",
+        dest="listen",
+    )
+    cmd.add_argument(
+        "--store",
+        help="Directory blobs and manifests are kept in, defaults to the cache directory",
+        default=None,
+        type=pathlib.Path,
+        dest="store",
+    )
+    cmd.add_argument(
+        "--cache-size",
+        help="Most MiB of blobs kept in the store",
+        default=10240,
+        type=int,
+        dest="cache_size",
+    )
+
+
+def _exportparser(parent: _addcommand):
+    description = "Write seeds from the registry to an OCI image layout"
+    cmd = parent.add_parser("export", help=description, description=description)
+    cmd.add_argument(
+        "-o",
+        "--output",
+        help="Layout directory, or a .tar file, or - to write a tar to stdout",
+        required=True,
+        dest="export_to",
+        metavar="OUT",
+    )
+    cmd.add_argument(
+        "-t",
+        "--tag",
+        help="Tag, or glob matching tags, to export instead of the tag in --ref, may be repeated",
+        default=[],
+        action="append",
+        dest="tags",
+    )
+    cmd.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of blobs to download at once, tars are always written one blob at a time",
+        default=1,
+        type=int,
+        dest="jobs",
+    )
+
+
+def _importparser(parent: _addcommand):
+    description = "Push the seeds in an OCI image layout to the registry"
+    cmd = parent.add_parser("import", help=description, description=description)
+    cmd.add_argument(
+        "-i",
+        "--input",
+        help="Layout directory or .tar file",
+        required=True,
+        type=pathlib.Path,
+        dest="import_from",
+        metavar="LAYOUT",
+    )
+    cmd.add_argument(
+        "-t",
+        "--tag",
+        help="Tag, or glob matching tags, in the layout to import, by default every tagged seed is",
+        default=[],
+        action="append",
+        dest="tags",
+    )
+    cmd.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of blobs to upload at once",
+        default=1,
+        type=int,
+        dest="jobs",
+    )
+
+
+def _indexparser(parent: _addcommand):
+    description = "Record the details of every seed in the repository in a local index, only fetching tags it hasn't seen"
+    cmd = parent.add_parser("index", help=description, description=description)
+    cmd.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of tags to fetch at once",
+        default=8,
+        type=int,
+        dest="jobs",
+    )
+    cmd.add_argument(
+        "--recheck",
+        help="Ask the registry about tags already in the index too, in case they were pushed over",
+        default=False,
+        dest="recheck",
+        action="store_true",
+    )
+    _dbargument(cmd)
+
+
+def _queryparser(parent: _addcommand):
+    description = "Search the local index of the repository's seeds"
+    cmd = parent.add_parser("query", help=description, description=description)
+    cmd.add_argument(
+        "-t",
+        "--tag",
+        help="Tag, or glob matching tags, may be repeated",
+        default=[],
+        action="append",
+        dest="tags",
+    )
+    cmd.add_argument(
+        "--version",
+        help="Randomizer version, or glob matching versions, may be repeated",
+        default=[],
+        action="append",
+        dest="versions",
+    )
+    cmd.add_argument(
+        "--settings",
+        help="Settings string, or glob matching settings strings, may be repeated",
+        default=[],
+        action="append",
+        dest="settings",
+    )
+    cmd.add_argument(
+        "--seed",
+        help="Seed, or glob matching seeds, may be repeated",
+        default=[],
+        action="append",
+        dest="seeds",
+    )
+    cmd.add_argument(
+        "--spoiler",
+        help="Only seeds with, or with --no-spoiler without, a spoiler log",
+        default=None,
+        dest="spoiler",
+        action=argparse.BooleanOptionalAction,
+    )
+    cmd.add_argument(
+        "-s",
+        "--sort",
+        help="Sort by this, may be repeated to break ties, seeds are always sorted by tag last",
+        choices=list(seedindex.SORT_KEYS),
+        default=[],
+        action="append",
+        dest="sort",
+    )
+    cmd.add_argument(
+        "-r",
+        "--reverse",
+        help="Sort in descending order",
+        default=False,
+        dest="reverse",
+        action="store_true",
+    )
+    cmd.add_argument(
+        "-n",
+        "--limit",
+        help="Most seeds to list",
+        default=None,
+        type=int,
+        dest="limit",
+    )
+    cmd.add_argument(
+        "--json",
+        help="Write a line of JSON per seed, with its layers, instead of tab separated columns",
+        default=False,
+        dest="as_json",
+        action="store_true",
+    )
+    _dbargument(cmd)
+
+
+def _inspectparser(parent: _addcommand):
+    description = "Show what seeds hold without pulling them, only their manifests and configs are fetched"
+    cmd = parent.add_parser("inspect", aliases=["ls"], help=description, description=description)
+    cmd.add_argument(
+        "tags",
+        help="Tag, digest, or glob matching tags, of a seed in the repository in --ref, by default the tag or digest in --ref",
+        nargs="*",
+        metavar="TAG",
+    )
+    cmd.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of seeds to inspect at once",
+        default=8,
+        type=int,
+        dest="jobs",
+    )
+    cmd.add_argument(
+        "--json",
+        help="Write a line of JSON per seed instead of a table",
+        default=False,
+        dest="as_json",
+        action="store_true",
+    )
+    # tags is shared with other commands, this is what tells inspect apart
+    cmd.set_defaults(inspect=True)
+
+
+def _dbargument(cmd: argparse.ArgumentParser):
+    cmd.add_argument(
+        "--db",
+        help="Index database, defaults to one in the cache directory",
+        default=None,
+        type=pathlib.Path,
+        dest="db",
+    )
 
 
 class HasReference(T.Protocol):
@@ -106,14 +441,75 @@ class basectx():
             return progress.track(s, n, self.std.out)
         return s
 
+    def say(self, line: str) -> None:
+        progress.write(line, self.std.out)
+
+    def complain(self, line: str) -> None:
+        progress.write(line, self.std.out, self.std.err)
+
 
 @dc.dataclass()
 class PushCtx(basectx):
-    src: pathlib.Path
+    src: T.List[pathlib.Path]
     autotag: bool
+    batch: bool
+    single_pass: bool
+    jobs: int
+    compress: T.Optional[compression.Compression]
+    delta_base: T.Optional[delta.Base]
 
 
 @dc.dataclass()
 class PullCtx(basectx):
     out: pathlib.Path
     clean: bool
+    jobs: int
+    cache: T.Optional[cache.BlobCache]
+    tags: T.List[str]
+
+
+@dc.dataclass()
+class ServeCtx(basectx):
+    listen: T.Tuple[str, int]
+    manifests: ocihttp.ManifestPuller
+    manifestcache: cache.ManifestCache
+    blobs: cache.BlobCache
+
+
+@dc.dataclass()
+class ExportCtx(basectx):
+    out: str
+    tags: T.List[str]
+    jobs: int
+    manifests: ocihttp.ManifestPuller
+
+
+@dc.dataclass()
+class ImportCtx(basectx):
+    layout: pathlib.Path
+    tags: T.List[str]
+    jobs: int
+    manifests: ocihttp.ManifestPusher
+
+
+@dc.dataclass()
+class IndexCtx(basectx):
+    db: pathlib.Path
+    jobs: int
+    recheck: bool
+    manifests: ocihttp.ManifestPuller
+
+
+@dc.dataclass()
+class QueryCtx(basectx):
+    db: pathlib.Path
+    query: seedindex.Query
+    as_json: bool
+
+
+@dc.dataclass()
+class InspectCtx(basectx):
+    tags: T.List[str]
+    jobs: int
+    as_json: bool
+    manifests: ocihttp.ManifestPuller
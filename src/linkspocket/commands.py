@@ -1,14 +1,27 @@
 import contextlib
+import ctypes
+import dataclasses as dc
+import errno
+import fnmatch
+import functools
+import hashlib
+import http.client as http
+import io
 import json
+import os
 import pathlib
 import shutil
+import signal
+import time
 import typing as T
 
 from linkspocket.oci.core.reference import Reference
+from linkspocket.zootrlib.artifacts import FileKind, ZootrFile, zootr_files_from_dir
 from linkspocket.zootrlib.manifest import ZootrManifest, zootr_manifest_from_dir
 
-from . import streams, cli, media, oci
-from .oci.core import descriptor, manifest
+from . import streams, cli, compression, delta, media, oci, parallel, progress, proxy, seedindex
+from .oci import json as ocijson, layout
+from .oci.core import cache, descriptor, manifest
 from .zootrlib import seeddetails
 from .errors import PocketError
 
@@ -18,7 +31,26 @@ class UnknownManifest(PocketError):
         super().__init__(f"Could not find manifest for {ref}")
 
 
+class IncompleteLayer(PocketError):
+    def __init__(self, dest: pathlib.Path, got: int, want: int):
+        super().__init__(
+            f"Only received {got} of {want} bytes for {dest.name}, rerun pull to resume")
+
+
+class CorruptLayer(PocketError):
+    def __init__(self, dest: pathlib.Path, reason: str):
+        super().__init__(f"Discarded {dest.name}, {reason}")
+
+
+class UnreadableConfig(PocketError):
+    def __init__(self, digest: descriptor.Digest, reason: str):
+        super().__init__(f"Could not read seed details from {digest}, {reason}")
+
+
 def pull(ctx: cli.PullCtx) -> int:
+    if ctx.tags:
+        return _pull_many(ctx)
+
     tag = ctx.ref.tag
     if not tag:
         if ctx.ref.digest:
@@ -28,98 +60,924 @@ def pull(ctx: cli.PullCtx) -> int:
                   file=ctx.std.err)
             return 4
 
+    _pull_tag(ctx, tag)
+    return 0
+
+
+def _pull_many(ctx: cli.PullCtx) -> int:
+    """
+    Pulls every tag named by --tag into its own directory, globs are matched
+    against the repository's tags as they are listed. A tag that fails is
+    reported and the rest are still pulled.
+    """
+    pulled, failed = 0, 0
+
+    for tag in _matching_tags(ctx):
+        if not ctx.quiet:
+            ctx.say(f"Pulling {dc.replace(ctx.ref, tag=tag, digest=None)}")
+
+        try:
+            _pull_tag(ctx, tag)
+        except (PocketError, OSError, http.HTTPException) as e:
+            ctx.complain(f"Failed to pull {tag}: {e}")
+            failed += 1
+            continue
+
+        pulled += 1
+
+    if not ctx.quiet:
+        ctx.say(f"Pulled {pulled} seeds")
+
+    if failed:
+        ctx.complain(f"{failed} seeds failed to pull")
+        return 5
+
+    return 0
+
+
+def _matching_tags(ctx: T.Union[cli.PullCtx, cli.ExportCtx, cli.InspectCtx]) -> T.Iterator[str]:
+    exact = [t for t in ctx.tags if not _is_glob(t)]
+    globs = [t for t in ctx.tags if _is_glob(t)]
+
+    yield from dict.fromkeys(exact)
+
+    # only list the repository when there's something to match against
+    if globs:
+        for tag in ctx.registry.tags.list_tags(ctx.ref.repository):
+            if tag not in exact and any(fnmatch.fnmatchcase(tag, g) for g in globs):
+                yield tag
+
+
+def _is_glob(tag: str) -> bool:
+    return any(c in tag for c in "*?[")
+
+
+def _pull_tag(ctx: cli.PullCtx, tag: str) -> None:
+    manifests = ctx.registry.manifests
+    if (manifest := manifests.pull_manifest(ctx.ref.repository, tag)) is None:
+        raise UnknownManifest(dc.replace(ctx.ref, tag=tag))
+
     seeddir = ctx.out.joinpath(tag)
     if ctx.clean:
         shutil.rmtree(seeddir, ignore_errors=True)
-    seeddir.mkdir(parents=True)
+    seeddir.mkdir(parents=True, exist_ok=True)
 
-    ref, manifests, blobs = ctx.ref, ctx.registry.manifests, ctx.registry.blobs
-    if (manifest := manifests.pull_manifest(ctx.ref.repository, tag)) is None:
-        raise UnknownManifest(ctx.ref)
+    # delta layers are rebuilt against these once they've been pulled, each
+    # is pulled once however many times the manifest lists it
+    base_layers = {str(layer.digest): layer
+                   for layer in manifest.layers if layer.content_type == delta.BASE_TYPE}
+    bases = {digest: seeddir.joinpath(f".{layer.digest.hexhash()}.base")
+             for digest, layer in base_layers.items()}
 
-    _download_layer(ctx,  manifest.config,  blobs.pull_blob(
-        ref.repository, manifest.config.digest), seeddir.joinpath(".seeddetails"))
+    tasks = [functools.partial(_pull_layer, ctx, layer, bases[digest])
+             for digest, layer in base_layers.items()]
+    tasks.append(functools.partial(_pull_layer, ctx, manifest.config,
+                                   seeddir.joinpath(".seeddetails")))
 
     for layer in manifest.layers:
+        if layer.content_type == delta.BASE_TYPE:
+            continue
+
         if (filename := layer.annotations.get(oci.FILENAME_ANNOTATION, None)) is None:
             ctx.std.err.write(
                 f"{layer} does not have filename attached, skipping\n")
             continue
 
-        _download_layer(ctx, layer, blobs.pull_blob(
-            ref.repository, layer.digest), seeddir.joinpath(filename))
+        if delta.is_delta(layer):
+            if (base := bases.get(layer.annotations[delta.BASE_ANNOTATION])) is None:
+                raise CorruptLayer(seeddir.joinpath(filename), "its base isn't in the manifest")
+            tasks.append(functools.partial(
+                _pull_delta, ctx, layer, seeddir.joinpath(filename), base))
+            continue
 
-    return 0
+        tasks.append(functools.partial(
+            _pull_layer, ctx, layer, seeddir.joinpath(filename)))
+
+    try:
+        # bases are pulled before anything can be rebuilt against them
+        parallel.collect(ctx.jobs, tasks[:len(bases)])
+        parallel.collect(ctx.jobs, tasks[len(bases):])
+    finally:
+        for base in bases.values():
+            base.unlink(missing_ok=True)
+
+
+# how many times a layer is requested again after the connection drops
+_PULL_ATTEMPTS = 3
+
+
+def _pull_layer(ctx: cli.PullCtx, descriptor: descriptor.Descriptor, dest: pathlib.Path, cancel: parallel.Cancel):
+    """
+    Downloads into a partial file next to dest, picking up where an earlier
+    attempt, or an earlier pull, left off. The layer is digested as it is
+    written and the file is only moved to dest once it has exactly the bytes
+    the descriptor names. When what an earlier pull left doesn't check out,
+    the layer is downloaded again from the start, once.
+    """
+    partial = dest.with_name(f"{dest.name}.part")
+    packed = compression.parse(media.compression(descriptor.content_type))
+
+    if ctx.cache is not None and _from_cache(ctx.cache, descriptor, dest, packed):
+        partial.unlink(missing_ok=True)
+        return
+
+    partial.touch(exist_ok=True)
+    resumed = partial.stat().st_size > 0
+
+    if (digest := _download_partial(ctx, descriptor, dest, partial)) != descriptor.digest and resumed:
+        # what an earlier run left may be what's wrong, one more go without it
+        partial.write_bytes(b"")
+        digest = _download_partial(ctx, descriptor, dest, partial)
+
+    if digest != descriptor.digest:
+        partial.unlink()
+        raise CorruptLayer(dest, f"digest is {digest}, expected {descriptor.digest}")
+
+    if packed is None:
+        partial.replace(dest)
+        return
+
+    # the partial file holds what the digest covers so that a pull can be
+    # resumed, it's only unpacked once it has been checked
+    with partial.open("rb") as fh:
+        _unpack(packed, fh, dest)
+    partial.unlink()
+
+
+def _download_partial(ctx: cli.PullCtx, descriptor: descriptor.Descriptor, dest: pathlib.Path, partial: pathlib.Path) -> descriptor.Digest:
+    """
+    Fills partial up to the layer's size, starting after whatever it already
+    holds, and returns the digest of all of it.
+    """
+    digester, hashed = _layer_digester(descriptor), streams.Sizer()
+
+    for attempt in range(_PULL_ATTEMPTS):
+        if (offset := partial.stat().st_size) > descriptor.bytes:
+            partial.write_bytes(b"")
+            offset = 0
+
+        if offset != hashed.written:
+            # left over from an earlier pull, only that much is read back
+            digester, hashed = _layer_digester(descriptor), streams.Sizer()
+            with partial.open("rb") as fh:
+                shutil.copyfileobj(fh, streams.TeeWriter(digester, hashed))
 
+        if offset == descriptor.bytes:
+            break
 
-def _download_layer(ctx: cli.PullCtx, descriptor: descriptor.Descriptor,  layer: streams.MustCloseReader, dest: pathlib.Path):
-    with contextlib.closing(layer) as lh, dest.open(mode='wb') as fh:
-        tracked = ctx.track(streams.name(str(dest.name), lh), descriptor.bytes)
-        shutil.copyfileobj(tracked, fh)
+        try:
+            layer = ctx.registry.blobs.pull_blob(
+                ctx.ref.repository, descriptor.digest, offset)
+            _download_layer(ctx, descriptor, layer, partial, offset,
+                            streams.TeeWriter(digester, hashed))
+        except (OSError, http.HTTPException):
+            if attempt == _PULL_ATTEMPTS - 1:
+                raise
+
+        if (got := partial.stat().st_size) > descriptor.bytes:
+            partial.unlink()
+            raise CorruptLayer(
+                dest, f"received {got} bytes, expected {descriptor.bytes}")
+
+    if (got := partial.stat().st_size) != descriptor.bytes:
+        raise IncompleteLayer(dest, got, descriptor.bytes)
+
+    return digester.digest()
+
+
+def _pull_delta(ctx: cli.PullCtx, layer: descriptor.Descriptor, dest: pathlib.Path, base: pathlib.Path, cancel: parallel.Cancel):
+    """
+    Pulls a ROM's delta like any other layer, then rebuilds the ROM from it
+    and its base. The ROM is only moved to dest once it matches the digest
+    recorded when the delta was made.
+    """
+    encoded = dest.with_name(f"{dest.name}.delta")
+    _pull_layer(ctx, layer, encoded, cancel)
+
+    rebuilding = dest.with_name(f"{dest.name}.rebuild")
+    digester, sizer = _layer_digester(layer), streams.Sizer()
+
+    with encoded.open("rb") as src, base.open("rb") as bh, rebuilding.open("wb") as fh:
+        shutil.copyfileobj(src, delta.decoder(
+            streams.TeeWriter(fh, streams.TeeWriter(digester, sizer)), T.cast(streams.Reader, bh)))
+
+    want_digest = layer.annotations.get(delta.DIGEST_ANNOTATION)
+    want_size = layer.annotations.get(delta.SIZE_ANNOTATION)
+
+    if str(digester.digest()) != want_digest or str(sizer.written) != want_size:
+        rebuilding.unlink()
+        raise CorruptLayer(dest, f"rebuilt ROM is {digester.digest()}, expected {want_digest}")
+
+    rebuilding.replace(dest)
+    encoded.unlink()
+
+
+def _from_cache(blobs: cache.BlobCache, descriptor: descriptor.Descriptor, dest: pathlib.Path, packed: T.Optional[compression.Compression]) -> bool:
+    if packed is None:
+        return blobs.materialize(descriptor.digest, dest)
+
+    if (fh := blobs.open(descriptor.digest)) is None:
+        return False
+
+    with fh:
+        _unpack(packed, fh, dest)
+    return True
+
+
+def _unpack(packed: compression.Compression, src: T.BinaryIO, dest: pathlib.Path) -> None:
+    unpacking = dest.with_name(f"{dest.name}.unpack")
+    with unpacking.open("wb") as fh:
+        shutil.copyfileobj(src, compression.DecompressingWriter(
+            fh, compression.decompressor(packed)))
+    unpacking.replace(dest)
+
+
+def _layer_digester(d: descriptor.Descriptor) -> descriptor.DigestStream:
+    return descriptor.DigestStream(hashlib.new(d.digest.algo))
+
+
+# layers are read into these and written out from them, one per download
+_buffers = streams.BufferPool(1024 * 1024)
+
+
+def _download_layer(ctx: cli.PullCtx, descriptor: descriptor.Descriptor,  layer: streams.MustCloseReader, dest: pathlib.Path, offset: int, verify: streams.Writer):
+    """
+    Appends the layer to dest at offset. The blocks for the rest of it are
+    reserved up front, and if the download stops early whatever was reserved
+    past what was received is given back.
+    """
+    with contextlib.closing(layer) as lh, dest.open(mode="r+b") as fh, _buffers.buffer() as buf:
+        _preallocate(fh, offset, descriptor.bytes - offset)
+        fh.seek(offset)
+
+        tracked = ctx.track(streams.name(str(dest.name), lh), descriptor.bytes - offset)
+        try:
+            while n := streams.readinto(tracked, buf):
+                fh.write(buf[:n])
+                verify.write(buf[:n])
+        finally:
+            fh.truncate(fh.tell())
+
+
+# linux/falloc.h, allocates blocks without changing the file's size
+_FALLOC_FL_KEEP_SIZE = 0x01
+
+
+def _preallocate(fh: T.BinaryIO, offset: int, n: int) -> None:
+    """
+    The file's size has to stay what was received, a pull killed before it
+    could truncate would otherwise leave a partial file that looks complete
+    and the next one would throw it away rather than resume it. So unlike
+    posix_fallocate this never grows the file, and where the blocks can't be
+    reserved that way they aren't reserved at all.
+    """
+    if n <= 0 or (fallocate := _fallocate()) is None:
+        return
+
+    if fallocate(fh.fileno(), _FALLOC_FL_KEEP_SIZE, offset, n) != 0:
+        if (err := ctypes.get_errno()) not in (errno.EOPNOTSUPP, errno.EINVAL, errno.ENOSYS):
+            raise OSError(err, os.strerror(err))
+
+
+@functools.cache
+def _fallocate() -> T.Optional[T.Callable[[int, int, int, int], int]]:
+    # only Linux has it, fallocate64 takes a 64 bit offset on 32 bit systems too
+    for name in ("fallocate64", "fallocate"):
+        try:
+            f = getattr(ctypes.CDLL(None, use_errno=True), name)
+        except (OSError, AttributeError, TypeError):
+            continue
+
+        f.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+        f.restype = ctypes.c_int
+        return f
+    return None
 
 
 def push(args: cli.PushCtx) -> int:
-    if not args.src.exists():
-        print(f"{args.src} does not exist", file=args.std.err)
-        return 2
+    seeds = []
 
-    if not args.src.is_dir():
-        print(f"{args.src} is not a directory", file=args.std.err)
-        return 3
+    for src in args.src:
+        if not src.exists():
+            print(f"{src} does not exist", file=args.std.err)
+            return 2
 
-    zm = zootr_manifest_from_dir(args.src)
+        if not src.is_dir():
+            print(f"{src} is not a directory", file=args.std.err)
+            return 3
+
+        seeds.extend(_seed_dirs(src) if args.batch else [src])
+
+    if args.batch or len(seeds) > 1:
+        return _push_batch(args, seeds)
+
+    zm = zootr_manifest_from_dir(seeds[0])
 
     tag = args.ref.tag
 
     if tag is None:
         if args.autotag:
-            tag = "-".join(zm.metadata.hash).replace(" ", "-").lower()
+            tag = _autotag(zm)
         else:
             print("No tag provided and autotag is not enabled", file=args.std.err)
             return 4
 
-    args.ref.tag = tag
+    _push_seed(args, zm, tag)
+    return 0
+
+
+def _push_batch(args: cli.PushCtx, seeds: T.List[pathlib.Path]) -> int:
+    """
+    Pushes every seed through the same registry client, each is tagged from
+    its hash. A seed that fails is reported and the rest are still pushed.
+    """
+    if args.ref.tag is not None:
+        print("An explicit tag can't be used when pushing more than one seed",
+              file=args.std.err)
+        return 4
+
+    started = time.monotonic()
+    pushed, size, failed = 0, 0, 0
+
+    for seed in seeds:
+        try:
+            zm = zootr_manifest_from_dir(seed)
+            m = _push_seed(args, zm, _autotag(zm))
+        except (PocketError, OSError, http.HTTPException) as e:
+            args.complain(f"Failed to push {seed}: {e}")
+            failed += 1
+            continue
+
+        pushed += 1
+        size += sum(b.bytes for b in m.blobs())
+
+    elapsed = max(time.monotonic() - started, 1e-9)
 
     if not args.quiet:
-        print(f"Pushing {args.ref}", file=args.std.out)
+        args.say(
+            f"Pushed {pushed} seeds ({size / 1024 / 1024:.1f} MiB) in {elapsed:.1f}s, "
+            f"{pushed / elapsed:.2f} seeds/s, {size / 1024 / 1024 / elapsed:.2f} MiB/s")
 
-    m = _oci_manifest_from_zootr(zm)
+    if failed:
+        args.complain(f"{failed} seeds failed to push")
+        return 5
 
-    s = streams.StringReader(json.dumps(
-        zm.metadata, cls=seeddetails.SeedDetailsEncoder))
+    return 0
 
-    s = args.track(streams.name("Metadata", s), m.config.bytes)
 
-    blobs, manifests = args.registry.blobs, args.registry.manifests
+def _seed_dirs(parent: pathlib.Path) -> T.List[pathlib.Path]:
+    """
+    A directory holding a seed's settings file is a seed, otherwise each
+    directory directly under it that does is.
+    """
+    def is_seed(d: pathlib.Path) -> bool:
+        return any(zf.kind == FileKind.Settings for zf in zootr_files_from_dir(d))
 
-    blobs.push_blob(
-        args.ref.repository,
-        m.config,
-        s,
-    )
+    if is_seed(parent):
+        return [parent]
 
-    for (zf, b) in zip(zm.files, m.layers):
-        s = args.track(streams.name(zf.kind.name, zf.open()), b.bytes)
-        blobs.push_blob(args.ref.repository, b, s)
+    return sorted(d for d in parent.iterdir() if d.is_dir() and is_seed(d))
 
-    manifests.push_manifest(args.ref.repository, tag, m)
-    return 0
 
+def _autotag(zm: ZootrManifest) -> str:
+    return "-".join(zm.metadata.hash).replace(" ", "-").lower()
 
-def _oci_manifest_from_zootr(zm: ZootrManifest) -> manifest.Manifest:
-    layers = []
-    config = descriptor.from_obj(
+
+def _push_seed(args: cli.PushCtx, zm: ZootrManifest, tag: str) -> manifest.Manifest:
+    ref = dc.replace(args.ref, tag=tag)
+
+    if not args.quiet:
+        args.say(f"Pushing {ref}")
+
+    if args.single_pass:
+        m = _push_single_pass(args, zm)
+    else:
+        m = _oci_manifest_from_zootr(zm, args.compress, args.delta_base)
+        _push_blobs(args, zm, m)
+
+    args.registry.manifests.push_manifest(ref.repository, tag, m)
+    return m
+
+
+def _push_config(args: cli.PushCtx, zm: ZootrManifest, config: descriptor.Descriptor, cancel: parallel.Cancel):
+    s = streams.StringReader(json.dumps(
+        zm.metadata, cls=seeddetails.SeedDetailsEncoder))
+
+    s = args.track(streams.name("Metadata", s), config.bytes)
+    args.registry.blobs.push_blob(
+        args.ref.repository, config, parallel.CancellableReader(s, cancel))
+
+
+def _push_layer(args: cli.PushCtx, zf: ZootrFile, layer: descriptor.Descriptor, cancel: parallel.Cancel):
+    with contextlib.ExitStack() as stack:
+        fh = stack.enter_context(contextlib.closing(streams.mapped(zf.open())))
+        s = args.track(streams.name(zf.kind.name, fh), zf.path.stat().st_size)
+        r, _ = _layer_stream(zf, s, args.compress, args.delta_base, stack)
+        args.registry.blobs.push_blob(
+            args.ref.repository, layer, parallel.CancellableReader(r, cancel))
+
+
+def _push_base(args: cli.PushCtx, cancel: parallel.Cancel) -> descriptor.Descriptor:
+    """
+    Already in the registry for every seed after the first one that used it,
+    so this is usually only a check.
+    """
+    base = T.cast(delta.Base, args.delta_base)
+    with contextlib.closing(streams.mapped(base.path.open("rb"))) as fh:
+        s = args.track(streams.name("Base ROM", fh), base.descriptor.bytes)
+        args.registry.blobs.push_blob(
+            args.ref.repository, base.descriptor, parallel.CancellableReader(s, cancel))
+    return base.descriptor
+
+
+def _push_blobs(args: cli.PushCtx, zm: ZootrManifest, m: manifest.Manifest):
+    tasks = [functools.partial(_push_config, args, zm, m.config)]
+    tasks.extend(functools.partial(_push_layer, args, zf, b)
+                 for (zf, b) in zip(zm.files, m.layers))
+    if args.delta_base is not None:
+        tasks.append(functools.partial(_push_base, args))
+    parallel.run(args.jobs, tasks)
+
+
+def _push_single_pass(args: cli.PushCtx, zm: ZootrManifest) -> manifest.Manifest:
+    """
+    Digests each file as it is uploaded rather than reading it once to build
+    the manifest and again to upload it. Since the digest isn't known ahead of
+    time, the registry can't be asked if it already has the layer.
+    """
+    config = _config_descriptor(zm)
+    tasks: T.List[parallel.Task[T.Optional[descriptor.Descriptor]]] = [
+        functools.partial(_push_config, args, zm, config)]
+    tasks.extend(functools.partial(_stream_layer, args, zf)
+                 for zf in zm.files)
+    if args.delta_base is not None:
+        tasks.append(functools.partial(_push_base, args))
+
+    _, *layers = parallel.run(args.jobs, tasks)
+    return manifest.Manifest(
+        media.type("generation"), config, T.cast(T.List[descriptor.Descriptor], layers))
+
+
+def _stream_layer(args: cli.PushCtx, zf: ZootrFile, cancel: parallel.Cancel) -> descriptor.Descriptor:
+    with contextlib.ExitStack() as stack:
+        fh = stack.enter_context(contextlib.closing(streams.mapped(zf.open())))
+        s = args.track(streams.name(zf.kind.name, fh), zf.path.stat().st_size)
+        r, content_type = _layer_stream(zf, s, args.compress, args.delta_base, stack)
+        d = args.registry.blobs.push_stream(
+            args.ref.repository, content_type, parallel.CancellableReader(r, cancel))
+
+    _annotate(d, zf, r, args.delta_base)
+    return d
+
+
+def _layer_stream(zf: ZootrFile, s: streams.Reader, packed: T.Optional[compression.Compression], base: T.Optional[delta.Base], stack: contextlib.ExitStack) -> T.Tuple[streams.Reader, str]:
+    """
+    What is pushed for a layer and its media type, a ROM is pushed as a delta
+    when there's a base to make it against and other layers are compressed
+    when asked to.
+    """
+    if base is not None and zf.kind == FileKind.Rom:
+        fh = stack.enter_context(contextlib.closing(streams.mapped(base.path.open("rb"))))
+        return delta.encode(s, fh), delta.DELTA_TYPE
+
+    return compression.compressing(packed, s), _layer_type(zf, packed)
+
+
+def _annotate(d: descriptor.Descriptor, zf: ZootrFile, r: streams.Reader, base: T.Optional[delta.Base]) -> None:
+    d.annotations[oci.FILENAME_ANNOTATION] = zf.path.name
+    if isinstance(r, delta.EncodingReader):
+        r.annotate(d, T.cast(delta.Base, base).descriptor)
+
+
+def _config_descriptor(zm: ZootrManifest) -> descriptor.Descriptor:
+    return descriptor.from_obj(
         zm.metadata, media.type("config"), cls=seeddetails.SeedDetailsEncoder
     )
+
+
+def _layer_type(zf: ZootrFile, packed: T.Optional[compression.Compression]) -> str:
+    return media.type(zf.kind.name, packed.value if packed is not None else None)
+
+
+def _oci_manifest_from_zootr(zm: ZootrManifest, packed: T.Optional[compression.Compression] = None, base: T.Optional[delta.Base] = None) -> manifest.Manifest:
+    """
+    Layers are digested as they will be pushed, compression is deterministic
+    so compressing them again while pushing produces the same bytes.
+    """
+    layers = []
+    config = _config_descriptor(zm)
     annotations = {}
 
     for zf in zm.files:
-        fh = zf.open()
-        d = descriptor.from_stream(
-            streams.name(zf.kind.name, T.cast(streams.Reader, fh)),
-            media.type(zf.kind.name),
-        )
-        d.annotations[oci.FILENAME_ANNOTATION] = zf.path.name
+        with contextlib.ExitStack() as stack:
+            fh = stack.enter_context(contextlib.closing(streams.mapped(zf.open())))
+            r, content_type = _layer_stream(zf, fh, packed, base, stack)
+            d = descriptor.from_stream(streams.name(zf.kind.name, r), content_type)
+        _annotate(d, zf, r, base)
         layers.append(d)
 
+    # referenced by the manifest so the registry keeps it around
+    if base is not None:
+        layers.append(base.descriptor)
+
     return manifest.Manifest(media.type("generation"), config, layers, annotations)
+
+
+def serve(ctx: cli.ServeCtx) -> int:
+    p = proxy.Proxy(ctx.registry, ctx.manifests, ctx.blobs, ctx.manifestcache, ctx.ref.repository)
+    server = proxy.server(ctx.listen, p, None if ctx.quiet else ctx.std.out)
+    host, port = server.server_address[:2]
+
+    if not ctx.quiet:
+        print(f"Serving {ctx.ref.registry}/{ctx.ref.repository} on {host}:{port}", file=ctx.std.out)
+
+    # stopped like any other service, the summary below still gets printed
+    signal.signal(signal.SIGTERM, _interrupt)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+    if not ctx.quiet:
+        print(p.stats, file=ctx.std.out)
+        print(f"manifest {p.manifestcache.stats}", file=ctx.std.out)
+    return 0
+
+
+def _interrupt(signum: int, frame: T.Any) -> None:
+    raise KeyboardInterrupt()
+
+
+def export(ctx: cli.ExportCtx) -> int:
+    if not ctx.tags and not ctx.ref.tag:
+        print(f"{ctx.ref} does not have a tag attached and no --tag was given",
+              file=ctx.std.err)
+        return 4
+
+    tags = _matching_tags(ctx) if ctx.tags else iter([T.cast(str, ctx.ref.tag)])
+    w = layout.writer(ctx.out)
+    exported: T.List[descriptor.Descriptor] = []
+
+    try:
+        for tag in tags:
+            if not ctx.quiet:
+                ctx.say(f"Exporting {dc.replace(ctx.ref, tag=tag, digest=None)}")
+            exported.append(_export_tag(ctx, w, tag))
+
+        w.finish(exported)
+    finally:
+        w.close()
+
+    if not ctx.quiet:
+        ctx.say(f"Exported {len(exported)} seeds to {ctx.out}")
+    return 0
+
+
+def _export_tag(ctx: cli.ExportCtx, w: layout.Writer, tag: str) -> descriptor.Descriptor:
+    """
+    Writes a seed's blobs and then its manifest, as the registry sent it, and
+    returns the manifest's entry for the index. Blobs an earlier seed wrote
+    aren't written again.
+    """
+    if (entry := ctx.manifests.fetch_manifest(ctx.ref.repository, tag)) is None:
+        raise UnknownManifest(dc.replace(ctx.ref, tag=tag))
+
+    blobs = {str(b.digest): b for b in entry.manifest.blobs() if not w.has_blob(b.digest)}
+    parallel.run(ctx.jobs if w.concurrent else 1,
+                 [functools.partial(_export_blob, ctx, w, b) for b in blobs.values()])
+
+    d = descriptor.from_bytes(entry.body, ocijson.media_type(entry.body))
+    if not w.has_blob(d.digest):
+        w.write_blob(d, io.BytesIO(entry.body))
+
+    d.annotations[layout.REF_NAME_ANNOTATION] = tag
+    return d
+
+
+def _export_blob(ctx: cli.ExportCtx, w: layout.Writer, d: descriptor.Descriptor, cancel: parallel.Cancel):
+    r = ctx.registry.blobs.pull_blob(ctx.ref.repository, d.digest)
+    try:
+        s = ctx.track(streams.name(_blob_title(d), r), d.bytes)
+        w.write_blob(d, parallel.CancellableReader(s, cancel))
+    finally:
+        r.close()
+
+
+def import_(ctx: cli.ImportCtx) -> int:
+    src = layout.reader(ctx.layout)
+    imported = 0
+
+    for d in src.index():
+        if (tag := d.annotations.get(layout.REF_NAME_ANNOTATION)) is None:
+            print(f"Skipping {d.digest}, it has no tag", file=ctx.std.err)
+            continue
+
+        if ctx.tags and not any(fnmatch.fnmatchcase(tag, t) for t in ctx.tags):
+            continue
+
+        if not ctx.quiet:
+            ctx.say(f"Importing {dc.replace(ctx.ref, tag=tag, digest=None)}")
+
+        _import_tag(ctx, src, d, tag)
+        imported += 1
+
+    if not ctx.quiet:
+        ctx.say(f"Imported {imported} seeds from {ctx.layout}")
+    return 0
+
+
+def _import_tag(ctx: cli.ImportCtx, src: layout.Reader, d: descriptor.Descriptor, tag: str) -> None:
+    """
+    Pushes a seed's blobs, the registry is asked for each first so only
+    those it doesn't have are read, then its manifest as it is in the layout.
+    """
+    body = src.read_blob(d)
+    if (got := descriptor.from_bytes(body, d.content_type).digest) != d.digest:
+        raise layout.CorruptBlob(d.digest, got)
+
+    m = ocijson.load_manifest(json.loads(body))
+    blobs = {str(b.digest): b for b in m.blobs()}
+    parallel.run(ctx.jobs, [functools.partial(_import_blob, ctx, src, b) for b in blobs.values()])
+
+    ctx.manifests.push_manifest_bytes(ctx.ref.repository, tag, body, d.content_type)
+
+
+def _import_blob(ctx: cli.ImportCtx, src: layout.Reader, d: descriptor.Descriptor, cancel: parallel.Cancel):
+    r = src.open_blob(d)
+    try:
+        s = ctx.track(streams.name(_blob_title(d), r), d.bytes)
+        ctx.registry.blobs.push_blob(ctx.ref.repository, d, parallel.CancellableReader(s, cancel))
+    finally:
+        r.close()
+
+
+def _blob_title(d: descriptor.Descriptor) -> str:
+    return d.annotations.get(oci.FILENAME_ANNOTATION) or str(d.digest)[:19]
+
+
+# tags indexed between commits, an interrupted index keeps what it had done
+_INDEX_BATCH = 500
+
+
+def index(ctx: cli.IndexCtx) -> int:
+    """
+    Only tags the index hasn't seen have their manifests fetched, and only
+    configs it hasn't seen are pulled. Tags that are no longer listed are
+    dropped from it.
+    """
+    registry, repository = ctx.ref.registry, ctx.ref.repository
+    idx = seedindex.Index(ctx.db)
+
+    try:
+        known = idx.tags(registry, repository)
+        listed = list(dict.fromkeys(ctx.registry.tags.list_tags(repository)))
+        gone = set(known) - set(listed)
+        todo = listed if ctx.recheck else [t for t in listed if t not in known]
+
+        idx.untag(registry, repository, gone)
+        idx.commit()
+
+        indexed, failed = 0, 0
+        for start in range(0, len(todo), _INDEX_BATCH):
+            ok, bad = _index_batch(ctx, idx, todo[start:start + _INDEX_BATCH])
+            idx.commit()
+            indexed, failed = indexed + ok, failed + bad
+
+            if not ctx.quiet:
+                print(f"Indexed {indexed} of {len(todo)} tags", file=ctx.std.out)
+
+        idx.analyze()
+    finally:
+        idx.close()
+
+    if not ctx.quiet:
+        print(f"{len(listed)} tags in {ctx.ref.repository}, {indexed} indexed, {len(gone)} removed",
+              file=ctx.std.out)
+
+    if failed:
+        print(f"{failed} tags failed to index", file=ctx.std.err)
+        return 5
+
+    return 0
+
+
+def _index_batch(ctx: cli.IndexCtx, idx: seedindex.Index, tags: T.List[str]) -> T.Tuple[int, int]:
+    """
+    Fetches the batch's manifests and then the configs none of them share
+    with what is already indexed, both concurrently. The index is only
+    touched from this thread.
+    """
+    fetched = parallel.run(ctx.jobs, [functools.partial(_index_manifest, ctx, t) for t in tags])
+    manifests = {t: m for t, m in zip(tags, fetched) if m is not None}
+    failed = len(tags) - len(manifests)
+
+    configs: T.Dict[str, descriptor.Descriptor] = {}
+    for tag, m in list(manifests.items()):
+        config = m.manifest.config
+        if config.content_type != media.type("config"):
+            print(f"Skipping {tag}, it is not a seed", file=ctx.std.err)
+            del manifests[tag]
+        elif not idx.has_manifest(m.digest) and not idx.has_config(str(config.digest)):
+            configs[str(config.digest)] = config
+
+    details = parallel.run(ctx.jobs, [functools.partial(_index_config, ctx, d) for d in configs.values()])
+    for digest, d in zip(configs, details):
+        if d is not None:
+            idx.add_config(digest, d)
+
+    indexed = 0
+    for tag, m in manifests.items():
+        if not idx.has_manifest(m.digest):
+            if not idx.has_config(str(m.manifest.config.digest)):
+                # already reported when the config couldn't be read
+                failed += 1
+                continue
+            idx.add_manifest(m.digest, m.manifest.config, m.manifest.layers)
+        idx.tag(ctx.ref.registry, ctx.ref.repository, tag, m.digest)
+        indexed += 1
+
+    return indexed, failed
+
+
+def _index_manifest(ctx: cli.IndexCtx, tag: str, cancel: parallel.Cancel) -> T.Optional[cache.CachedManifest]:
+    try:
+        if (m := ctx.manifests.fetch_manifest(ctx.ref.repository, tag)) is None:
+            raise UnknownManifest(dc.replace(ctx.ref, tag=tag, digest=None))
+        return m
+    except (PocketError, OSError, http.HTTPException, ValueError, KeyError) as e:
+        print(f"Failed to index {tag}: {e}", file=ctx.std.err)
+        return None
+
+
+def _index_config(ctx: cli.IndexCtx, d: descriptor.Descriptor, cancel: parallel.Cancel) -> T.Optional[seeddetails.SeedDetails]:
+    try:
+        return _read_config(ctx, d)
+    except (PocketError, OSError, http.HTTPException) as e:
+        print(f"Failed to index {d.digest}: {e}", file=ctx.std.err)
+        return None
+
+
+def _read_config(ctx: T.Union[cli.IndexCtx, cli.InspectCtx], d: descriptor.Descriptor) -> seeddetails.SeedDetails:
+    buf = io.BytesIO()
+    r = ctx.registry.blobs.pull_blob(ctx.ref.repository, d.digest)
+    try:
+        shutil.copyfileobj(r, buf)
+    finally:
+        r.close()
+    body = buf.getvalue()
+
+    if (got := descriptor.from_bytes(body, d.content_type).digest) != d.digest:
+        raise UnreadableConfig(d.digest, f"its digest is {got}")
+
+    try:
+        return seeddetails.seeddetails_from_config(json.loads(body))
+    except (ValueError, KeyError, TypeError) as e:
+        raise UnreadableConfig(d.digest, f"it is malformed: {e!r}")
+
+
+def query(ctx: cli.QueryCtx) -> int:
+    """
+    Answered from the index alone, the registry isn't asked anything
+    """
+    idx = seedindex.Index(ctx.db, create=False)
+    try:
+        seeds = idx.query(ctx.ref.registry, ctx.ref.repository, ctx.query, layers=ctx.as_json)
+    finally:
+        idx.close()
+
+    for s in seeds:
+        if ctx.as_json:
+            print(json.dumps({
+                "tag": s.tag,
+                "manifest": s.manifest,
+                "config": s.config,
+                **dc.asdict(s.details),
+                "size": s.size,
+                "layers": s.layers,
+            }, cls=ocijson.OciEncoder), file=ctx.std.out)
+        else:
+            d = s.details
+            print("\t".join([s.tag, d.version, d.seed, d.settings,
+                             "spoiler" if d.spoiler else "-", ", ".join(d.hash)]), file=ctx.std.out)
+
+    return 0
+
+
+@dc.dataclass()
+class _Inspected:
+    ref: Reference
+    manifest: cache.CachedManifest
+    # None when the manifest's config isn't a seed's
+    details: T.Optional[seeddetails.SeedDetails]
+
+
+def inspect(ctx: cli.InspectCtx) -> int:
+    """
+    Only manifests and configs are fetched, never layers. Every seed is
+    resolved before anything is printed so the output is in the order the
+    seeds were asked for. A seed that fails is reported and the rest are
+    still printed.
+    """
+    if ctx.tags:
+        refs = [_inspect_ref(ctx, t) for t in _matching_tags(ctx)]
+    elif ctx.ref.tag or ctx.ref.digest:
+        refs = [ctx.ref]
+    else:
+        print(f"{ctx.ref} does not have a tag or a digest attached and no tags were given",
+              file=ctx.std.err)
+        return 4
+
+    inspected = parallel.run(ctx.jobs, [functools.partial(_inspect_seed, ctx, r) for r in refs])
+
+    for i, seed in enumerate(s for s in inspected if s is not None):
+        if ctx.as_json:
+            print(json.dumps(_inspect_json(seed), cls=ocijson.OciEncoder), file=ctx.std.out)
+            continue
+
+        if i:
+            print(file=ctx.std.out)
+        print(_inspect_table(seed), file=ctx.std.out)
+
+    if failed := sum(1 for s in inspected if s is None):
+        print(f"{failed} seeds failed to inspect", file=ctx.std.err)
+        return 5
+
+    return 0
+
+
+def _inspect_ref(ctx: cli.InspectCtx, tag: str) -> Reference:
+    if ":" in tag:
+        return dc.replace(ctx.ref, tag=None, digest=tag)
+    return dc.replace(ctx.ref, tag=tag, digest=None)
+
+
+def _inspect_seed(ctx: cli.InspectCtx, ref: Reference, cancel: parallel.Cancel) -> T.Optional[_Inspected]:
+    try:
+        if (m := ctx.manifests.fetch_manifest(ref.repository, T.cast(str, ref.digest or ref.tag))) is None:
+            raise UnknownManifest(ref)
+
+        details = None
+        if m.manifest.config.content_type == media.type("config"):
+            details = _read_config(ctx, m.manifest.config)
+        return _Inspected(ref, m, details)
+    except (PocketError, OSError, http.HTTPException, ValueError, KeyError) as e:
+        print(f"Failed to inspect {ref}: {e}", file=ctx.std.err)
+        return None
+
+
+def _pull_size(m: manifest.Manifest) -> int:
+    return sum(b.bytes for b in m.blobs())
+
+
+def _inspect_json(seed: _Inspected) -> T.Dict[str, T.Any]:
+    m = seed.manifest.manifest
+    return {
+        "tag": seed.ref.tag,
+        "manifest": seed.manifest.digest,
+        "config": m.config.digest,
+        **(dc.asdict(seed.details) if seed.details is not None else {}),
+        "size": _pull_size(m),
+        "layers": m.layers,
+    }
+
+
+def _inspect_table(seed: _Inspected) -> str:
+    m = seed.manifest.manifest
+    lines = [str(dc.replace(seed.ref, digest=seed.manifest.digest))]
+
+    if (d := seed.details) is not None:
+        lines.extend(_columns([
+            ["version", d.version],
+            ["seed", d.seed],
+            ["settings", d.settings],
+            ["hash", ", ".join(d.hash)],
+            ["spoiler", "yes" if d.spoiler else "no"],
+        ]))
+    else:
+        lines.append(f"not a seed, its config is {m.config.content_type}")
+
+    lines.append("")
+    lines.extend(_columns(
+        [["FILE", "TYPE", "SIZE"]]
+        + [[_blob_title(b), _layer_kind(b), progress.size(b.bytes)] for b in m.layers]
+        + [["total", "", progress.size(_pull_size(m))]],
+        right=[2],
+    ))
+    return "\n".join(lines)
+
+
+def _layer_kind(d: descriptor.Descriptor) -> str:
+    if (kind := media.parse_type(d.content_type)) is None:
+        return d.content_type
+    if (packed := media.compression(d.content_type)) is not None:
+        return f"{kind}+{packed}"
+    return kind
+
+
+def _columns(rows: T.List[T.List[str]], right: T.Sequence[int] = ()) -> T.List[str]:
+    widths = [max(len(r[i]) for r in rows) for i in range(len(rows[0]))]
+    return ["  ".join(c.rjust(w) if i in right else c.ljust(w)
+                      for i, (c, w) in enumerate(zip(r, widths))).rstrip()
+            for r in rows]
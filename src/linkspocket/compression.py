@@ -0,0 +1,127 @@
+import dataclasses as dc
+import enum
+import typing as T
+import zlib
+
+from . import streams
+from .errors import PocketError
+
+try:
+    from compression import zstd as _zstd  # type: ignore
+except ImportError:
+    _zstd = None
+
+try:
+    import zstandard as _zstandard  # type: ignore
+except ImportError:
+    _zstandard = None
+
+
+class Compression(enum.Enum):
+    Gzip = "gzip"
+    Zstd = "zstd"
+
+
+class Unsupported(PocketError):
+    def __init__(self, c: str):
+        super().__init__(
+            f"{c} compression isn't available, zstd needs python 3.14 or the zstandard package")
+
+
+class _compressor(T.Protocol):
+    def compress(self, b: bytes) -> bytes:
+        ...
+
+    def flush(self) -> bytes:
+        ...
+
+
+class _decompressor(T.Protocol):
+    def decompress(self, b: bytes) -> bytes:
+        ...
+
+
+# gzip's wbits, zlib writes a gzip header with no name and no mtime so the same
+# input always compresses to the same bytes
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+_READ_SIZE = 1024 * 64
+
+
+def parse(s: T.Optional[str]) -> T.Optional[Compression]:
+    if s is None:
+        return None
+
+    try:
+        return Compression(s)
+    except ValueError:
+        raise Unsupported(s)
+
+
+def compressor(c: Compression) -> _compressor:
+    if c == Compression.Gzip:
+        return zlib.compressobj(6, zlib.DEFLATED, _GZIP_WBITS)
+
+    if _zstd is not None:
+        return _zstd.ZstdCompressor()
+    if _zstandard is not None:
+        return _zstandard.ZstdCompressor().compressobj()
+    raise Unsupported(c.value)
+
+
+def decompressor(c: Compression) -> _decompressor:
+    if c == Compression.Gzip:
+        return zlib.decompressobj(_GZIP_WBITS)
+
+    if _zstd is not None:
+        return _zstd.ZstdDecompressor()
+    if _zstandard is not None:
+        return _zstandard.ZstdDecompressor().decompressobj()
+    raise Unsupported(c.value)
+
+
+@dc.dataclass()
+class CompressingReader(streams.Reader):
+    """
+    Compresses r as it is read, reads fill the requested size unless r has
+    run out, just like reading a file.
+    """
+
+    r: streams.Reader
+    c: _compressor
+    _buf: bytearray = dc.field(default_factory=bytearray)
+    _eof: bool = False
+
+    def read(self, s: int = 0) -> bytes:
+        while not self._eof and (s <= 0 or len(self._buf) < s):
+            if b := self.r.read(_READ_SIZE):
+                self._buf += self.c.compress(b)
+            else:
+                self._buf += self.c.flush()
+                self._eof = True
+
+        n = len(self._buf) if s <= 0 else s
+        b = bytes(self._buf[:n])
+        del self._buf[:n]
+        return b
+
+
+@dc.dataclass()
+class DecompressingWriter(streams.Writer):
+    """
+    Decompresses everything written to it into w
+    """
+
+    w: streams.Writer
+    d: _decompressor
+
+    def write(self, s: T.Optional[bytes]) -> int:
+        if not s:
+            return 0
+        self.w.write(self.d.decompress(s))
+        return len(s)
+
+
+def compressing(c: T.Optional[Compression], r: streams.Reader) -> streams.Reader:
+    if c is None:
+        return r
+    return CompressingReader(r, compressor(c))
@@ -29,6 +29,17 @@ def resetline() -> str:
     return "\033[G\033K"
 
 
+def up(n: int) -> str:
+    """
+    Moves to the start of the line n lines up
+    """
+    return f"\033[{n}F"
+
+
+def clearbelow() -> str:
+    return "\033[J"
+
+
 @dc.dataclass()
 class Std:
     out: T.TextIO
@@ -0,0 +1,99 @@
+# Seeds generated from the same vanilla ROM share almost all of their ROM's
+# bytes. A ROM can be stored as a delta against a base ROM that is pushed once
+# per repository: the ROM XORed with the base, which zeroes every unchanged
+# byte, then deflated, which makes the zeroes nearly free.
+
+import dataclasses as dc
+import pathlib
+import typing as T
+
+from . import compression, media, streams
+from .oci.core import descriptor
+
+BASE_TYPE = media.type("rom.base")
+DELTA_TYPE = media.type("rom.delta")
+
+# digest of the base the delta is against
+BASE_ANNOTATION = media.annotation("delta.base")
+# digest and size of the rebuilt ROM
+DIGEST_ANNOTATION = media.annotation("delta.digest")
+SIZE_ANNOTATION = media.annotation("delta.size")
+
+
+@dc.dataclass()
+class Base:
+    path: pathlib.Path
+    descriptor: descriptor.Descriptor
+
+    @staticmethod
+    def from_path(path: pathlib.Path) -> "Base":
+        with path.open("rb") as fh:
+            d = descriptor.from_stream(streams.name(path.name, T.cast(streams.Reader, fh)), BASE_TYPE)
+        return Base(path, d)
+
+
+def _xor(a: bytes, b: bytes) -> bytes:
+    if len(b) < len(a):
+        # past the end of the base every byte is kept as is
+        b = bytes(b).ljust(len(a), b"\0")
+    return (int.from_bytes(a, "little") ^ int.from_bytes(b, "little")).to_bytes(len(a), "little")
+
+
+@dc.dataclass()
+class _xorreader(streams.Reader):
+    r: streams.Reader
+    base: streams.Reader
+
+    def read(self, s: int = 0) -> bytes:
+        b = self.r.read(s)
+        return _xor(b, self.base.read(len(b))) if b else b
+
+
+@dc.dataclass()
+class _xorwriter(streams.Writer):
+    w: streams.Writer
+    base: streams.Reader
+
+    def write(self, s: T.Optional[bytes]) -> int:
+        if not s:
+            return 0
+        self.w.write(_xor(s, self.base.read(len(s))))
+        return len(s)
+
+
+@dc.dataclass()
+class EncodingReader(streams.Reader):
+    """
+    Reads as the delta of r against base, describes r once it has been read
+    through.
+    """
+
+    r: descriptor.DescribingReader
+    delta: streams.Reader
+
+    def read(self, s: int = 0) -> bytes:
+        return self.delta.read(s)
+
+    def annotate(self, d: descriptor.Descriptor, base: descriptor.Descriptor) -> None:
+        rom = self.r.describe("")
+        d.annotations[BASE_ANNOTATION] = str(base.digest)
+        d.annotations[DIGEST_ANNOTATION] = str(rom.digest)
+        d.annotations[SIZE_ANNOTATION] = str(rom.bytes)
+
+
+def encode(r: streams.Reader, base: streams.Reader) -> EncodingReader:
+    described = descriptor.DescribingReader(r)
+    return EncodingReader(described, compression.CompressingReader(
+        _xorreader(described, base), compression.compressor(compression.Compression.Gzip)))
+
+
+def decoder(w: streams.Writer, base: streams.Reader) -> streams.Writer:
+    """
+    Writes the ROM a delta was made from to w as the delta is written
+    """
+    return compression.DecompressingWriter(
+        _xorwriter(w, base), compression.decompressor(compression.Compression.Gzip))
+
+
+def is_delta(d: descriptor.Descriptor) -> bool:
+    return d.content_type == DELTA_TYPE and BASE_ANNOTATION in d.annotations
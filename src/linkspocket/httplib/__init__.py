@@ -1 +1 @@
-from . import handlers, url
+from . import aiopool, handlers, pool, trace, url
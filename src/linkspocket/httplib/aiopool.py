@@ -0,0 +1,279 @@
+import asyncio
+import inspect
+import ssl
+import typing as T
+import urllib.parse as urlparse
+
+from .pool import Stats
+
+
+class AsyncReader(T.Protocol):
+    async def read(self, s: int = -1) -> bytes:
+        ...
+
+
+# bytes, or anything with a sync or async read, sync readers are read inline
+Body = T.Any
+
+_Key = T.Tuple[str, str]
+_Conn = T.Tuple[asyncio.StreamReader, asyncio.StreamWriter]
+
+_READ_SIZE = 1024 * 64
+
+
+async def read(r: T.Any, s: int = -1) -> bytes:
+    """
+    Reads from either a sync or an async reader
+    """
+    b = r.read(s)
+    if inspect.isawaitable(b):
+        b = await b
+    return b
+
+
+class Response:
+    """
+    A response whose body is read as it is asked for, the connection goes back
+    to its pool once the response is closed.
+    """
+
+    def __init__(self, status: int, reason: str, headers: T.Dict[str, str], reader: asyncio.StreamReader, length: T.Optional[int], chunked: bool, release: T.Callable[[bool], None]):
+        self.status = status
+        self.reason = reason
+        self._headers = headers
+        self._reader = reader
+        self._length = length
+        self._chunked = chunked
+        self._chunk_left = 0
+        self._done = length == 0
+        self._release: T.Optional[T.Callable[[bool], None]] = release
+
+    def getheader(self, name: str, default: T.Optional[str] = None) -> T.Optional[str]:
+        return self._headers.get(name.lower(), default)
+
+    async def read(self, s: int = -1) -> bytes:
+        if self._done:
+            return b""
+
+        if self._chunked:
+            return await self._read_chunked(s)
+
+        if self._length is None:
+            b = await (self._reader.read(s) if s > 0 else self._reader.read())
+            self._done = not b
+            return b
+
+        n = self._length if s < 0 else min(s, self._length)
+        b = await self._reader.readexactly(n)
+        self._length -= n
+        self._done = self._length == 0
+        return b
+
+    async def _read_chunked(self, s: int) -> bytes:
+        out = bytearray()
+
+        while s < 0 or len(out) < s:
+            if self._chunk_left == 0:
+                size = int((await self._reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    # trailers end with a blank line like headers do
+                    while (await self._reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    self._done = True
+                    break
+                self._chunk_left = size
+
+            n = self._chunk_left if s < 0 else min(self._chunk_left, s - len(out))
+            out += await self._reader.readexactly(n)
+            self._chunk_left -= n
+
+            if self._chunk_left == 0:
+                await self._reader.readexactly(2)
+
+        return bytes(out)
+
+    async def close(self) -> None:
+        release, self._release = self._release, None
+        if release is None:
+            return
+
+        # a short body left unread costs less than a new connection
+        reusable = self._done or (self._length is not None and self._length <= _READ_SIZE)
+        if reusable and not self._done:
+            try:
+                await self.read()
+            except (OSError, asyncio.IncompleteReadError):
+                reusable = False
+
+        release(reusable and self.getheader("connection", "").lower() != "close")
+
+    async def __aenter__(self) -> "Response":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+
+class Pool:
+    """
+    The asyncio counterpart of pool.Pool, keeps HTTP/1.1 connections alive
+    between requests with at most max_per_host open to any one host.
+    """
+
+    _REDIRECTS = frozenset([301, 302, 303, 307, 308])
+    _MAX_REDIRECTS = 10
+
+    def __init__(self, max_per_host: int = 8):
+        self.stats = Stats()
+        self._max_per_host = max_per_host
+        self._slots: T.Dict[_Key, asyncio.Semaphore] = {}
+        self._idle: T.Dict[_Key, T.List[_Conn]] = {}
+        self._ssl: T.Optional[ssl.SSLContext] = None
+
+    async def request(self, method: str, url: str, headers: T.Optional[T.Dict[str, str]] = None, body: Body = None) -> Response:
+        headers = dict(headers or {})
+        redirects = 0
+
+        while True:
+            resp = await self._send(method, url, headers, body)
+            location = resp.getheader("location")
+
+            # like urllib, only follow redirects that don't resend a body
+            if (
+                resp.status not in Pool._REDIRECTS
+                or location is None
+                or method not in ("GET", "HEAD")
+                or redirects >= Pool._MAX_REDIRECTS
+            ):
+                return resp
+
+            await resp.close()
+            redirects += 1
+            url = urlparse.urljoin(url, location)
+
+    async def close(self) -> None:
+        for conns in self._idle.values():
+            for _, writer in conns:
+                writer.close()
+        self._idle.clear()
+
+    async def _send(self, method: str, url: str, headers: T.Dict[str, str], body: Body) -> Response:
+        u = urlparse.urlsplit(url)
+        key = (u.scheme, u.netloc)
+        path = u.path or "/"
+        if u.query:
+            path = f"{path}?{u.query}"
+
+        (reader, writer), reused = await self._acquire(key)
+
+        try:
+            await _write_request(writer, method, path, u.netloc, headers, body)
+            resp = await _read_response(reader, method, lambda reusable: self._release(key, (reader, writer), reusable))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            self._release(key, (reader, writer), False)
+            # the registry may have hung up on an idle connection, a fresh one
+            # is worth trying as long as the body can be sent again
+            if reused and isinstance(body, (type(None), bytes, bytearray)):
+                return await self._send(method, url, headers, body)
+            raise
+        except BaseException:
+            self._release(key, (reader, writer), False)
+            raise
+
+        return resp
+
+    async def _acquire(self, key: _Key) -> T.Tuple[_Conn, bool]:
+        await self._slots.setdefault(key, asyncio.Semaphore(self._max_per_host)).acquire()
+
+        idle = self._idle.setdefault(key, [])
+        while idle:
+            reader, writer = idle.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                self.stats.reused += 1
+                return (reader, writer), True
+            writer.close()
+
+        try:
+            conn = await self._connect(key)
+        except BaseException:
+            self._slots[key].release()
+            raise
+
+        self.stats.opened += 1
+        return conn, False
+
+    def _release(self, key: _Key, conn: _Conn, reusable: bool) -> None:
+        if reusable:
+            self._idle.setdefault(key, []).append(conn)
+        else:
+            conn[1].close()
+        self._slots[key].release()
+
+    async def _connect(self, key: _Key) -> _Conn:
+        scheme, netloc = key
+        host, _, port = netloc.rpartition(":")
+        if not host or not port.isdigit():
+            host, port = netloc, ""
+
+        if scheme == "https":
+            if self._ssl is None:
+                self._ssl = ssl.create_default_context()
+            return await asyncio.open_connection(host, int(port or 443), ssl=self._ssl)
+        return await asyncio.open_connection(host, int(port or 80))
+
+
+async def _write_request(writer: asyncio.StreamWriter, method: str, path: str, host: str, headers: T.Dict[str, str], body: Body) -> None:
+    lines = [f"{method} {path} HTTP/1.1", f"Host: {host}"]
+    names = {k.lower() for k in headers}
+
+    if isinstance(body, (bytes, bytearray)) and "content-length" not in names:
+        headers = {**headers, "Content-Length": str(len(body))}
+    elif body is None and method in ("POST", "PUT", "PATCH") and "content-length" not in names:
+        headers = {**headers, "Content-Length": "0"}
+
+    chunked = body is not None and not isinstance(body, (bytes, bytearray)) and "content-length" not in names
+    if chunked:
+        headers = {**headers, "Transfer-Encoding": "chunked"}
+
+    lines.extend(f"{k}: {v}" for k, v in headers.items())
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+
+    if isinstance(body, (bytes, bytearray)):
+        writer.write(body)
+    elif body is not None:
+        while b := await read(body, _READ_SIZE):
+            writer.write(b"%x\r\n%s\r\n" % (len(b), b) if chunked else b)
+            await writer.drain()
+        if chunked:
+            writer.write(b"0\r\n\r\n")
+
+    await writer.drain()
+
+
+async def _read_response(reader: asyncio.StreamReader, method: str, release: T.Callable[[bool], None]) -> Response:
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionResetError("connection closed before the response")
+
+    _, status, *reason = status_line.decode("latin-1").rstrip("\r\n").split(" ", 2)
+    headers: T.Dict[str, str] = {}
+
+    while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+        name, _, value = line.decode("latin-1").partition(":")
+        name, value = name.strip().lower(), value.strip()
+        headers[name] = f"{headers[name]}, {value}" if name in headers else value
+
+    code = int(status)
+    chunked = "chunked" in headers.get("transfer-encoding", "").lower()
+    length: T.Optional[int] = None
+
+    if method == "HEAD" or code in (204, 304) or 100 <= code < 200:
+        length = 0
+    elif not chunked and (cl := headers.get("content-length")) is not None:
+        length = int(cl)
+
+    if length is None and not chunked:
+        # read until the server closes, nothing else can use the connection
+        headers["connection"] = "close"
+
+    return Response(code, "".join(reason), headers, reader, length, chunked, release)
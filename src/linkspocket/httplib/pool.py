@@ -0,0 +1,270 @@
+import dataclasses as dc
+import http.client as http
+import select
+import socket
+import threading
+import time
+import typing as T
+import urllib.parse as urlparse
+import urllib.request as urlreq
+
+from . import trace
+
+
+class Opener(T.Protocol):
+    def open(self, req: urlreq.Request) -> T.Any:
+        ...
+
+
+@dc.dataclass()
+class Stats:
+    opened: int = 0
+    reused: int = 0
+
+    def __str__(self) -> str:
+        return f"connections opened: {self.opened}, reused: {self.reused}"
+
+
+class _response(http.HTTPResponse):
+    # set by the pool once the response is handed out, called exactly once
+    release: T.Optional[T.Callable[[bool], None]] = None
+    span: T.Optional[trace.Span] = None
+    # body length the response started with, None when it is chunked
+    declared: T.Optional[int] = None
+
+    # unread bodies smaller than this are drained so the connection can be reused
+    _DRAIN_LIMIT = 1024 * 64
+
+    def begin(self):
+        super().begin()
+        self.declared = self.length
+
+    def close(self):
+        release, self.release = self.release, None
+        reusable = release is not None and not self.will_close and self._drain()
+        received = self.declared - (self.length or 0) if self.declared is not None else None
+        super().close()
+
+        if release is not None:
+            release(reusable)
+
+        if (span := self.span) is not None:
+            self.span = None
+            span.mark("transfer")
+            span.fields["bytes_in"] = received
+            span.finish()
+
+    def _drain(self) -> bool:
+        if self.isclosed():
+            return True
+
+        if self.chunked or self.length is None or self.length > _response._DRAIN_LIMIT:
+            return False
+
+        try:
+            self.read()
+        except (OSError, http.HTTPException):
+            return False
+
+        return True
+
+
+class _timedconnect(http.HTTPConnection):
+    """
+    Remembers how long the TCP handshake of the last connect took, for HTTPS
+    the rest of connect is the TLS handshake.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tcp = 0.0
+        # http.client connects through this attribute rather than a method
+        self._create_connection = self._timed_create_connection
+
+    def _timed_create_connection(self, *args, **kwargs) -> socket.socket:
+        started = time.perf_counter()
+        try:
+            return socket.create_connection(*args, **kwargs)
+        finally:
+            self.tcp = time.perf_counter() - started
+
+
+class _httpconnection(_timedconnect):
+    response_class = _response
+
+
+class _httpsconnection(_timedconnect, http.HTTPSConnection):
+    response_class = _response
+
+
+_Key = T.Tuple[str, str]
+
+
+class Pool(Opener):
+    """
+    Keeps HTTP/1.1 connections alive between requests, at most max_per_host
+    connections are open to any one host at a time. A connection goes back to
+    the pool when the response it served is closed.
+    """
+
+    _REDIRECTS = frozenset([301, 302, 303, 307, 308])
+    _MAX_REDIRECTS = 10
+
+    def __init__(self, max_per_host: int = 8, tracer: T.Optional[trace.Tracer] = None):
+        self.stats = Stats()
+        self._max_per_host = max_per_host
+        self._tracer = tracer
+        self._cond = threading.Condition()
+        self._idle: T.Dict[_Key, T.List[http.HTTPConnection]] = {}
+        self._count: T.Dict[_Key, int] = {}
+
+    def open(self, req: urlreq.Request) -> http.HTTPResponse:
+        redirects = 0
+
+        while True:
+            resp = self._send(req)
+            location = resp.getheader("location")
+
+            # like urllib, only follow redirects that don't resend a body
+            if (
+                resp.status not in Pool._REDIRECTS
+                or location is None
+                or req.get_method() not in ("GET", "HEAD")
+                or redirects >= Pool._MAX_REDIRECTS
+            ):
+                return resp
+
+            resp.close()
+            redirects += 1
+            req = urlreq.Request(
+                urlparse.urljoin(req.full_url, location),
+                method=req.get_method(),
+                headers=dict(req.header_items()),
+            )
+
+    def close(self):
+        with self._cond:
+            for conns in self._idle.values():
+                for conn in conns:
+                    conn.close()
+            self._idle.clear()
+            self._count.clear()
+
+    def _send(self, req: urlreq.Request) -> http.HTTPResponse:
+        u = urlparse.urlsplit(req.full_url)
+        key = (u.scheme, u.netloc)
+        path = u.path or "/"
+        if u.query:
+            path = f"{path}?{u.query}"
+
+        span = None
+        if self._tracer is not None:
+            span = self._tracer.span(req.get_method(), req.full_url, _length(req))
+
+        conn, reused = self._acquire(key)
+
+        try:
+            if span is not None:
+                span.mark("wait")
+                span.fields["reused"] = reused
+                if not reused:
+                    conn.connect()
+                    span.connected(T.cast(_timedconnect, conn).tcp, isinstance(conn, http.HTTPSConnection))
+
+            conn.request(req.get_method(), path, body=req.data,
+                         headers=dict(req.header_items()))
+            if span is not None:
+                span.mark("send")
+
+            resp = T.cast(_response, conn.getresponse())
+        except ConnectionError as e:
+            if span is not None:
+                span.finish(e)
+            self._release(key, conn, False)
+            # the registry may have hung up on an idle connection, a fresh one
+            # is worth trying as long as the body can be sent again
+            if reused and isinstance(req.data, (type(None), bytes, bytearray, memoryview)):
+                return self._send(req)
+            raise
+        except BaseException as e:
+            if span is not None:
+                span.finish(e)
+            self._release(key, conn, False)
+            raise
+
+        if span is not None:
+            span.mark("ttfb")
+            span.fields["status"] = resp.status
+            resp.span = span
+
+        resp.release = lambda reusable: self._release(key, conn, reusable)
+        return resp
+
+    def _acquire(self, key: _Key) -> T.Tuple[http.HTTPConnection, bool]:
+        with self._cond:
+            while True:
+                idle = self._idle.setdefault(key, [])
+                while idle:
+                    conn = idle.pop()
+                    if _is_alive(conn):
+                        self.stats.reused += 1
+                        return conn, True
+
+                    conn.close()
+                    self._count[key] -= 1
+
+                if self._count.get(key, 0) < self._max_per_host:
+                    self._count[key] = self._count.get(key, 0) + 1
+                    self.stats.opened += 1
+                    break
+
+                self._cond.wait()
+
+        try:
+            return _connect(key), False
+        except BaseException:
+            self._release(key, None, False)
+            raise
+
+    def _release(self, key: _Key, conn: T.Optional[http.HTTPConnection], reusable: bool) -> None:
+        with self._cond:
+            if reusable and conn is not None and conn.sock is not None:
+                self._idle.setdefault(key, []).append(conn)
+            else:
+                if conn is not None:
+                    conn.close()
+                self._count[key] = self._count.get(key, 1) - 1
+
+            self._cond.notify()
+
+
+# bodies sent from a reader are read this much at a time, http.client's
+# default of 8 KiB means a syscall for every 8 KiB uploaded
+_BLOCKSIZE = 1024 * 64
+
+
+def _connect(key: _Key) -> http.HTTPConnection:
+    scheme, host = key
+    if scheme == "https":
+        return _httpsconnection(host, blocksize=_BLOCKSIZE)
+    return _httpconnection(host, blocksize=_BLOCKSIZE)
+
+
+def _length(req: urlreq.Request) -> T.Optional[int]:
+    if (n := req.get_header("Content-length")) is not None:
+        return int(n)
+    if isinstance(req.data, (bytes, bytearray, memoryview)):
+        return len(req.data)
+    return 0 if req.data is None else None
+
+
+def _is_alive(conn: http.HTTPConnection) -> bool:
+    """
+    An idle connection with something to read has either been closed by the
+    other end or is in a state we can't make sense of.
+    """
+    if conn.sock is None:
+        return False
+
+    readable, _, _ = select.select([conn.sock], [], [], 0)
+    return not readable
@@ -0,0 +1,136 @@
+# A span is one HTTP request from the pool's point of view: how long it waited
+# for a connection, connected, sent, waited for the status line and read the
+# body. The body counts as being read until the response is closed, so that
+# includes whatever the caller did with it in between. Spans are grouped under
+# the operation that was active in the thread that made the request, pushing
+# one blob can take a POST, many PATCHes and a PUT that all share an operation.
+
+import contextlib
+import contextvars
+import dataclasses as dc
+import itertools
+import json
+import re
+import threading
+import time
+import typing as T
+import urllib.parse as urlparse
+
+
+@dc.dataclass()
+class Operation:
+    id: int
+    name: str
+    attrs: T.Dict[str, str]
+
+
+_operation: contextvars.ContextVar[T.Optional[Operation]] = contextvars.ContextVar("operation", default=None)
+_ids = itertools.count(1)
+
+
+@contextlib.contextmanager
+def operation(name: str, **attrs: T.Any) -> T.Iterator[Operation]:
+    """
+    Requests made inside the block are traced as part of this operation, an
+    operation inside another one takes over until it ends.
+    """
+    op = Operation(next(_ids), name, {k: str(v) for k, v in attrs.items()})
+    token = _operation.set(op)
+    try:
+        yield op
+    finally:
+        _operation.reset(token)
+
+
+# registry paths with the parts that change from request to request taken out
+_TEMPLATES = [
+    (re.compile(r"/v2/(.+)/blobs/uploads/[^/]+"), "/v2/{name}/blobs/uploads/{session}"),
+    (re.compile(r"/v2/(.+)/blobs/uploads/?"), "/v2/{name}/blobs/uploads/"),
+    (re.compile(r"/v2/(.+)/blobs/[^/]+"), "/v2/{name}/blobs/{digest}"),
+    (re.compile(r"/v2/(.+)/manifests/[^/]+"), "/v2/{name}/manifests/{reference}"),
+    (re.compile(r"/v2/(.+)/tags/list"), "/v2/{name}/tags/list"),
+]
+
+
+def template(path: str) -> T.Tuple[str, T.Optional[str]]:
+    """
+    The template of a registry path and the repository it names, paths that
+    aren't part of the distribution API are kept as they are.
+    """
+    for pattern, tmpl in _TEMPLATES:
+        if m := pattern.fullmatch(path):
+            return tmpl, m.group(1)
+    return path, None
+
+
+class Span:
+    """
+    Timed by calling mark at the end of each phase, the time since the
+    previous mark goes to that phase.
+    """
+
+    def __init__(self, tracer: "Tracer", method: str, url: str, bytes_out: T.Optional[int]):
+        path, repository = template(urlparse.urlsplit(url).path or "/")
+        self._tracer = tracer
+        self._operation = _operation.get()
+        self._started = self._last = time.perf_counter()
+        self.fields: T.Dict[str, T.Any] = {
+            "method": method,
+            "path": path,
+            "repository": repository,
+            "status": None,
+            "bytes_out": bytes_out,
+            "bytes_in": None,
+            "reused": None,
+        }
+        self.phases: T.Dict[str, float] = {}
+
+    def mark(self, phase: str) -> None:
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self._last
+        self._last = now
+
+    def connected(self, tcp: float, tls: bool) -> None:
+        """
+        Marks the end of connecting, with TLS whatever wasn't spent on the TCP
+        handshake went to the TLS one.
+        """
+        self.mark("connect")
+        if tls:
+            self.phases["tls"] = max(self.phases["connect"] - tcp, 0.0)
+            self.phases["connect"] -= self.phases["tls"]
+
+    def finish(self, error: T.Optional[BaseException] = None) -> None:
+        self.fields["seconds"] = time.perf_counter() - self._started
+        self.fields["phases"] = self.phases
+        if error is not None:
+            self.fields["error"] = repr(error)
+        self._tracer.record(self._started, self._operation, self.fields)
+
+
+class Tracer:
+    """
+    Writes every finished span to w as a line of JSON
+    """
+
+    def __init__(self, w: T.TextIO):
+        self._w = w
+        self._lock = threading.Lock()
+        self._epoch = time.perf_counter()
+
+    def span(self, method: str, url: str, bytes_out: T.Optional[int]) -> Span:
+        return Span(self, method, url, bytes_out)
+
+    def record(self, started: float, op: T.Optional[Operation], fields: T.Dict[str, T.Any]) -> None:
+        line = {
+            # seconds since tracing started
+            "start": round(started - self._epoch, 6),
+            "operation": {"id": op.id, "name": op.name, **op.attrs} if op is not None else None,
+            **fields,
+        }
+        line["seconds"] = round(line["seconds"], 6)
+        line["phases"] = {k: round(v, 6) for k, v in line["phases"].items()}
+
+        encoded = json.dumps(line)
+        with self._lock:
+            self._w.write(f"{encoded}\n")
@@ -1,4 +1,3 @@
-
 _BASE_MEDIA_TYPE = "application/sudonters.zootr.seed"
 _ANNOTATION_BASE = "etc.sudonters.zootr"
 
@@ -7,11 +6,23 @@ def annotation(s: str) -> str:
     return f"{_ANNOTATION_BASE}.{s}".lower()
 
 
-def type(s: str) -> str:
-    return f"{_BASE_MEDIA_TYPE}.{s}".lower()
+def type(s: str, compression: str | None = None) -> str:
+    t = f"{_BASE_MEDIA_TYPE}.{s}".lower()
+    if compression is not None:
+        t = f"{t}+{compression}"
+    return t
 
 
 def parse_type(s: str) -> str | None:
     if not s.startswith(_BASE_MEDIA_TYPE):
         return None
-    return s[len(_BASE_MEDIA_TYPE)+1:]
+    return s[len(_BASE_MEDIA_TYPE)+1:].partition("+")[0]
+
+
+def compression(s: str) -> str | None:
+    """
+    The suffix naming how a layer of our own media type is compressed
+    """
+    if parse_type(s) is None:
+        return None
+    return s.partition("+")[2] or None
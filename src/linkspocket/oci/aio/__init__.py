@@ -0,0 +1,7 @@
+# asyncio implementations of the registry protocols for embedding linkspocket
+# in an event loop, none of these block it or need a thread per transfer.
+
+from .blob import BlobPuller, BlobPusher
+from .manifest import ManifestPuller, ManifestPusher
+from .registry import Registry, connect
+from .tags import TagLister
@@ -0,0 +1,235 @@
+import dataclasses as dc
+import hashlib
+import time
+import typing as T
+import urllib.parse as urlparse
+
+from ...httplib import aiopool, url
+from ..core import descriptor
+from ..http.blob import BlobUnavailable, ChunkSizer, UploadFailed
+
+
+class Puller(T.Protocol):
+    async def pull_blob(self, repository: str, digest: descriptor.Digest, offset: int = 0) -> aiopool.Response:
+        ...
+
+    async def does_blob_exist(self, repository: str, digest: descriptor.Digest) -> bool:
+        ...
+
+
+class Pusher(T.Protocol):
+    async def push_blob(self, repository: str, descriptor: descriptor.Descriptor, content: aiopool.Body) -> None:
+        ...
+
+    async def push_stream(self, repository: str, content_type: str, content: aiopool.Body) -> descriptor.Descriptor:
+        ...
+
+    async def mount_blob(self, repository: str, digest: descriptor.Digest, source: str) -> bool:
+        ...
+
+
+@dc.dataclass()
+class PullPusher(Puller, Pusher):
+    _pull: Puller
+    _push: Pusher
+    # other repositories in the same registry that may already have the blob
+    _mount_from: T.Sequence[str] = ()
+    # blobs seen to be in the registry, saves asking again when many pushes
+    # share blobs
+    _known: T.Set[T.Tuple[str, str]] = dc.field(default_factory=set)
+
+    async def push_blob(self, repository: str, descriptor: descriptor.Descriptor, content: aiopool.Body) -> None:
+        if await self.does_blob_exist(repository, descriptor.digest):
+            return
+
+        for source in self._mount_from:
+            if source != repository and await self.mount_blob(repository, descriptor.digest, source):
+                return
+
+        await self._push.push_blob(repository, descriptor, content)
+        self._known.add((repository, str(descriptor.digest)))
+
+    async def mount_blob(self, repository: str, digest: descriptor.Digest, source: str) -> bool:
+        if mounted := await self._push.mount_blob(repository, digest, source):
+            self._known.add((repository, str(digest)))
+        return mounted
+
+    async def push_stream(self, repository: str, content_type: str, content: aiopool.Body) -> descriptor.Descriptor:
+        d = await self._push.push_stream(repository, content_type, content)
+        self._known.add((repository, str(d.digest)))
+        return d
+
+    async def pull_blob(self, repository: str, digest: descriptor.Digest, offset: int = 0) -> aiopool.Response:
+        return await self._pull.pull_blob(repository, digest, offset)
+
+    async def does_blob_exist(self, repository: str, digest: descriptor.Digest) -> bool:
+        if (repository, str(digest)) in self._known:
+            return True
+
+        if exists := await self._pull.does_blob_exist(repository, digest):
+            self._known.add((repository, str(digest)))
+        return exists
+
+
+@dc.dataclass()
+class BlobPuller(Puller):
+    _registry: str
+    _pool: aiopool.Pool
+    _proto: str = "https"
+
+    async def does_blob_exist(self, repository: str, digest: descriptor.Digest) -> bool:
+        async with await self._pool.request("HEAD", self._url(repository, digest)) as resp:
+            return resp.status == 200
+
+    async def pull_blob(self, repository: str, digest: descriptor.Digest, offset: int = 0) -> aiopool.Response:
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        resp = await self._pool.request("GET", self._url(repository, digest), headers)
+
+        if resp.status not in (200, 206):
+            await resp.close()
+            raise BlobUnavailable(repository, digest, resp.status)
+
+        if offset and resp.status == 200:
+            # registry ignored the range, throw away what we already have
+            while offset > 0 and (b := await resp.read(min(offset, aiopool._READ_SIZE))):
+                offset -= len(b)
+
+        return resp
+
+    def _url(self, repository: str, digest: descriptor.Digest) -> str:
+        return f"{self._proto}://{self._registry}/v2/{repository}/blobs/{digest}"
+
+
+@dc.dataclass()
+class BlobPusher(Pusher):
+    """
+    Uploads small blobs in a single PUT and larger ones in chunks sized like
+    the threaded pusher sizes them.
+    """
+
+    _registry: str
+    _pool: aiopool.Pool
+    _proto: str = "https"
+
+    _MIN_CHUNK_SIZE = 1024 * 64
+    # blobs at or under this size are sent in a single PUT
+    _MONOLITHIC_MAX = 1024 * 1024 * 8
+
+    async def push_blob(self, repository: str, descriptor: descriptor.Descriptor, content: aiopool.Body) -> None:
+        location, min_chunk = await self._start_upload(repository)
+
+        if descriptor.bytes <= BlobPusher._MONOLITHIC_MAX:
+            await self._put(location, descriptor, content, descriptor.bytes)
+            return
+
+        location = await self._chunked_upload(location, min_chunk, content, None)
+        await self._put(location, descriptor, None, 0)
+
+    async def push_stream(self, repository: str, content_type: str, content: aiopool.Body) -> descriptor.Descriptor:
+        location, min_chunk = await self._start_upload(repository)
+        digester = descriptor.DigestStream(hashlib.sha256())
+
+        # size isn't known up front, buffer enough to find out if it's small
+        head = await aiopool.read(content, BlobPusher._MONOLITHIC_MAX + 1)
+        if len(head) <= BlobPusher._MONOLITHIC_MAX:
+            d = descriptor.from_bytes(head, content_type)
+            await self._put(location, d, head, len(head))
+            return d
+
+        digester.write(head)
+        sizer = _described(content, digester, len(head))
+        location = await self._chunked_upload(location, min_chunk, sizer, head)
+
+        d = descriptor.Descriptor(digester.digest(), sizer.size, content_type)
+        await self._put(location, d, None, 0)
+        return d
+
+    async def mount_blob(self, repository: str, digest: descriptor.Digest, source: str) -> bool:
+        query = urlparse.urlencode({"mount": str(digest), "from": source})
+
+        async with await self._pool.request(
+                "POST", f"{self._proto}://{self._registry}/v2/{repository}/blobs/uploads/?{query}") as resp:
+            if resp.status == 201:
+                return True
+
+            # registry declined and opened a regular upload instead, nothing
+            # is going to be sent to it
+            location = self._location(resp) if resp.status == 202 else None
+
+        if location is not None:
+            async with await self._pool.request("DELETE", location) as resp:
+                # an upload the registry already dropped has nothing to cancel
+                if resp.status >= 400 and resp.status != 404:
+                    raise UploadFailed(location, resp.status)
+
+        return False
+
+    async def _start_upload(self, repository: str) -> T.Tuple[str, int]:
+        url = f"{self._proto}://{self._registry}/v2/{repository}/blobs/uploads/"
+        async with await self._pool.request("POST", url) as resp:
+            if resp.status >= 400:
+                raise UploadFailed(url, resp.status)
+
+            min_chunk = int(resp.getheader("oci-chunk-min-length")
+                            or BlobPusher._MIN_CHUNK_SIZE)
+            return self._location(resp), max(min_chunk, BlobPusher._MIN_CHUNK_SIZE)
+
+    async def _chunked_upload(self, location: str, min_chunk: int, content: aiopool.Body, head: T.Optional[bytes]) -> str:
+        sizer = ChunkSizer(min_chunk)
+        pending = bytearray(head or b"")
+        offset = 0
+
+        while True:
+            while len(pending) < sizer.size and (b := await aiopool.read(content, sizer.size - len(pending))):
+                pending += b
+
+            if not pending:
+                return location
+
+            chunk, pending = bytes(pending[:sizer.size]), pending[sizer.size:]
+            started = time.monotonic()
+
+            async with await self._pool.request("PATCH", location, {
+                "Content-Range": f"{offset}-{offset + len(chunk) - 1}",
+                "Content-Type": "application/octet-stream",
+            }, chunk) as resp:
+                if resp.status >= 400:
+                    raise UploadFailed(location, resp.status)
+                location = self._location(resp)
+
+            sizer.measure(len(chunk), time.monotonic() - started)
+            offset += len(chunk)
+
+    async def _put(self, location: str, descriptor: descriptor.Descriptor, content: aiopool.Body, size: int) -> None:
+        builder = url.Builder(urlparse.urlparse(location))
+        builder.query["digest"] = [str(descriptor.digest)]
+
+        async with await self._pool.request("PUT", str(builder), {
+            "Content-Length": str(size),
+            "Content-Type": "application/octet-stream",
+        }, content) as resp:
+            if resp.status >= 400:
+                raise UploadFailed(location, resp.status)
+
+    def _location(self, resp: aiopool.Response) -> str:
+        builder = url.Builder(urlparse.urlparse(T.cast(str, resp.getheader("location"))))
+        builder.host = self._registry
+        builder.scheme = self._proto
+        return str(builder)
+
+
+@dc.dataclass()
+class _described:
+    """
+    Digests and counts what is read through it
+    """
+
+    r: aiopool.Body
+    digester: descriptor.DigestStream
+    size: int = 0
+
+    async def read(self, s: int = -1) -> bytes:
+        b = await aiopool.read(self.r, s)
+        self.digester.write(b)
+        self.size += len(b)
+        return b
@@ -0,0 +1,85 @@
+import dataclasses as dc
+import json
+import typing as T
+
+from ...httplib import aiopool
+from .. import json as ocijson
+from ..core import manifest
+from ..http.manifest import ManifestRejected
+
+
+class Puller(T.Protocol):
+    async def pull_manifest(self, repository: str, reference: str) -> T.Optional[manifest.Manifest]:
+        ...
+
+    async def does_manifest_exist(self, repository: str, reference: str) -> bool:
+        ...
+
+
+class Pusher(T.Protocol):
+    async def push_manifest(self, repository: str, reference: str, manifest: manifest.Manifest) -> None:
+        ...
+
+
+@dc.dataclass()
+class PullPusher(Puller, Pusher):
+    _pull: Puller
+    _push: Pusher
+
+    async def pull_manifest(self, repository: str, reference: str) -> T.Optional[manifest.Manifest]:
+        return await self._pull.pull_manifest(repository, reference)
+
+    async def does_manifest_exist(self, repository: str, reference: str) -> bool:
+        return await self._pull.does_manifest_exist(repository, reference)
+
+    async def push_manifest(self, repository: str, reference: str, manifest: manifest.Manifest) -> None:
+        if await self.does_manifest_exist(repository, reference):
+            return
+
+        await self._push.push_manifest(repository, reference, manifest)
+
+
+@dc.dataclass()
+class ManifestPusher(Pusher):
+    _registry: str
+    _pool: aiopool.Pool
+    _proto: str = "https"
+
+    async def push_manifest(self, repository: str, reference: str, manifest: manifest.Manifest) -> None:
+        body = json.dumps(manifest, cls=ocijson.OciEncoder, indent=4).encode()
+
+        async with await self._pool.request(
+            "PUT",
+            f"{self._proto}://{self._registry}/v2/{repository}/manifests/{reference}",
+            {"Content-Type": ocijson.MANIFEST_TYPE},
+            body,
+        ) as resp:
+            if resp.status >= 400:
+                raise ManifestRejected(repository, reference, resp.status)
+
+
+@dc.dataclass()
+class ManifestPuller(Puller):
+    _registry: str
+    _pool: aiopool.Pool
+    _proto: str = "https"
+
+    async def does_manifest_exist(self, repository: str, reference: str) -> bool:
+        async with await self._pool.request(
+            "HEAD",
+            f"{self._proto}://{self._registry}/v2/{repository}/manifests/{reference}",
+            {"Accept": ocijson.MANIFEST_TYPE},
+        ) as resp:
+            return resp.status == 200
+
+    async def pull_manifest(self, repository: str, reference: str) -> T.Optional[manifest.Manifest]:
+        async with await self._pool.request(
+            "GET",
+            f"{self._proto}://{self._registry}/v2/{repository}/manifests/{reference}",
+            {"Accept": ocijson.MANIFEST_TYPE},
+        ) as resp:
+            if resp.status != 200:
+                return None
+            body = await resp.read()
+
+        return ocijson.load_manifest(json.loads(body))
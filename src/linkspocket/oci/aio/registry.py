@@ -0,0 +1,44 @@
+import dataclasses as dc
+import typing as T
+
+from ...httplib import aiopool
+from . import blob, manifest, tags
+
+
+@dc.dataclass()
+class Registry:
+    """
+    The asyncio counterpart of core.registry.Registry, every transfer shares
+    one connection pool that is closed along with the registry.
+    """
+
+    manifests: manifest.PullPusher
+    blobs: blob.PullPusher
+    tags: tags.Lister
+    pool: aiopool.Pool
+
+    async def close(self) -> None:
+        await self.pool.close()
+
+    async def __aenter__(self) -> "Registry":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+
+def connect(registry: str, proto: str = "https", max_connections: int = 8, mount_from: T.Sequence[str] = ()) -> Registry:
+    pool = aiopool.Pool(max_connections)
+    return Registry(
+        manifest.PullPusher(
+            manifest.ManifestPuller(registry, pool, proto),
+            manifest.ManifestPusher(registry, pool, proto),
+        ),
+        blob.PullPusher(
+            blob.BlobPuller(registry, pool, proto),
+            blob.BlobPusher(registry, pool, proto),
+            mount_from,
+        ),
+        tags.TagLister(registry, pool, proto),
+        pool,
+    )
@@ -0,0 +1,45 @@
+import dataclasses as dc
+import json
+import typing as T
+
+from ...httplib import aiopool
+from ..http.tags import TagsUnavailable, _next_page
+
+
+class Lister(T.Protocol):
+    def list_tags(self, repository: str) -> T.AsyncIterator[str]:
+        ...
+
+
+@dc.dataclass()
+class TagLister(Lister):
+    """
+    Yields tags a page at a time, following Link headers like the threaded
+    lister does.
+    """
+
+    _registry: str
+    _pool: aiopool.Pool
+    _proto: str = "https"
+    # how many tags to ask for per page, None leaves it to the registry
+    _page_size: T.Optional[int] = None
+
+    async def list_tags(self, repository: str) -> T.AsyncIterator[str]:
+        url: T.Optional[str] = f"{self._proto}://{self._registry}/v2/{repository}/tags/list"
+        if self._page_size is not None:
+            url = f"{url}?n={self._page_size}"
+
+        while url is not None:
+            async with await self._pool.request("GET", url) as resp:
+                # a repository that was never pushed to has no tags
+                if resp.status == 404:
+                    return
+
+                if resp.status != 200:
+                    raise TagsUnavailable(repository, resp.status)
+
+                page = json.loads(await resp.read()).get("tags") or []
+                url = _next_page(url, resp.getheader("link"))
+
+            for tag in page:
+                yield tag
@@ -19,9 +19,20 @@ class Pusher(T.Protocol):
     ) -> None:
         ...
 
+    def push_stream(
+        self,
+        repository: str,
+        content_type: str,
+        content: streams.Reader,
+    ) -> descriptor.Descriptor:
+        ...
+
+    def mount_blob(self, repository: str, digest: descriptor.Digest, source: str) -> bool:
+        ...
+
 
 class Puller(T.Protocol):
-    def pull_blob(self, repository: str, digest: descriptor.Digest) -> streams.MustCloseReader:
+    def pull_blob(self, repository: str, digest: descriptor.Digest, offset: int = 0) -> streams.MustCloseReader:
         ...
 
     def does_blob_exist(self, repository: str, digest: descriptor.Digest) -> bool:
@@ -32,15 +43,40 @@ class Puller(T.Protocol):
 class PullPusher(Puller, Pusher):
     _pull: Puller
     _push: Pusher
+    # other repositories in the same registry that may already have the blob
+    _mount_from: T.Sequence[str] = ()
+    # blobs seen to be in the registry, saves asking again when many pushes
+    # share blobs
+    _known: T.Set[T.Tuple[str, str]] = dc.field(default_factory=set)
 
     def push_blob(self, repository: str, descriptor: descriptor.Descriptor, content: streams.Reader) -> None:
         if self.does_blob_exist(repository, descriptor.digest):
             return
 
-        return self._push.push_blob(repository, descriptor, content)
+        for source in self._mount_from:
+            if source != repository and self.mount_blob(repository, descriptor.digest, source):
+                return
+
+        self._push.push_blob(repository, descriptor, content)
+        self._known.add((repository, str(descriptor.digest)))
+
+    def mount_blob(self, repository: str, digest: descriptor.Digest, source: str) -> bool:
+        if mounted := self._push.mount_blob(repository, digest, source):
+            self._known.add((repository, str(digest)))
+        return mounted
+
+    def push_stream(self, repository: str, content_type: str, content: streams.Reader) -> descriptor.Descriptor:
+        d = self._push.push_stream(repository, content_type, content)
+        self._known.add((repository, str(d.digest)))
+        return d
 
     def does_blob_exist(self, repository: str, digest: descriptor.Digest) -> bool:
-        return self._pull.does_blob_exist(repository, digest)
+        if (repository, str(digest)) in self._known:
+            return True
+
+        if exists := self._pull.does_blob_exist(repository, digest):
+            self._known.add((repository, str(digest)))
+        return exists
 
-    def pull_blob(self, repository: str, digest: descriptor.Digest) -> streams.MustCloseReader:
-        return self._pull.pull_blob(repository, digest)
+    def pull_blob(self, repository: str, digest: descriptor.Digest, offset: int = 0) -> streams.MustCloseReader:
+        return self._pull.pull_blob(repository, digest, offset)
@@ -0,0 +1,268 @@
+# Blobs are content addressed, so once one has been pulled it never needs to
+# be pulled again. The cache keeps them on disk by digest and hands them out
+# to later pulls, evicting whatever was used least recently once it grows past
+# its size cap.
+#
+# Manifests are small and asked for by tag far more often than they change, so
+# they're kept along with what's needed to ask the registry if they have.
+
+import dataclasses as dc
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import threading
+import typing as T
+
+from ... import streams
+from .. import json as ocijson
+from . import blob, descriptor, manifest
+
+# linux/fs.h, clones the source file's extents into the destination
+_FICLONE = 0x40049409
+
+
+@dc.dataclass()
+class Stats:
+    hits: int = 0
+    misses: int = 0
+
+    def __str__(self) -> str:
+        total = self.hits + self.misses
+        rate = (self.hits / total * 100) if total else 0.0
+        return f"cache hits: {self.hits}, misses: {self.misses} ({rate:.1f}% hit rate)"
+
+
+class BlobCache:
+    def __init__(self, root: pathlib.Path, max_bytes: int):
+        self.stats = Stats()
+        self._root = root
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def path(self, digest: descriptor.Digest) -> pathlib.Path:
+        return self._root.joinpath(digest.algo, digest.hexhash())
+
+    def open(self, digest: descriptor.Digest) -> T.Optional[T.BinaryIO]:
+        try:
+            fh = self.path(digest).open("rb")
+        except FileNotFoundError:
+            self._count(hit=False)
+            return None
+
+        self._touch(digest)
+        self._count(hit=True)
+        return fh
+
+    def materialize(self, digest: descriptor.Digest, dest: pathlib.Path) -> bool:
+        """
+        Puts a cached blob at dest as a reflink where the filesystem has them
+        and a copy where it doesn't. Either way dest is a file of its own with
+        the usual permissions, changing it leaves the cache alone.
+        """
+        src = self.path(digest)
+        if not src.exists():
+            return False
+
+        dest.unlink(missing_ok=True)
+        try:
+            _clone(src, dest)
+        except FileNotFoundError:
+            # evicted out from under us
+            return False
+
+        self._touch(digest)
+        self._count(hit=True)
+        return True
+
+    def filling(self, digest: descriptor.Digest, r: streams.MustCloseReader) -> streams.MustCloseReader:
+        tmp = self.temporary(digest)
+        return _filling(r, tmp.open("wb"), tmp, digest, self)
+
+    def temporary(self, digest: descriptor.Digest) -> pathlib.Path:
+        """
+        Where to write a blob before it is committed, unique to the calling
+        thread and ignored by eviction.
+        """
+        self._root.joinpath(digest.algo).mkdir(parents=True, exist_ok=True)
+        return self.path(digest).with_name(
+            f".{digest.hexhash()}.{os.getpid()}.{threading.get_ident()}")
+
+    def commit(self, tmp: pathlib.Path, digest: descriptor.Digest) -> None:
+        """
+        Moves a fully written and verified blob into the cache
+        """
+        tmp.chmod(0o444)
+        tmp.replace(self.path(digest))
+        self._evict()
+
+    def _evict(self) -> None:
+        with self._lock:
+            blobs = [(p.stat(), p) for p in self._root.glob("*/*")
+                     if not p.name.startswith(".")]
+            total = sum(st.st_size for st, _ in blobs)
+
+            for st, p in sorted(blobs, key=lambda b: b[0].st_mtime):
+                if total <= self._max_bytes:
+                    break
+                p.unlink(missing_ok=True)
+                total -= st.st_size
+
+    def _touch(self, digest: descriptor.Digest) -> None:
+        # mtime doubles as last use, atime can't be trusted to be updated
+        try:
+            os.utime(self.path(digest))
+        except OSError:
+            pass
+
+    def _count(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.stats.hits += 1
+            else:
+                self.stats.misses += 1
+
+
+@dc.dataclass()
+class _filling(streams.MustCloseReader):
+    """
+    Copies a blob into the cache as it is read, it is only kept if everything
+    read through it matches the digest it was pulled by
+    """
+
+    r: streams.MustCloseReader
+    fh: T.BinaryIO
+    tmp: pathlib.Path
+    digest: descriptor.Digest
+    cache: BlobCache
+    digester: descriptor.DigestStream = dc.field(
+        default_factory=lambda: descriptor.DigestStream(hashlib.sha256()))
+
+    def read(self, s: int = 0) -> bytes:
+        b = self.r.read(s)
+        self.fh.write(b)
+        self.digester.write(b)
+        return b
+
+    def readinto(self, b: memoryview) -> int:
+        n = streams.readinto(self.r, b)
+        self.fh.write(b[:n])
+        self.digester.write(b[:n])
+        return n
+
+    def close(self):
+        self.r.close()
+        self.fh.close()
+
+        if self.digester.digest() == self.digest:
+            self.cache.commit(self.tmp, self.digest)
+        else:
+            self.tmp.unlink(missing_ok=True)
+
+
+def _clone(src: pathlib.Path, dest: pathlib.Path) -> None:
+    with src.open("rb") as s, dest.open("wb") as d:
+        try:
+            fcntl.ioctl(d.fileno(), _FICLONE, s.fileno())
+            return
+        except OSError as e:
+            if e.errno not in (errno.EOPNOTSUPP, errno.EXDEV, errno.EINVAL, errno.ENOTTY, errno.EBADF):
+                raise
+
+        shutil.copyfileobj(s, d)
+
+
+@dc.dataclass()
+class CachingPuller(blob.Puller):
+    _pull: blob.Puller
+    _cache: BlobCache
+
+    def does_blob_exist(self, repository: str, digest: descriptor.Digest) -> bool:
+        return self._pull.does_blob_exist(repository, digest)
+
+    def pull_blob(self, repository: str, digest: descriptor.Digest, offset: int = 0) -> streams.MustCloseReader:
+        if (fh := self._cache.open(digest)) is not None:
+            fh.seek(offset)
+            return T.cast(streams.MustCloseReader, fh)
+
+        r = self._pull.pull_blob(repository, digest, offset)
+
+        # a partial blob can't be checked against its digest
+        if offset:
+            return r
+
+        return self._cache.filling(digest, r)
+
+
+@dc.dataclass()
+class CachedManifest:
+    digest: str
+    etag: T.Optional[str]
+    manifest: manifest.Manifest
+    # as the registry sent it, the digest is of these bytes
+    body: bytes
+
+
+class ManifestCache:
+    """
+    Keeps each manifest's body as the registry sent it alongside its digest
+    and ETag, parsed manifests are kept in memory once loaded.
+    """
+
+    def __init__(self, root: pathlib.Path):
+        self.stats = Stats()
+        self._root = root
+        self._loaded: T.Dict[str, CachedManifest] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> T.Optional[CachedManifest]:
+        with self._lock:
+            if (entry := self._loaded.get(key)) is not None:
+                return entry
+
+        try:
+            with self._path(key).open() as fh:
+                stored = json.load(fh)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        entry = _cached_manifest(
+            stored["digest"], stored["etag"], stored["body"].encode())
+        with self._lock:
+            self._loaded[key] = entry
+        return entry
+
+    def put(self, key: str, digest: str, etag: T.Optional[str], body: bytes) -> CachedManifest:
+        entry = _cached_manifest(digest, etag, body)
+
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}")
+        tmp.write_text(json.dumps(
+            {"key": key, "digest": digest, "etag": etag, "body": body.decode()}))
+        tmp.replace(path)
+
+        with self._lock:
+            self._loaded[key] = entry
+        return entry
+
+    def count(self, hit: bool) -> None:
+        """
+        Called by whoever asked the registry, only it knows whether the cached
+        manifest was still current.
+        """
+        with self._lock:
+            if hit:
+                self.stats.hits += 1
+            else:
+                self.stats.misses += 1
+
+    def _path(self, key: str) -> pathlib.Path:
+        return self._root.joinpath(hashlib.sha256(key.encode()).hexdigest())
+
+
+def _cached_manifest(digest: str, etag: T.Optional[str], body: bytes) -> CachedManifest:
+    return CachedManifest(digest, etag, ocijson.load_manifest(json.loads(body)), body)
@@ -77,6 +77,27 @@ class DigestStream(streams.Writer):
         return Digest(self.algo.name, self.algo.digest())
 
 
+@dc.dataclass
+class DescribingReader(streams.Reader):
+    """
+    Builds a Descriptor from the content as it is read through
+    """
+
+    r: streams.Reader
+    digester: DigestStream = dc.field(
+        default_factory=lambda: DigestStream(hashlib.sha256()))
+    sizer: streams.Sizer = dc.field(default_factory=streams.Sizer)
+
+    def read(self, s: int = 0) -> bytes:
+        b = self.r.read(s)
+        self.digester.write(b)
+        self.sizer.write(b)
+        return b
+
+    def describe(self, content_type: str) -> Descriptor:
+        return Descriptor(self.digester.digest(), self.sizer.written, content_type)
+
+
 def from_str(s: str, content_type: str) -> Descriptor:
     return from_bytes(s.encode(), content_type)
 
@@ -1,8 +1,9 @@
 import dataclasses as dc
-from . import manifest, blob
+from . import manifest, blob, tags
 
 
 @dc.dataclass()
 class Registry:
     manifests: manifest.PullPusher
     blobs: blob.PullPusher
+    tags: tags.Lister
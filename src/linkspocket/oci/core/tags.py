@@ -0,0 +1,6 @@
+import typing as T
+
+
+class Lister(T.Protocol):
+    def list_tags(self, repository: str) -> T.Iterator[str]:
+        ...
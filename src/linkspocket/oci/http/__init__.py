@@ -1,2 +1,4 @@
-from .blob import BlobPusher, BlobPuller
-from .manifest import ManifestPusher, ManifestPuller
+from .blob import BlobPusher, BlobPuller, BlobUnavailable, UploadStrategy
+from .manifest import ManifestMismatch, ManifestPusher, ManifestPuller, ManifestRejected
+from .sessions import FileSessions
+from .tags import TagLister, TagsUnavailable
@@ -1,67 +1,272 @@
-from ...httplib import url
+from ...httplib import pool, trace, url
 from ... import streams
 import urllib.request as urlreq
 import urllib.parse as urlparse
 import http.client as http
 import typing as T
 import dataclasses as dc
+import enum
+import functools
+import io
+import time
 
 
+from ...errors import PocketError
 from ..core import blob, descriptor
+from . import sessions
+
+
+class BlobUnavailable(PocketError):
+    def __init__(self, repository: str, digest: descriptor.Digest, status: int):
+        super().__init__(
+            f"Could not pull {digest} from {repository}: HTTP {status}")
+
+
+class UploadFailed(PocketError):
+    def __init__(self, location: str, status: int):
+        super().__init__(f"Upload to {location} failed: HTTP {status}")
+
+
+class UploadStrategy(enum.Enum):
+    Auto = "auto"
+    Monolithic = "monolithic"
+    Chunked = "chunked"
+
+
+@dc.dataclass()
+class ChunkSizer:
+    """
+    Grows or shrinks the PATCH size so that each request carries about
+    `target` seconds worth of data at the most recently measured throughput.
+    Never goes below what the registry asked for or more than doubles at once.
+    """
+
+    minimum: int
+    maximum: int = 1024 * 1024 * 32
+    target: float = 0.5
+    size: int = dc.field(init=False)
+
+    def __post_init__(self):
+        # the registry rejects chunks under its minimum, whatever our maximum
+        self.maximum = max(self.minimum, self.maximum)
+        self.size = self.minimum
+
+    def measure(self, n: int, elapsed: float) -> None:
+        ideal = int(n / elapsed * self.target) if elapsed > 0 else self.maximum
+        self.size = max(self.minimum, min(ideal, self.size * 2, self.maximum))
 
 
 @dc.dataclass()
 class BlobPusher(blob.Pusher):
     _registry: str
-    _opener: urlreq.OpenerDirector
+    _opener: pool.Opener
     _proto: str = "https"
+    _strategy: UploadStrategy = UploadStrategy.Auto
+    _sessions: T.Optional[sessions.Sessions] = None
 
     _MIN_CHUNK_SIZE = 1024 * 64
+    # tries at sending a chunk, the registry is asked what it has between them
+    _PATCH_ATTEMPTS = 3
+    # blobs at or under this size are sent in a single PUT when picking automatically
+    _MONOLITHIC_MAX = 1024 * 1024 * 8
 
     def push_blob(self, repository: str, descriptor: descriptor.Descriptor, content: streams.Reader) -> None:
+        with trace.operation("push blob", repository=repository, digest=descriptor.digest):
+            if self._is_monolithic(descriptor.bytes):
+                location, _ = self._start_upload(repository)
+                self._monolithic_upload(location, descriptor, content)
+                return
+
+            key = f"{self._registry}/{repository}@{descriptor.digest}"
+
+            if (session := self._resume(key)) is not None:
+                streams.skip(content, session.offset)
+            else:
+                location, min_chunk = self._start_upload(repository)
+                session = sessions.Session(location, 0, min_chunk)
+
+            location = self._chunked_upload(session, content, key)
+            self._finalize_upload(location, descriptor)
+
+            if self._sessions is not None:
+                self._sessions.remove(key)
+
+    def push_stream(self, repository: str, content_type: str, content: streams.Reader) -> descriptor.Descriptor:
+        with trace.operation("push stream", repository=repository):
+            location, min_chunk = self._start_upload(repository)
+
+            if self._strategy == UploadStrategy.Auto:
+                # size isn't known up front, buffer enough to find out if it's small
+                head = content.read(BlobPusher._MONOLITHIC_MAX)
+                if len(head) < BlobPusher._MONOLITHIC_MAX or not (tail := content.read(BlobPusher._MIN_CHUNK_SIZE)):
+                    d = descriptor.from_bytes(head, content_type)
+                    self._monolithic_upload(location, d, io.BytesIO(head))
+                    return d
+
+                content = streams.ChainReader(
+                    [io.BytesIO(head), io.BytesIO(tail), content])
+
+            described = descriptor.DescribingReader(content)
+
+            if self._strategy == UploadStrategy.Monolithic:
+                # the digest has to be in the PUT's URL before the body is sent
+                body = described.read(-1)
+                d = described.describe(content_type)
+                self._monolithic_upload(location, d, io.BytesIO(body))
+                return d
+
+            location = self._chunked_upload(
+                sessions.Session(location, 0, min_chunk), described)
+            d = described.describe(content_type)
+            self._finalize_upload(location, d)
+            return d
+
+    def mount_blob(self, repository: str, digest: descriptor.Digest, source: str) -> bool:
+        with trace.operation("mount blob", repository=repository, digest=digest, source=source):
+            query = urlparse.urlencode({"mount": str(digest), "from": source})
+            req = urlreq.Request(
+                f"{self._proto}://{self._registry}/v2/{repository}/blobs/uploads/?{query}", method="POST")
+
+            with self._opener.open(req) as rh:
+                resp = T.cast(http.HTTPResponse, rh)
+                if resp.status == 201:
+                    return True
+
+                # registry declined and opened a regular upload instead, nothing
+                # is going to be sent to it
+                location = self._location(resp) if resp.status == 202 else None
+
+            if location is not None:
+                with self._opener.open(urlreq.Request(location, method="DELETE")) as rh:
+                    resp = T.cast(http.HTTPResponse, rh)
+                    # an upload the registry already dropped has nothing to cancel
+                    if resp.status >= 400 and resp.status != 404:
+                        raise UploadFailed(location, resp.status)
+
+            return False
+
+    def _is_monolithic(self, size: int) -> bool:
+        if self._strategy == UploadStrategy.Auto:
+            return size <= BlobPusher._MONOLITHIC_MAX
+        return self._strategy == UploadStrategy.Monolithic
+
+    def _start_upload(self, repository: str) -> T.Tuple[str, int]:
         req = urlreq.Request(
             f"{self._proto}://{self._registry}/v2/{repository}/blobs/uploads/", method="POST")
 
         with self._opener.open(req) as rh:
             resp = T.cast(http.HTTPResponse, rh)
-            location = resp.getheader("location")
+            min_chunk = int(resp.getheader("oci-chunk-min-length")
+                            or BlobPusher._MIN_CHUNK_SIZE)
+            return self._location(resp), max(min_chunk, BlobPusher._MIN_CHUNK_SIZE)
+
+    def _resume(self, key: str) -> T.Optional[sessions.Session]:
+        if self._sessions is None or (session := self._sessions.load(key)) is None:
+            return None
 
-        location = self._chunked_upload(
-            T.cast(str, location), descriptor, content)
-        self._finalize_upload(location, descriptor)
+        if (status := self._upload_status(session.location)) is None:
+            # the registry has forgotten about it, start over
+            self._sessions.remove(key)
+            return None
 
-    def _chunked_upload(self, location: str, descriptor: descriptor.Descriptor, content: streams.Reader) -> str:
-        offset = 0
+        session.location, session.offset = status
+        return session
 
-        while offset < descriptor.bytes:
-            chunk = content.read(BlobPusher._MIN_CHUNK_SIZE)
-            chunk_start = offset
-            chunk_end = offset + len(chunk) - 1  # content range is 0 indexed
+    def _upload_status(self, location: str) -> T.Optional[T.Tuple[str, int]]:
+        """
+        Asks the registry how much of an upload it has, the Range header
+        covers every byte it has received so far.
+        """
+        req = urlreq.Request(location, method="GET")
 
-            b = url.Builder.from_str(location)
-            this_url = str(b)
+        with self._opener.open(req) as rh:
+            resp = T.cast(http.HTTPResponse, rh)
+            if resp.status != 204:
+                return None
 
+            if resp.getheader("location") is not None:
+                location = self._location(resp)
+
+            # registries report an empty upload as 0-0 too
+            _, _, end = (resp.getheader("range") or "0-0").partition("-")
+            return location, int(end) + 1 if int(end) > 0 else 0
+
+    def _monolithic_upload(self, location: str, descriptor: descriptor.Descriptor, content: streams.Reader) -> None:
+        builder = url.Builder(urlparse.urlparse(location))
+        builder.query["digest"] = [str(descriptor.digest)]
+
+        req = urlreq.Request(
+            str(builder),
+            method="PUT",
+            data=content,
+            headers={
+                "Content-Length": str(descriptor.bytes),
+                "Content-Type": "application/octet-stream",
+            })
+
+        with self._opener.open(req):
+            pass
+
+    def _chunked_upload(self, session: sessions.Session, content: streams.Reader, key: T.Optional[str] = None) -> str:
+        sizer = ChunkSizer(session.min_chunk)
+
+        while chunk := content.read(sizer.size):
+            started = time.monotonic()
+            session.location = self._send_chunk(
+                session.location, chunk, session.offset)
+            sizer.measure(len(chunk), time.monotonic() - started)
+            session.offset += len(chunk)
+
+            if key is not None and self._sessions is not None:
+                self._sessions.save(key, session)
+
+        return session.location
+
+    def _send_chunk(self, location: str, chunk: bytes, offset: int) -> str:
+        """
+        When a PATCH fails the registry is asked how much of the upload it
+        has and only the rest of the chunk is sent again.
+        """
+        sent, attempts = 0, 0
+
+        while True:
+            rest = chunk[sent:]
             req = urlreq.Request(
-                this_url,
+                location,
                 method="PATCH",
-                data=chunk,
+                data=rest,
                 headers={
-                    "Content-Length": str(len(chunk)),
-                    "Content-Range": f"{chunk_start}-{chunk_end}",
+                    "Content-Length": str(len(rest)),
+                    # content range is 0 indexed
+                    "Content-Range": f"{offset + sent}-{offset + len(chunk) - 1}",
                     "Content-Type": "application/octet-stream",
                 })
 
-            with self._opener.open(req) as rh:
-                resp = T.cast(http.HTTPResponse, rh)
-                builder = url.Builder(urlparse.urlparse(
-                    T.cast(str, resp.getheader("location"))))
-                builder.host = self._registry
-                builder.scheme = self._proto
-                location = str(builder)
+            try:
+                with self._opener.open(req) as rh:
+                    resp = T.cast(http.HTTPResponse, rh)
+                    if resp.status < 400:
+                        return self._location(resp)
+
+                    failure: Exception = UploadFailed(location, resp.status)
+            except (OSError, http.HTTPException) as e:
+                failure = e
+
+            if (attempts := attempts + 1) == BlobPusher._PATCH_ATTEMPTS:
+                raise failure
 
-            offset += len(chunk)
+            if (status := self._upload_status(location)) is None:
+                raise failure
 
-        return location
+            location, received = status
+            if not offset <= received <= offset + len(chunk):
+                raise failure
+
+            if (sent := received - offset) == len(chunk):
+                return location
+
+    def _location(self, resp: http.HTTPResponse) -> str:
+        return _rebase(T.cast(str, resp.getheader("location")), self._registry, self._proto)
 
     def _finalize_upload(self, location: str, descriptor: descriptor.Descriptor) -> None:
         builder = url.Builder(urlparse.urlparse(location))
@@ -70,29 +275,60 @@ class BlobPusher(blob.Pusher):
         builder.query["digest"] = [str(descriptor.digest)]
         req = urlreq.Request(str(builder), method="PUT")
 
-        with self._opener.open(req):
-            pass
+        with self._opener.open(req) as rh:
+            resp = T.cast(http.HTTPResponse, rh)
+            if resp.status >= 400:
+                raise UploadFailed(location, resp.status)
+
+
+@functools.lru_cache(maxsize=64)
+def _rebase(location: str, registry: str, proto: str) -> str:
+    # registries often hand back the same location for every chunk, only
+    # parse it when it changes
+    builder = url.Builder(urlparse.urlparse(location))
+    builder.host = registry
+    builder.scheme = proto
+    return str(builder)
 
 
 @dc.dataclass()
 class BlobPuller(blob.Puller):
     _registry: str
-    _opener: urlreq.OpenerDirector
+    _opener: pool.Opener
     _proto: str = "https"
 
     def does_blob_exist(self, repository: str, digest: descriptor.Digest) -> bool:
-        req = urlreq.Request(
-            f"{self._proto}://{self._registry}/v2/{repository}/blobs/{digest}")
+        with trace.operation("existence check", repository=repository, digest=digest):
+            req = urlreq.Request(
+                f"{self._proto}://{self._registry}/v2/{repository}/blobs/{digest}",
+                method="HEAD",
+            )
 
-        with self._opener.open(req) as rh:
-            resp = T.cast(http.HTTPResponse, rh)
-            return resp.status == 200
+            with self._opener.open(req) as rh:
+                resp = T.cast(http.HTTPResponse, rh)
+                return resp.status == 200
 
-    def pull_blob(self, repository: str, digest: descriptor.Digest) -> streams.MustCloseReader:
-        req = urlreq.Request(
-            f"{self._proto}://{self._registry}/v2/{repository}/blobs/{digest}")
-        rh = self._opener.open(req)
-        return httpreader(T.cast(http.HTTPResponse, rh))
+    def pull_blob(self, repository: str, digest: descriptor.Digest, offset: int = 0) -> streams.MustCloseReader:
+        with trace.operation("pull blob", repository=repository, digest=digest):
+            req = urlreq.Request(
+                f"{self._proto}://{self._registry}/v2/{repository}/blobs/{digest}")
+
+            if offset:
+                req.add_header("Range", f"bytes={offset}-")
+
+            resp = T.cast(http.HTTPResponse, self._opener.open(req))
+
+            if resp.status not in (200, 206):
+                resp.close()
+                raise BlobUnavailable(repository, digest, resp.status)
+
+            reader = httpreader(resp)
+
+            if offset and resp.status == 200:
+                # registry ignored the range, throw away what we already have
+                streams.skip(reader, offset)
+
+            return reader
 
 
 @dc.dataclass()
@@ -102,5 +338,8 @@ class httpreader(streams.MustCloseReader):
     def read(self, s: int = 0) -> bytes:
         return self._inner.read(s)
 
+    def readinto(self, b: memoryview) -> int:
+        return self._inner.readinto(b)
+
     def close(self):
         self._inner.close()
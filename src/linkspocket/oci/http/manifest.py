@@ -6,73 +6,152 @@ import urllib.request as urlreq
 
 from linkspocket.oci.core import descriptor
 
+from ...errors import PocketError
+from ...httplib import pool, trace
 from .. import json as ocijson
-from ..core import manifest
+from ..core import cache, manifest
+
+
+class ManifestRejected(PocketError):
+    def __init__(self, repository: str, reference: str, status: int):
+        super().__init__(f"Could not push manifest {repository}:{reference}: HTTP {status}")
+
+
+class ManifestMismatch(PocketError):
+    def __init__(self, repository: str, reference: str, got: str, want: str):
+        super().__init__(f"Manifest {repository}:{reference} is {got}, the registry said {want}")
 
 
 @dc.dataclass()
 class ManifestPusher(manifest.Pusher):
     _registry: str
-    _opener: urlreq.OpenerDirector
+    _opener: pool.Opener
     _proto: str = "https"
 
     def push_manifest(
         self, repository: str, reference: str, manifest: manifest.Manifest
     ) -> None:
         serialized = json.dumps(manifest, cls=ocijson.OciEncoder, indent=4)
-        encoded_manifest = serialized.encode()
+        self.push_manifest_bytes(
+            repository, reference, serialized.encode(), ocijson.MANIFEST_TYPE)
 
-        req = urlreq.Request(
-            f"{self._proto}://{self._registry}/v2/{repository}/manifests/{reference}",
-            method="PUT",
-            data=encoded_manifest,
-        )
-        req.add_header(
-            "Content-Type", "application/vnd.oci.image.manifest.v1+json")
+    def push_manifest_bytes(
+        self, repository: str, reference: str, body: bytes, content_type: str
+    ) -> None:
+        """
+        Pushes a manifest exactly as given, its digest stays the same as
+        wherever it came from
+        """
+        with trace.operation("push manifest", repository=repository, reference=reference):
+            req = urlreq.Request(
+                f"{self._proto}://{self._registry}/v2/{repository}/manifests/{reference}",
+                method="PUT",
+                data=body,
+            )
+            req.add_header("Content-Type", content_type)
 
-        with self._opener.open(req):
-            pass
+            with self._opener.open(req) as rh:
+                resp = T.cast(http.HTTPResponse, rh)
+                if resp.status >= 400:
+                    raise ManifestRejected(repository, reference, resp.status)
 
 
 @dc.dataclass()
 class ManifestPuller(manifest.Puller):
     _registry: str
-    _opener: urlreq.OpenerDirector
+    _opener: pool.Opener
     _proto: str = "https"
+    _cache: T.Optional[cache.ManifestCache] = None
 
     def does_manifest_exist(self, repository: str, reference: str) -> bool:
-        req = urlreq.Request(
-            f"{self._proto}://{self._registry}/v2/{repository}/manifests/{reference}",
-            method="HEAD",
-        )
+        with trace.operation("manifest existence check", repository=repository, reference=reference):
+            if _is_digest(reference) and self._cached(repository, reference) is not None:
+                return True
 
-        req.add_header(
-            "Content-Type", "application/vnd.oci.image.manifest.v1+json")
+            req = urlreq.Request(
+                f"{self._proto}://{self._registry}/v2/{repository}/manifests/{reference}",
+                method="HEAD",
+            )
+
+            req.add_header("Content-Type", ocijson.MANIFEST_TYPE)
 
-        with self._opener.open(req) as rh:
-            resp = T.cast(http.HTTPResponse, rh)
-            return resp.status == 200
+            with self._opener.open(req) as rh:
+                resp = T.cast(http.HTTPResponse, rh)
+                return resp.status == 200
 
     def pull_manifest(
         self, repository: str, reference: str
     ) -> T.Optional[manifest.Manifest]:
-        req = urlreq.Request(
-            f"{self._proto}://{self._registry}/v2/{repository}/manifests/{reference}",
-            method="GET",
-        )
-
-        req.add_header(
-            "Accept", "application/vnd.oci.image.manifest.v1+json")
-
-        with self._opener.open(req) as rh:
-            resp = T.cast(http.HTTPResponse, rh)
-            j = json.load(resp)
-            m = manifest.Manifest(
-                j.get("artifactType", j.get("mediaType", "")),
-                descriptor.load_from(j["config"]),
+        entry = self.fetch_manifest(repository, reference)
+        return entry.manifest if entry is not None else None
+
+    def fetch_manifest(
+        self, repository: str, reference: str
+    ) -> T.Optional[cache.CachedManifest]:
+        """
+        Pulls a manifest along with the bytes and digest the registry sent for
+        it. While the cached copy is current, that cached entry is what comes
+        back.
+        """
+        with trace.operation("pull manifest", repository=repository, reference=reference):
+            cached = self._cached(repository, reference)
+
+            # what a digest points at never changes
+            if cached is not None and _is_digest(reference):
+                self._count(hit=True)
+                return cached
+
+            req = urlreq.Request(
+                f"{self._proto}://{self._registry}/v2/{repository}/manifests/{reference}",
+                method="GET",
             )
 
-            for l in j["layers"]:
-                m.add_layer(descriptor.load_from(l))
+            req.add_header("Accept", ocijson.MANIFEST_TYPE)
+
+            if cached is not None and cached.etag is not None:
+                req.add_header("If-None-Match", cached.etag)
+
+            with self._opener.open(req) as rh:
+                resp = T.cast(http.HTTPResponse, rh)
+
+                if resp.status == 304 and cached is not None:
+                    self._count(hit=True)
+                    return cached
+
+                if resp.status != 200:
+                    return None
+
+                body = resp.read()
+                etag = resp.getheader("etag")
+                digest = str(descriptor.from_bytes(body, "").digest)
+
+                # it's cached under its digest, which has to be the one of the
+                # bytes that came back
+                for want in (resp.getheader("docker-content-digest"), reference if _is_digest(reference) else None):
+                    if want is not None and want != digest:
+                        raise ManifestMismatch(repository, reference, digest, want)
+
+            if self._cache is None:
+                return cache.CachedManifest(digest, etag, ocijson.load_manifest(json.loads(body)), body)
+
+            self._count(hit=False)
+            entry = self._cache.put(self._key(repository, reference), digest, etag, body)
+            self._cache.put(self._key(repository, digest), digest, etag, body)
+            return entry
+
+    def _cached(self, repository: str, reference: str) -> T.Optional[cache.CachedManifest]:
+        if self._cache is None:
+            return None
+        return self._cache.get(self._key(repository, reference))
+
+    def _count(self, hit: bool) -> None:
+        if self._cache is not None:
+            self._cache.count(hit)
+
+    def _key(self, repository: str, reference: str) -> str:
+        sep = "@" if _is_digest(reference) else ":"
+        return f"{self._registry}/{repository}{sep}{reference}"
+
 
-        return m
+def _is_digest(reference: str) -> bool:
+    return ":" in reference
@@ -0,0 +1,69 @@
+# Chunked uploads can outlive the process that started them. The registry keeps
+# an upload session open at its Location, recording where it is lets a later
+# push continue it rather than sending every byte again.
+
+import dataclasses as dc
+import json
+import os
+import pathlib
+import threading
+import typing as T
+
+
+@dc.dataclass()
+class Session:
+    location: str
+    offset: int
+    min_chunk: int
+
+
+class Sessions(T.Protocol):
+    def load(self, key: str) -> T.Optional[Session]:
+        ...
+
+    def save(self, key: str, session: Session) -> None:
+        ...
+
+    def remove(self, key: str) -> None:
+        ...
+
+
+class FileSessions(Sessions):
+    """
+    Keeps sessions in a single JSON file, rewritten whole on every change
+    """
+
+    def __init__(self, path: pathlib.Path):
+        self._path = path
+        self._lock = threading.Lock()
+
+    def load(self, key: str) -> T.Optional[Session]:
+        with self._lock:
+            if (s := self._read().get(key)) is None:
+                return None
+            return Session(**s)
+
+    def save(self, key: str, session: Session) -> None:
+        with self._lock:
+            sessions = self._read()
+            sessions[key] = dc.asdict(session)
+            self._write(sessions)
+
+    def remove(self, key: str) -> None:
+        with self._lock:
+            sessions = self._read()
+            if sessions.pop(key, None) is not None:
+                self._write(sessions)
+
+    def _read(self) -> T.Dict[str, T.Any]:
+        try:
+            with self._path.open() as fh:
+                return json.load(fh)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _write(self, sessions: T.Dict[str, T.Any]) -> None:
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self._path.with_name(f"{self._path.name}.{os.getpid()}")
+        tmp.write_text(json.dumps(sessions))
+        tmp.replace(self._path)
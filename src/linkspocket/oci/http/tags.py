@@ -0,0 +1,64 @@
+import dataclasses as dc
+import http.client as http
+import json
+import re
+import typing as T
+import urllib.parse as urlparse
+import urllib.request as urlreq
+
+from ...errors import PocketError
+from ...httplib import pool, trace
+from ..core import tags
+
+
+class TagsUnavailable(PocketError):
+    def __init__(self, repository: str, status: int):
+        super().__init__(f"Could not list tags of {repository}: HTTP {status}")
+
+
+# <url>; rel="next", possibly among other links
+_next_re = re.compile(r'<([^>]*)>\s*;[^,]*\brel="?next"?')
+
+
+@dc.dataclass()
+class TagLister(tags.Lister):
+    """
+    Yields tags a page at a time, the next page is only asked for once the
+    previous one has been used up so a repository with any number of tags
+    takes the same memory to walk.
+    """
+
+    _registry: str
+    _opener: pool.Opener
+    _proto: str = "https"
+    # how many tags to ask for per page, None leaves it to the registry
+    _page_size: T.Optional[int] = None
+
+    def list_tags(self, repository: str) -> T.Iterator[str]:
+        url: T.Optional[str] = f"{self._proto}://{self._registry}/v2/{repository}/tags/list"
+        if self._page_size is not None:
+            url = f"{url}?n={self._page_size}"
+
+        while url is not None:
+            # the operation can't stay open across the yield, the caller's
+            # requests would be counted as listing tags
+            with trace.operation("list tags", repository=repository), self._opener.open(urlreq.Request(url)) as rh:
+                resp = T.cast(http.HTTPResponse, rh)
+
+                # a repository that was never pushed to has no tags
+                if resp.status == 404:
+                    return
+
+                if resp.status != 200:
+                    raise TagsUnavailable(repository, resp.status)
+
+                page = json.load(resp).get("tags") or []
+                url = _next_page(url, resp.getheader("link"))
+
+            yield from page
+
+
+def _next_page(url: str, link: T.Optional[str]) -> T.Optional[str]:
+    if link is None or (m := _next_re.search(link)) is None:
+        return None
+    return urlparse.urljoin(url, m.group(1))
@@ -2,6 +2,9 @@ import json
 import typing as T
 from .core import descriptor, manifest
 
+MANIFEST_TYPE = "application/vnd.oci.image.manifest.v1+json"
+
+
 class OciEncoder(json.JSONEncoder):
     def default(self, obj: object) -> T.Any:
         if isinstance(obj, descriptor.Digest):
@@ -18,7 +21,7 @@ class OciEncoder(json.JSONEncoder):
         if isinstance(obj, manifest.Manifest):
             m = {
                 "schemaVersion": 2,
-                "mediaType": "application/vnd.oci.image.manifest.v1+json",
+                "mediaType": MANIFEST_TYPE,
                 "config": obj.config,
                 "layers": [d for d in obj.layers],
             }
@@ -26,3 +29,23 @@ class OciEncoder(json.JSONEncoder):
                 m["annotations"] = obj.annotations.copy()
             return m
         super().default(obj)
+
+
+def load_manifest(j: T.Dict[str, T.Any]) -> manifest.Manifest:
+    m = manifest.Manifest(
+        j.get("artifactType", j.get("mediaType", "")),
+        descriptor.load_from(j["config"]),
+    )
+
+    for l in j["layers"]:
+        m.add_layer(descriptor.load_from(l))
+
+    return m
+
+
+def media_type(body: bytes) -> str:
+    """
+    The media type a manifest's body says it is, a parsed Manifest has its
+    artifact type instead when there is one
+    """
+    return json.loads(body).get("mediaType") or MANIFEST_TYPE
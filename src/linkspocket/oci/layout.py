@@ -0,0 +1,301 @@
+# An OCI image layout holds manifests and blobs without a registry: an
+# oci-layout file naming the version, an index.json listing the manifests with
+# their tags as ref.name annotations, and every blob, manifests included, at
+# blobs/<algorithm>/<hex>. It is either a directory or a tar of one.
+#
+# Blobs are streamed through in both directions, never held in memory whole.
+
+import dataclasses as dc
+import io
+import json
+import os
+import pathlib
+import sys
+import tarfile
+import threading
+import typing as T
+
+from .. import streams
+from ..errors import PocketError
+from . import json as ocijson
+from .core import descriptor
+
+VERSION = "1.0.0"
+INDEX_TYPE = "application/vnd.oci.image.index.v1+json"
+REF_NAME_ANNOTATION = "org.opencontainers.image.ref.name"
+
+_LAYOUT_FILE = "oci-layout"
+_INDEX_FILE = "index.json"
+
+
+class InvalidLayout(PocketError):
+    def __init__(self, where: str, reason: str):
+        super().__init__(f"{where} is not an OCI image layout, {reason}")
+
+
+class CorruptBlob(PocketError):
+    def __init__(self, expected: descriptor.Digest, got: descriptor.Digest):
+        super().__init__(f"Expected {expected} but read {got}")
+
+
+def _blob_name(digest: descriptor.Digest) -> str:
+    return f"blobs/{digest.algo}/{digest.hexhash()}"
+
+
+def _layout() -> bytes:
+    return json.dumps({"imageLayoutVersion": VERSION}).encode()
+
+
+def _index(manifests: T.List[descriptor.Descriptor]) -> bytes:
+    return json.dumps(
+        {"schemaVersion": 2, "mediaType": INDEX_TYPE, "manifests": manifests},
+        cls=ocijson.OciEncoder, indent=4).encode()
+
+
+def _verify(d: descriptor.Descriptor, r: descriptor.DescribingReader) -> None:
+    if (got := r.describe(d.content_type)).digest != d.digest:
+        raise CorruptBlob(d.digest, got.digest)
+
+
+class Writer(T.Protocol):
+    # whether write_blob can be called from several threads at once
+    concurrent: bool
+
+    def has_blob(self, digest: descriptor.Digest) -> bool:
+        ...
+
+    def write_blob(self, d: descriptor.Descriptor, r: streams.Reader) -> None:
+        ...
+
+    def finish(self, manifests: T.List[descriptor.Descriptor]) -> None:
+        ...
+
+    def close(self) -> None:
+        ...
+
+
+class DirWriter(Writer):
+    """
+    Writes into a directory, adding to a layout already there. Blobs it
+    already has are kept and manifests are added to its index, replacing any
+    with the same tag.
+    """
+
+    concurrent = True
+
+    def __init__(self, root: pathlib.Path):
+        self._root = root
+        self._root.mkdir(parents=True, exist_ok=True)
+
+    def has_blob(self, digest: descriptor.Digest) -> bool:
+        return self._root.joinpath(_blob_name(digest)).exists()
+
+    def write_blob(self, d: descriptor.Descriptor, r: streams.Reader) -> None:
+        dest = self._root.joinpath(_blob_name(d.digest))
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        tmp = dest.with_name(f".{dest.name}.{os.getpid()}.{threading.get_ident()}")
+
+        described = descriptor.DescribingReader(r)
+        try:
+            with tmp.open("wb") as fh:
+                while b := described.read(1024 * 1024):
+                    fh.write(b)
+            _verify(d, described)
+            tmp.replace(dest)
+        finally:
+            tmp.unlink(missing_ok=True)
+
+    def finish(self, manifests: T.List[descriptor.Descriptor]) -> None:
+        tags = {m.annotations.get(REF_NAME_ANNOTATION) for m in manifests}
+        kept: T.List[descriptor.Descriptor] = []
+        if self._root.joinpath(_INDEX_FILE).exists():
+            kept = [m for m in DirReader(self._root).index()
+                    if m.annotations.get(REF_NAME_ANNOTATION) not in tags]
+
+        self._replace(_LAYOUT_FILE, _layout())
+        self._replace(_INDEX_FILE, _index(kept + manifests))
+
+    def close(self) -> None:
+        pass
+
+    def _replace(self, name: str, content: bytes) -> None:
+        tmp = self._root.joinpath(f".{name}.{os.getpid()}")
+        tmp.write_bytes(content)
+        tmp.replace(self._root.joinpath(name))
+
+
+@dc.dataclass()
+class _exact(streams.Reader):
+    """
+    tarfile takes a short read as the end of the file, this keeps reading
+    until it has what was asked for or there is nothing left.
+    """
+
+    r: streams.Reader
+
+    def read(self, s: int = 0) -> bytes:
+        if s <= 0:
+            return self.r.read(s)
+
+        b = self.r.read(s)
+        if len(b) == s or not b:
+            return b
+
+        out = bytearray(b)
+        while len(out) < s and (b := self.r.read(s - len(out))):
+            out += b
+        return bytes(out)
+
+
+class TarWriter(Writer):
+    """
+    Writes a tar as a stream, so it can go to a pipe. Nothing can be read
+    back, only blobs written through it count as had.
+    """
+
+    concurrent = False
+
+    def __init__(self, fh: T.BinaryIO, owned: bool = True):
+        self._fh = fh
+        # stdout is left open for whatever else wants to write to it
+        self._owned = owned
+        self._tar = tarfile.open(fileobj=fh, mode="w|", format=tarfile.PAX_FORMAT)
+        self._written: T.Set[str] = set()
+        self._add(_LAYOUT_FILE, _layout())
+
+    def has_blob(self, digest: descriptor.Digest) -> bool:
+        return str(digest) in self._written
+
+    def write_blob(self, d: descriptor.Descriptor, r: streams.Reader) -> None:
+        described = descriptor.DescribingReader(r)
+        self._tar.addfile(self._info(_blob_name(d.digest), d.bytes), _exact(described))
+        _verify(d, described)
+        self._written.add(str(d.digest))
+
+    def finish(self, manifests: T.List[descriptor.Descriptor]) -> None:
+        self._add(_INDEX_FILE, _index(manifests))
+
+    def close(self) -> None:
+        self._tar.close()
+        if self._owned:
+            self._fh.close()
+        else:
+            self._fh.flush()
+
+    def _add(self, name: str, content: bytes) -> None:
+        self._tar.addfile(self._info(name, len(content)), io.BytesIO(content))
+
+    def _info(self, name: str, size: int) -> tarfile.TarInfo:
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mode = 0o644
+        return info
+
+
+def writer(out: str) -> Writer:
+    """
+    - is a tar written to stdout, a path ending in .tar is a tar file and
+    anything else is a directory
+    """
+    if out == "-":
+        return TarWriter(sys.stdout.buffer, owned=False)
+    if out.endswith(".tar"):
+        return TarWriter(open(out, "wb"))
+    return DirWriter(pathlib.Path(out))
+
+
+class Reader(T.Protocol):
+    def index(self) -> T.List[descriptor.Descriptor]:
+        ...
+
+    def open_blob(self, d: descriptor.Descriptor) -> streams.MustCloseReader:
+        ...
+
+    def read_blob(self, d: descriptor.Descriptor) -> bytes:
+        ...
+
+
+@dc.dataclass()
+class DirReader(Reader):
+    root: pathlib.Path
+
+    def index(self) -> T.List[descriptor.Descriptor]:
+        try:
+            index = json.loads(self.root.joinpath(_INDEX_FILE).read_bytes())
+        except FileNotFoundError:
+            raise InvalidLayout(str(self.root), f"it has no {_INDEX_FILE}")
+        return [descriptor.load_from(m) for m in index.get("manifests", [])]
+
+    def open_blob(self, d: descriptor.Descriptor) -> streams.MustCloseReader:
+        return streams.mapped(self.root.joinpath(_blob_name(d.digest)).open("rb"))
+
+    def read_blob(self, d: descriptor.Descriptor) -> bytes:
+        return self.root.joinpath(_blob_name(d.digest)).read_bytes()
+
+
+@dc.dataclass()
+class _section(streams.MustCloseReader):
+    fh: T.BinaryIO
+    left: int
+
+    def read(self, s: int = 0) -> bytes:
+        b = self.fh.read(self.left if s <= 0 else min(s, self.left))
+        self.left -= len(b)
+        return b
+
+    def close(self):
+        self.fh.close()
+
+
+class TarReader(Reader):
+    """
+    Finds where each member's data starts once, then every blob is read
+    through its own file handle so blobs can be read at the same time.
+    """
+
+    def __init__(self, path: pathlib.Path):
+        self._path = path
+        self._members: T.Dict[str, T.Tuple[int, int]] = {}
+
+        try:
+            with tarfile.open(path, "r:") as tar:
+                for m in tar:
+                    if m.isfile():
+                        name = m.name[2:] if m.name.startswith("./") else m.name
+                        self._members[name] = (m.offset_data, m.size)
+        except tarfile.TarError as e:
+            raise InvalidLayout(str(path), str(e))
+
+    def index(self) -> T.List[descriptor.Descriptor]:
+        if _INDEX_FILE not in self._members:
+            raise InvalidLayout(str(self._path), f"it has no {_INDEX_FILE}")
+        index = json.loads(self._read(_INDEX_FILE))
+        return [descriptor.load_from(m) for m in index.get("manifests", [])]
+
+    def open_blob(self, d: descriptor.Descriptor) -> streams.MustCloseReader:
+        return self._open(_blob_name(d.digest))
+
+    def read_blob(self, d: descriptor.Descriptor) -> bytes:
+        return self._read(_blob_name(d.digest))
+
+    def _open(self, name: str) -> _section:
+        if (member := self._members.get(name)) is None:
+            raise InvalidLayout(str(self._path), f"{name} is missing")
+
+        offset, size = member
+        fh = self._path.open("rb")
+        fh.seek(offset)
+        return _section(fh, size)
+
+    def _read(self, name: str) -> bytes:
+        r = self._open(name)
+        try:
+            return r.read(-1)
+        finally:
+            r.close()
+
+
+def reader(src: pathlib.Path) -> Reader:
+    if src.is_dir():
+        return DirReader(src)
+    return TarReader(src)
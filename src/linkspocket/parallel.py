@@ -0,0 +1,101 @@
+import concurrent.futures as futures
+import dataclasses as dc
+import threading
+import typing as T
+
+from . import streams
+from .errors import PocketError
+
+R = T.TypeVar("R")
+
+
+class Cancelled(PocketError):
+    def __init__(self):
+        super().__init__("Cancelled after another transfer failed")
+
+
+class Failures(PocketError):
+    def __init__(self, errors: T.Sequence[BaseException]):
+        super().__init__("\n".join(str(e) or repr(e) for e in errors))
+        self.errors = errors
+
+
+@dc.dataclass()
+class Cancel:
+    _event: threading.Event = dc.field(default_factory=threading.Event)
+
+    def cancel(self) -> None:
+        self._event.set()
+
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def check(self) -> None:
+        if self._event.is_set():
+            raise Cancelled()
+
+
+@dc.dataclass()
+class CancellableReader(streams.Reader):
+    """
+    Stops a transfer at its next read once its group has been cancelled
+    """
+
+    r: streams.Reader
+    c: Cancel
+
+    def read(self, s: int = 0) -> bytes:
+        self.c.check()
+        return self.r.read(s)
+
+    def readinto(self, b: memoryview) -> int:
+        self.c.check()
+        return streams.readinto(self.r, b)
+
+
+Task = T.Callable[[Cancel], R]
+
+
+def run(jobs: int, tasks: T.Sequence[Task[R]]) -> T.List[R]:
+    """
+    Runs every task on at most `jobs` threads and returns their results in
+    order. The first failure cancels everything that hasn't finished yet and
+    is raised once every worker has stopped.
+    """
+    cancel = Cancel()
+
+    if jobs <= 1:
+        return [t(cancel) for t in tasks]
+
+    with futures.ThreadPoolExecutor(max_workers=jobs) as ex:
+        running = [ex.submit(t, cancel) for t in tasks]
+        futures.wait(running, return_when=futures.FIRST_EXCEPTION)
+
+        if any(f.done() and f.exception() is not None for f in running):
+            cancel.cancel()
+            for f in running:
+                f.cancel()
+
+    # report what went wrong rather than the cancellations it caused
+    for f in running:
+        if not f.cancelled() and (e := f.exception()) is not None and not isinstance(e, Cancelled):
+            raise e
+
+    return [f.result() for f in running]
+
+
+def collect(jobs: int, tasks: T.Sequence[Task[R]]) -> T.List[R]:
+    """
+    Runs every task on at most `jobs` threads and returns their results in
+    order. Unlike `run` a failure doesn't stop the other tasks, every failure
+    is raised together once all of them have finished.
+    """
+    cancel = Cancel()
+
+    with futures.ThreadPoolExecutor(max_workers=max(jobs, 1)) as ex:
+        running = [ex.submit(t, cancel) for t in tasks]
+
+    if errors := [e for f in running if (e := f.exception()) is not None]:
+        raise Failures(errors)
+
+    return [f.result() for f in running]
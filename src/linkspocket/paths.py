@@ -0,0 +1,7 @@
+import os
+import pathlib
+
+
+def cache_dir() -> pathlib.Path:
+    base = os.environ.get("XDG_CACHE_HOME") or pathlib.Path.home().joinpath(".cache")
+    return pathlib.Path(base).joinpath("linkspocket")
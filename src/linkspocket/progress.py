@@ -1,8 +1,14 @@
+# Reads only count bytes, everything on screen is drawn by a Board from a
+# background thread a few times a second no matter how many reads there were
+# in between. A terminal gets a line per transfer that is redrawn in place,
+# anything else gets a plain line now and then.
+
 import dataclasses as dc
-import io
+import threading
+import time
 import typing as T
-from . import console as C
 
+from . import console as C
 from . import streams
 
 
@@ -10,133 +16,243 @@ def bar(
     progress: float, total: float, filled: str, unfilled: str, scale: int = 100
 ) -> str:
     """forestall + trafuri"""
-    percent = int(scale * progress / total)
+    percent = int(scale * progress / total) if total else scale
     return (filled * percent) + (unfilled * (scale - percent))
 
 
-class Render(T.Protocol):
-    def tick(self, n: float) -> str:
-        ...
-
-
-@dc.dataclass()
-class _progress(Render):
-    total: float
-    progress: float = dc.field(init=False, default=0.0)
-
-    def tick(self, n: float) -> str:
-        self.progress += n
-        return ""
-
-
-@dc.dataclass()
-class Bar(_progress):
-    filled: str
-    unfilled: str
-
-    def tick(self, n: float) -> str:
-        super().tick(n)
-        return bar(self.progress, self.total, self.filled, self.unfilled)
-
-
-@dc.dataclass()
-class Percentage(_progress):
-    def tick(self, n: float) -> str:
-        super().tick(n)
-        percent = (self.progress / self.total) * 100
-        return f"{percent:>6.2f}%"
-
-
-@dc.dataclass()
-class Spinner(Render):
-    states: T.Sequence[str]
-    ticks: int = dc.field(init=False, default=0)
+def size(n: float) -> str:
+    for unit in ("B", "KiB", "MiB"):
+        if n < 1024:
+            return f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} GiB"
 
-    def tick(self, n) -> str:
-        self.ticks += 1
-        return self.states[self.ticks % len(self.states)]
 
+def duration(s: float) -> str:
+    m, s = divmod(int(s), 60)
+    h, m = divmod(m, 60)
+    return f"{h}:{m:02}:{s:02}" if h else f"{m}:{s:02}"
 
-@dc.dataclass()
-class Static(Render):
-    s: str
 
-    def tick(self, n) -> str:
-        return self.s
+_SPINNER = [
+    f"{C.fg(70)}◌{C.reset()}",
+    f"{C.fg(76)}◎{C.reset()}",
+    f"{C.fg(82)}◍{C.reset()}",
+    f"{C.fg(156)}●{C.reset()}",
+    f"{C.fg(82)}◍{C.reset()}",
+    f"{C.fg(76)}◎{C.reset()}",
+]
 
 
 @dc.dataclass()
-class Many(Render):
-    r: T.Sequence[Render]
-
-    def tick(self, n: float) -> str:
-        b = io.StringIO(newline=None)
-
-        for r in self.r:
-            b.write(r.tick(n))
-
-        return b.getvalue()
-
-
-@dc.dataclass()
-class MinTick(_progress):
-    r: Render
-    min_tick: float
-    ticks: float = dc.field(init=False, default=0)
-    has_ticked: bool = dc.field(init=False, default=False)
-
-    def tick(self, n: float) -> str:
-        super().tick(n)
-        self.ticks += n
-        should_tick = (
-            not self.has_ticked
-            or self.ticks >= self.min_tick
-            or self.progress == self.total
-        )
-
-        if should_tick:
-            self.has_ticked = True
-            ticks = self.ticks
-            self.ticks = 0
-            return self.r.tick(ticks)
-
-        return ""
-
-
-@dc.dataclass()
-class OnFinalTick(_progress):
-    r: Render
-    display: str
+class Transfer:
+    name: str
+    total: float
+    board: "Board"
+    done: int = 0
+    started: bool = False
+    # what had been done the last time the board looked
+    seen: int = 0
+
+    def advance(self, n: int) -> None:
+        # only ever called from the thread doing the transfer
+        if not self.started:
+            self.started = True
+            self.board._start(self)
+        self.done += n
+        if self.done >= self.total:
+            self.board.wake()
+
+    def finished(self) -> bool:
+        return self.started and self.done >= self.total
+
+
+class Board:
+    """
+    Draws every transfer writing to w from one thread at a fixed rate, along
+    with their combined throughput and how long is left.
+    """
+
+    # how much of the throughput estimate comes from the latest refresh
+    _SMOOTHING = 0.3
+
+    def __init__(self, w: T.TextIO, interval: T.Optional[float] = None):
+        self._w = w
+        self._tty = _isatty(w)
+        self._interval = interval or (0.1 if self._tty else 5.0)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._active: T.List[Transfer] = []
+        self._thread: T.Optional[threading.Thread] = None
+        self._drawn = 0
+        self._rate = 0.0
+        self._last = time.monotonic()
+        self._logged = 0.0
+
+    def add(self, name: str, total: float) -> Transfer:
+        """
+        The transfer is only drawn once something has been read from it, one
+        that never is, like a blob the registry already has, isn't counted in
+        what is left.
+        """
+        return Transfer(name, total, self)
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def write(self, line: str, w: T.Optional[T.TextIO] = None) -> None:
+        """
+        Writes a line to w, or the board's own stream, above the transfers
+        being drawn. They are redrawn under it straight away.
+        """
+        with self._lock:
+            if self._drawn:
+                self._w.write(f"{C.up(self._drawn)}{C.clearbelow()}")
+                self._w.flush()
+                self._drawn = 0
+                self._wake.set()
+
+            w = w or self._w
+            w.write(f"{line}\n")
+            w.flush()
+
+    def close(self) -> None:
+        """
+        Draws whatever finished since the last refresh and forgets transfers
+        that never will.
+        """
+        with self._lock:
+            self._refresh(closing=True)
+            self._active.clear()
+            self._thread = None
+            self._wake.set()
+
+    def _start(self, t: Transfer) -> None:
+        with self._lock:
+            self._active.append(t)
+            if self._thread is None:
+                self._last = time.monotonic()
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(self._interval)
+            self._wake.clear()
+
+            with self._lock:
+                if threading.current_thread() is not self._thread:
+                    return
+
+                self._refresh()
+
+                if not self._active:
+                    self._thread = None
+                    return
+
+    def _refresh(self, closing: bool = False) -> None:
+        now = time.monotonic()
+        moved = 0
+        for t in self._active:
+            moved, t.seen = moved + t.done - t.seen, t.done
+
+        if (elapsed := now - self._last) > 0:
+            rate = moved / elapsed
+            self._rate = rate if not self._rate else (
+                Board._SMOOTHING * rate + (1 - Board._SMOOTHING) * self._rate)
+        self._last = now
+
+        finished = [t for t in self._active if t.finished()]
+        self._active = [t for t in self._active if not t.finished()]
+        shown = [] if closing else list(self._active)
+
+        if self._tty:
+            out = self._draw(finished, shown, now)
+        else:
+            out = self._log(finished, shown, now)
+
+        if out:
+            self._w.write(out)
+            self._w.flush()
+
+    def _draw(self, finished: T.List[Transfer], shown: T.List[Transfer], now: float) -> str:
+        lines = [f" {C.fg(156)}●{C.reset()} {t.name}" for t in finished]
+
+        spinner = _SPINNER[int(now * 10) % len(_SPINNER)]
+        for t in shown:
+            lines.append(
+                f" {spinner} {C.fg(129)}{bar(t.done, t.total, '=', ' ', 40)}{C.reset()}"
+                f" {t.done / t.total * 100 if t.total else 100:>6.2f}% {t.name}")
+
+        if shown:
+            lines.append(f"   {self._summary(shown)}")
+
+        # back up over the last refresh's lines, whatever is left of them is
+        # cleared before drawing
+        out = f"{C.up(self._drawn)}{C.clearbelow()}" if self._drawn else ""
+        self._drawn = len(lines) - len(finished)
+        return out + "".join(f"{line}\n" for line in lines)
+
+    def _log(self, finished: T.List[Transfer], shown: T.List[Transfer], now: float) -> str:
+        lines = [f"{t.name}: done, {size(t.total)}" for t in finished]
+
+        if shown and now - self._logged >= self._interval:
+            self._logged = now
+            lines.extend(
+                f"{t.name}: {t.done / t.total * 100 if t.total else 100:.1f}% of {size(t.total)}" for t in shown)
+            lines.append(self._summary(shown))
+
+        return "".join(f"{line}\n" for line in lines)
+
+    def _summary(self, shown: T.List[Transfer]) -> str:
+        left = sum(max(t.total - t.done, 0) for t in self._active)
+        eta = duration(left / self._rate) if self._rate > 0 else "--:--"
+        return f"{len(shown)} transfers, {size(self._rate)}/s, {eta} left"
+
+
+def _isatty(w: T.TextIO) -> bool:
+    try:
+        return w.isatty()
+    except (AttributeError, ValueError):
+        return False
 
-    def tick(self, n: float) -> str:
-        super().tick(n)
 
-        if self.progress >= self.total:
-            return self.display
+# one board per output stream so concurrent transfers share it
+_boards: T.Dict[int, Board] = {}
+_boards_lock = threading.Lock()
+
 
-        return self.r.tick(n)
+def board(w: T.TextIO) -> Board:
+    with _boards_lock:
+        if (b := _boards.get(id(w))) is None:
+            b = _boards[id(w)] = Board(w)
+        return b
 
 
-@dc.dataclass()
-class Display:
-    r: Render
-    w: T.TextIO
+def close() -> None:
+    with _boards_lock:
+        boards = list(_boards.values())
+        _boards.clear()
 
-    def tick(self, n: float) -> None:
-        d = self.r.tick(n)
-        print(d, end="", flush=True, file=self.w)
+    for b in boards:
+        b.close()
 
 
 @dc.dataclass()
 class Reader(streams.NamedReader):
     r: streams.NamedReader
-    d: Display
+    t: Transfer
 
     def read(self, s: int = 0) -> bytes:
         r = self.r.read(s)
-        self.d.tick(float(len(r)))
+        self.t.advance(len(r))
         return r
 
+    def readinto(self, b: memoryview) -> int:
+        n = streams.readinto(self.r, b)
+        self.t.advance(n)
+        return n
+
     def name(self) -> str:
         return self.r.name()
 
@@ -144,11 +260,11 @@ class Reader(streams.NamedReader):
 @dc.dataclass()
 class Writer(streams.NamedWriter):
     w: streams.NamedWriter
-    d: Display
+    t: Transfer
 
     def write(self, s: T.Optional[bytes]) -> int:
         n = self.w.write(s)
-        self.d.tick(float(n))
+        self.t.advance(n)
         return n
 
     def name(self) -> str:
@@ -156,36 +272,12 @@ class Writer(streams.NamedWriter):
 
 
 def track(s: streams.NamedReader, n: float, w: T.TextIO) -> Reader:
-    return Reader(s, Display(ticker(s.name(), n), w))
-
-
-def ticker(name: str, n: float):
-    r = Many(
-        [
-            Static(f"{C.resetline()} "),
-            Spinner(
-                [
-                    f"{C.fg(70)}◌{C.reset()}",
-                    f"{C.fg(76)}◎{C.reset()}",
-                    f"{C.fg(82)}◍{C.reset()}",
-                    f"{C.fg(156)}●{C.reset()}",
-                    f"{C.fg(82)}◍{C.reset()}",
-                    f"{C.fg(76)}◎{C.reset()}",
-                ]
-            ),
-            Static(f"{C.reset()} "),
-            Bar(filled=f"{C.fg(129)}={C.reset()}",
-                unfilled=" ", total=n),
-            Static(" "),
-            Percentage(n),
-            Static(f" {name}"),
-        ]
-    )
-
-    r = MinTick(r=r, total=n, min_tick=n * 0.032)
-    r = OnFinalTick(
-        r=r,
-        total=n,
-        display=f"{C.resetline()} {C.fg(156)}●{C.reset()} {name}" + "\n",
-    )
-    return r
+    return Reader(s, board(w).add(s.name(), n))
+
+
+def write(line: str, w: T.TextIO, to: T.Optional[T.TextIO] = None) -> None:
+    """
+    Writes a line to to, or w, without the transfers drawn on w drawing over
+    it.
+    """
+    board(w).write(line, to)
@@ -0,0 +1,431 @@
+# A read only registry in front of another one. Manifests are asked for
+# upstream on every request, which costs a 304 while they haven't changed, and
+# are served as the exact bytes upstream sent so their digests hold. Blobs are
+# kept on disk by digest and only ever fetched once: the first request for one
+# starts a fetch into a temporary file, and it and every request that comes in
+# meanwhile read that file as it grows.
+
+import dataclasses as dc
+import hashlib
+import http.client as http
+import http.server as httpserver
+import json
+import os
+import pathlib
+import re
+import threading
+import typing as T
+import urllib.parse as urlparse
+
+from . import streams
+from .errors import PocketError
+from .oci import json as ocijson
+from .oci.core import cache, descriptor
+from .oci.core.registry import Registry
+from .oci.http import BlobUnavailable, ManifestPuller
+
+_DIGEST_RE = re.compile(r"sha256:[0-9a-f]{64}")
+_CHUNK = 1024 * 1024
+
+
+class CorruptBlob(PocketError):
+    def __init__(self, digest: str, got: descriptor.Digest):
+        super().__init__(f"Upstream sent {got} for {digest}")
+
+
+@dc.dataclass()
+class Stats:
+    blob_hits: int = 0
+    blob_misses: int = 0
+    # requests that joined a fetch another request had started
+    blob_coalesced: int = 0
+    bytes_fetched: int = 0
+    bytes_served: int = 0
+    upstream_errors: int = 0
+
+    def __str__(self) -> str:
+        total = self.blob_hits + self.blob_misses + self.blob_coalesced
+        rate = (self.blob_hits / total * 100) if total else 0.0
+        return (
+            f"blob hits: {self.blob_hits}, misses: {self.blob_misses}, coalesced: {self.blob_coalesced}"
+            f" ({rate:.1f}% hit rate), fetched: {self.bytes_fetched} bytes, served: {self.bytes_served} bytes,"
+            f" upstream errors: {self.upstream_errors}")
+
+
+class _fetch:
+    """
+    A blob being written to tmp, readers wait on cond for more than what
+    they've read so far.
+    """
+
+    def __init__(self, tmp: pathlib.Path):
+        self.tmp = tmp
+        self.cond = threading.Condition()
+        # upstream has said it has the blob and started sending it
+        self.answered = False
+        self.written = 0
+        self.done = False
+        self.error: T.Optional[BaseException] = None
+
+    def answer(self) -> None:
+        with self.cond:
+            self.answered = True
+            self.cond.notify_all()
+
+    def wait_answer(self) -> None:
+        """
+        Returns once upstream has answered, raising whatever the fetch
+        failed with if it already has.
+        """
+        with self.cond:
+            while not self.answered and not self.done:
+                self.cond.wait()
+            if self.error is not None:
+                raise self.error
+
+    def advance(self, n: int) -> None:
+        with self.cond:
+            self.written += n
+            self.cond.notify_all()
+
+    def finish(self, error: T.Optional[BaseException] = None) -> None:
+        with self.cond:
+            self.done = True
+            self.error = error
+            self.cond.notify_all()
+
+
+@dc.dataclass()
+class _following(streams.MustCloseReader):
+    """
+    Reads a blob that is still being fetched, never past what has been
+    written and failing if the fetch does.
+    """
+
+    f: _fetch
+    fh: T.BinaryIO
+    pos: int = 0
+
+    def read(self, s: int = 0) -> bytes:
+        with self.f.cond:
+            while self.pos >= self.f.written and not self.f.done:
+                self.f.cond.wait()
+            if self.f.error is not None:
+                raise self.f.error
+            available = self.f.written - self.pos
+
+        b = self.fh.read(min(s, available) if s > 0 else available)
+        self.pos += len(b)
+        return b
+
+    def close(self):
+        self.fh.close()
+
+
+@dc.dataclass()
+class Blob:
+    """
+    A blob ready to be sent, size is None when it is still being fetched and
+    nothing said how big it is.
+    """
+
+    r: streams.MustCloseReader
+    size: T.Optional[int]
+    # a file that can be sent as it is
+    file: T.Optional[T.BinaryIO] = None
+
+
+class Proxy:
+    def __init__(self, upstream: Registry, manifests: ManifestPuller, blobs: cache.BlobCache, manifestcache: cache.ManifestCache, repository: str):
+        self.stats = Stats()
+        self.manifestcache = manifestcache
+        self._upstream = upstream
+        self._manifests = manifests
+        self._blobs = blobs
+        self._repository = repository
+        self._lock = threading.Lock()
+        self._fetches: T.Dict[str, _fetch] = {}
+        # blob sizes from manifests that have been served, blobs still being
+        # fetched can be sent with a length
+        self._sizes: T.Dict[str, int] = {}
+
+    def serves(self, repository: str) -> bool:
+        return repository == self._repository or repository.startswith(f"{self._repository}/")
+
+    def manifest(self, repository: str, reference: str) -> T.Optional[cache.CachedManifest]:
+        entry = self._manifests.fetch_manifest(repository, reference)
+        if entry is not None:
+            with self._lock:
+                for d in entry.manifest.blobs():
+                    self._sizes[str(d.digest)] = d.bytes
+        return entry
+
+    def tags(self, repository: str) -> T.List[str]:
+        return list(self._upstream.tags.list_tags(repository))
+
+    def blob_size(self, repository: str, digest: str) -> T.Optional[int]:
+        """
+        The size of a blob if it exists, -1 when it does but its size isn't
+        known yet.
+        """
+        try:
+            return self._blobs.path(descriptor.Digest.from_str(digest)).stat().st_size
+        except FileNotFoundError:
+            pass
+
+        with self._lock:
+            size = self._sizes.get(digest)
+
+        if not self._upstream.blobs.does_blob_exist(repository, descriptor.Digest.from_str(digest)):
+            return None
+        return size if size is not None else -1
+
+    def blob(self, repository: str, digest: str) -> Blob:
+        """
+        Doesn't return until upstream has answered for a blob that isn't
+        cached, raising BlobUnavailable if it doesn't have it.
+        """
+        d = descriptor.Digest.from_str(digest)
+
+        with self._lock:
+            if (fh := self._blobs.open(d)) is not None:
+                self.stats.blob_hits += 1
+                size = os.fstat(fh.fileno()).st_size
+                return Blob(T.cast(streams.MustCloseReader, fh), size, fh)
+
+            if (f := self._fetches.get(digest)) is not None:
+                self.stats.blob_coalesced += 1
+            else:
+                self.stats.blob_misses += 1
+                f = self._fetches[digest] = _fetch(self._blobs.temporary(d))
+                f.tmp.touch()
+                threading.Thread(target=self._fetch, args=(repository, d, f), daemon=True).start()
+
+            # opened while holding the lock, the fetch can't move it into the
+            # cache until that is released
+            r = _following(f, f.tmp.open("rb"))
+            size = self._sizes.get(digest)
+
+        try:
+            f.wait_answer()
+        except BaseException:
+            r.close()
+            raise
+        return Blob(r, size)
+
+    def _fetch(self, repository: str, digest: descriptor.Digest, f: _fetch) -> None:
+        error: T.Optional[BaseException] = None
+
+        try:
+            r = self._upstream.blobs.pull_blob(repository, digest)
+            f.answer()
+            digester = descriptor.DigestStream(hashlib.sha256())
+
+            try:
+                with f.tmp.open("wb") as fh:
+                    while b := r.read(_CHUNK):
+                        fh.write(b)
+                        # followers read the file, not this buffer
+                        fh.flush()
+                        digester.write(b)
+                        f.advance(len(b))
+                        with self._lock:
+                            self.stats.bytes_fetched += len(b)
+            finally:
+                r.close()
+
+            if (got := digester.digest()) != digest:
+                raise CorruptBlob(str(digest), got)
+
+            with self._lock:
+                self._blobs.commit(f.tmp, digest)
+                del self._fetches[str(digest)]
+        except BaseException as e:
+            error = e
+            with self._lock:
+                # failing before upstream answered is counted by each
+                # request that was waiting on it
+                if f.answered:
+                    self.stats.upstream_errors += 1
+                self._fetches.pop(str(digest), None)
+            f.tmp.unlink(missing_ok=True)
+        finally:
+            f.finish(error)
+
+    def served(self, n: int) -> None:
+        with self._lock:
+            self.stats.bytes_served += n
+
+    def upstream_error(self) -> None:
+        with self._lock:
+            self.stats.upstream_errors += 1
+
+    def summary(self) -> T.Dict[str, T.Any]:
+        with self._lock:
+            blobs = dc.asdict(self.stats)
+        return {"blobs": blobs, "manifests": dc.asdict(self.manifestcache.stats)}
+
+
+_UPSTREAM_ERRORS = (OSError, http.HTTPException, PocketError)
+
+
+class Handler(httpserver.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    proxy: Proxy
+    log: T.Optional[T.TextIO] = None
+    _log_lock = threading.Lock()
+
+    def do_GET(self):
+        self._route()
+
+    def do_HEAD(self):
+        self._route()
+
+    def log_message(self, format: str, *args: T.Any) -> None:
+        if self.log is not None:
+            with Handler._log_lock:
+                self.log.write(f"{self.address_string()} {format % args}\n")
+                self.log.flush()
+
+    def _route(self) -> None:
+        path = urlparse.urlsplit(self.path).path
+
+        if path in ("/v2", "/v2/"):
+            return self._send(200, {"Docker-Distribution-API-Version": "registry/2.0"})
+        if path == "/stats":
+            return self._json(200, self.proxy.summary())
+
+        m = (
+            re.fullmatch(r"/v2/(.+)/(manifests|blobs)/([^/]+)", path)
+            or re.fullmatch(r"/v2/(.+)/(tags)/(list)", path)
+        )
+        if m is None:
+            return self._error(404, "UNSUPPORTED", "not served by this proxy")
+
+        repository, kind, reference = m.groups()
+        if not self.proxy.serves(repository):
+            return self._error(404, "NAME_UNKNOWN", f"{repository} is not proxied")
+
+        try:
+            if kind == "manifests":
+                return self._manifest(repository, reference)
+            if kind == "tags":
+                return self._json(200, {"name": repository, "tags": self.proxy.tags(repository)})
+            if not _DIGEST_RE.fullmatch(reference):
+                return self._error(400, "DIGEST_INVALID", f"{reference} is not a sha256 digest")
+            if self.command == "HEAD":
+                return self._head_blob(repository, reference)
+            return self._get_blob(repository, reference)
+        except BlobUnavailable as e:
+            return self._error(404, "BLOB_UNKNOWN", str(e))
+        except _UPSTREAM_ERRORS as e:
+            self.proxy.upstream_error()
+            return self._error(502, "UNAVAILABLE", str(e) or repr(e))
+
+    def _manifest(self, repository: str, reference: str) -> None:
+        if (entry := self.proxy.manifest(repository, reference)) is None:
+            return self._error(404, "MANIFEST_UNKNOWN", f"{repository}:{reference}")
+
+        etag = f'"{entry.digest}"'
+        headers = {
+            "Content-Type": ocijson.media_type(entry.body),
+            "Docker-Content-Digest": entry.digest,
+            "ETag": etag,
+            "Content-Length": str(len(entry.body)),
+        }
+
+        if self.headers.get("If-None-Match") == etag:
+            return self._send(304, {k: v for k, v in headers.items() if k != "Content-Length"})
+
+        self._send(200, headers, entry.body)
+
+    def _head_blob(self, repository: str, digest: str) -> None:
+        if (size := self.proxy.blob_size(repository, digest)) is None:
+            return self._error(404, "BLOB_UNKNOWN", digest)
+
+        self._send_blob_headers(digest, size if size >= 0 else None)
+
+    def _get_blob(self, repository: str, digest: str) -> None:
+        blob = self.proxy.blob(repository, digest)
+
+        try:
+            offset = self._send_blob_headers(digest, blob.size)
+        except BaseException:
+            blob.r.close()
+            raise
+
+        try:
+            self._copy(blob, offset)
+        except Exception as e:
+            # the status line is gone, all that's left is to cut the body
+            # short so the client knows it didn't get all of it
+            self.close_connection = True
+            self.log_message("%s failed partway: %s", digest, str(e) or repr(e))
+        finally:
+            blob.r.close()
+
+    def _send_blob_headers(self, digest: str, size: T.Optional[int]) -> int:
+        """
+        The same headers for a GET and a HEAD, returns the offset the body
+        starts at.
+        """
+        offset = _range_start(self.headers.get("Range")) if size is not None else 0
+        if size is not None and offset >= size:
+            offset = 0
+
+        headers = {"Docker-Content-Digest": digest, "Content-Type": "application/octet-stream"}
+        if size is None:
+            headers["Transfer-Encoding"] = "chunked"
+        else:
+            headers["Content-Length"] = str(size - offset)
+        if offset:
+            headers["Content-Range"] = f"bytes {offset}-{size - 1}/{size}"
+
+        self._send(206 if offset else 200, headers)
+        return offset
+
+    def _copy(self, blob: Blob, offset: int) -> None:
+        if blob.file is not None and blob.size is not None:
+            # already on disk in full, the kernel can send it without it
+            # passing through here
+            sent = self.connection.sendfile(blob.file, offset, blob.size - offset)
+            self.proxy.served(sent)
+            return
+
+        streams.skip(blob.r, offset)
+        while b := blob.r.read(_CHUNK):
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(b), b) if blob.size is None else b)
+            self.proxy.served(len(b))
+
+        if blob.size is None:
+            self.wfile.write(b"0\r\n\r\n")
+
+    def _json(self, code: int, body: T.Any) -> None:
+        self._send(code, {"Content-Type": "application/json"}, json.dumps(body).encode())
+
+    def _error(self, code: int, error: str, message: str) -> None:
+        self._json(code, {"errors": [{"code": error, "message": message}]})
+
+    def _send(self, code: int, headers: T.Dict[str, str], body: bytes = b"") -> None:
+        self.send_response(code)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        if "Content-Length" not in headers and "Transfer-Encoding" not in headers:
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body and self.command != "HEAD":
+            self.wfile.write(body)
+
+
+def _range_start(header: T.Optional[str]) -> int:
+    # only open ended ranges, which is what resuming a download asks for
+    if header is None or (m := re.fullmatch(r"bytes=(\d+)-", header.strip())) is None:
+        return 0
+    return int(m.group(1))
+
+
+def server(address: T.Tuple[str, int], proxy: Proxy, log: T.Optional[T.TextIO]) -> httpserver.ThreadingHTTPServer:
+    handler = type("handler", (Handler,), {"proxy": proxy, "log": log})
+    s = httpserver.ThreadingHTTPServer(address, handler)
+    s.daemon_threads = True
+    return s
@@ -0,0 +1,270 @@
+# Finding the seeds generated with some settings string means reading the
+# config blob of every tag, so the index keeps each seed's details and layers
+# in SQLite where they can be searched without asking the registry anything.
+#
+# Manifests and configs are content addressed, once one has been read it never
+# needs to be fetched again whatever tag it turns up under. Only what a tag
+# points at can change, so tags are the one thing kept per repository.
+
+import dataclasses as dc
+import json
+import pathlib
+import sqlite3
+import typing as T
+
+from .errors import PocketError
+from .oci.core import descriptor
+from .zootrlib.seeddetails import SeedDetails
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS configs (
+    digest TEXT PRIMARY KEY,
+    version TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    seed TEXT NOT NULL,
+    settings TEXT NOT NULL,
+    spoiler INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS manifests (
+    digest TEXT PRIMARY KEY,
+    config TEXT NOT NULL REFERENCES configs (digest),
+    size INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS layers (
+    manifest TEXT NOT NULL REFERENCES manifests (digest),
+    position INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    media_type TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    annotations TEXT NOT NULL,
+    PRIMARY KEY (manifest, position)
+);
+
+CREATE TABLE IF NOT EXISTS tags (
+    registry TEXT NOT NULL,
+    repository TEXT NOT NULL,
+    tag TEXT NOT NULL,
+    manifest TEXT NOT NULL REFERENCES manifests (digest),
+    PRIMARY KEY (registry, repository, tag)
+);
+
+CREATE INDEX IF NOT EXISTS configs_version ON configs (version, settings);
+CREATE INDEX IF NOT EXISTS configs_settings ON configs (settings);
+CREATE INDEX IF NOT EXISTS configs_seed ON configs (seed);
+CREATE INDEX IF NOT EXISTS manifests_config ON manifests (config);
+CREATE INDEX IF NOT EXISTS tags_manifest ON tags (manifest);
+"""
+
+# kept in user_version, an index older than this has manifest sizes that
+# didn't count the config
+_VERSION = 1
+
+# what seeds can be sorted by and the column holding it
+SORT_KEYS = {
+    "tag": "t.tag",
+    "version": "c.version",
+    "seed": "c.seed",
+    "settings": "c.settings",
+    "spoiler": "c.spoiler",
+    "size": "m.size",
+}
+
+
+class NoIndex(PocketError):
+    def __init__(self, path: pathlib.Path):
+        super().__init__(f"There is no index at {path}, build one with the index command first")
+
+
+@dc.dataclass()
+class Seed:
+    tag: str
+    manifest: str
+    config: str
+    details: SeedDetails
+    # every blob in the manifest, the config included, which is what a pull
+    # downloads
+    size: int
+    layers: T.List[descriptor.Descriptor] = dc.field(default_factory=list)
+
+
+@dc.dataclass()
+class Query:
+    """
+    Every field but spoiler is a list of globs, a seed matches a field when
+    any of them match and matches the query when it matches every field that
+    was given.
+    """
+
+    tags: T.List[str] = dc.field(default_factory=list)
+    versions: T.List[str] = dc.field(default_factory=list)
+    settings: T.List[str] = dc.field(default_factory=list)
+    seeds: T.List[str] = dc.field(default_factory=list)
+    spoiler: T.Optional[bool] = None
+    sort: T.List[str] = dc.field(default_factory=list)
+    reverse: bool = False
+    limit: T.Optional[int] = None
+
+
+class Index:
+    """
+    Nothing is written until commit, whatever was added since the last one
+    is lost if the process stops before then.
+    """
+
+    def __init__(self, path: pathlib.Path, create: bool = True):
+        if not create and not path.exists():
+            raise NoIndex(path)
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path)
+        self._db.executescript(_SCHEMA)
+
+        if self._db.execute("PRAGMA user_version").fetchone()[0] < _VERSION:
+            self._upgrade()
+
+    def tags(self, registry: str, repository: str) -> T.Dict[str, str]:
+        """
+        Every tag of the repository in the index and the digest of the
+        manifest it pointed at when it was indexed
+        """
+        rows = self._db.execute(
+            "SELECT tag, manifest FROM tags WHERE registry = ? AND repository = ?",
+            (registry, repository))
+        return dict(rows)
+
+    def has_manifest(self, digest: str) -> bool:
+        return self._has("manifests", digest)
+
+    def has_config(self, digest: str) -> bool:
+        return self._has("configs", digest)
+
+    def add_config(self, digest: str, details: SeedDetails) -> None:
+        self._db.execute(
+            "INSERT OR REPLACE INTO configs VALUES (?, ?, ?, ?, ?, ?)",
+            (digest, details.version, json.dumps(details.hash), details.seed,
+             details.settings, int(details.spoiler)))
+
+    def add_manifest(self, digest: str, config: descriptor.Descriptor, layers: T.Sequence[descriptor.Descriptor]) -> None:
+        self._db.execute(
+            "INSERT OR REPLACE INTO manifests VALUES (?, ?, ?)",
+            (digest, str(config.digest), config.bytes + sum(d.bytes for d in layers)))
+        self._db.execute("DELETE FROM layers WHERE manifest = ?", (digest,))
+        self._db.executemany(
+            "INSERT INTO layers VALUES (?, ?, ?, ?, ?, ?)",
+            [(digest, i, str(d.digest), d.content_type, d.bytes, json.dumps(d.annotations))
+             for i, d in enumerate(layers)])
+
+    def tag(self, registry: str, repository: str, tag: str, manifest: str) -> None:
+        self._db.execute(
+            "INSERT OR REPLACE INTO tags VALUES (?, ?, ?, ?)",
+            (registry, repository, tag, manifest))
+
+    def untag(self, registry: str, repository: str, tags: T.Iterable[str]) -> None:
+        """
+        Manifests and configs are kept, another tag may still point at them or
+        the same seed may be pushed again.
+        """
+        self._db.executemany(
+            "DELETE FROM tags WHERE registry = ? AND repository = ? AND tag = ?",
+            [(registry, repository, t) for t in tags])
+
+    def commit(self) -> None:
+        self._db.commit()
+
+    def analyze(self) -> None:
+        """
+        Lets SQLite see how selective each index is, without it a search by
+        settings walks every tag of the repository rather than starting from
+        the configs that match.
+        """
+        self._db.execute("ANALYZE")
+        self._db.commit()
+
+    def close(self) -> None:
+        self._db.close()
+
+    def query(self, registry: str, repository: str, q: Query, layers: bool = False) -> T.List[Seed]:
+        where, params = _where(registry, repository, q)
+        order = ", ".join(f"{SORT_KEYS[k]} {'DESC' if q.reverse else 'ASC'}" for k in q.sort + ["tag"])
+        sql = f"""
+            SELECT t.tag, t.manifest, m.config, c.version, c.hash, c.seed, c.settings, c.spoiler, m.size
+            FROM tags t
+            JOIN manifests m ON m.digest = t.manifest
+            JOIN configs c ON c.digest = m.config
+            WHERE {where}
+            ORDER BY {order}
+        """
+        if q.limit is not None:
+            sql = f"{sql} LIMIT ?"
+            params.append(q.limit)
+
+        seeds = [
+            Seed(tag, manifest, config,
+                 SeedDetails(version, json.loads(hash), seed, settings, bool(spoiler)), size)
+            for tag, manifest, config, version, hash, seed, settings, spoiler, size
+            in self._db.execute(sql, params)
+        ]
+
+        if layers:
+            self._load_layers(seeds)
+        return seeds
+
+    def _load_layers(self, seeds: T.List[Seed]) -> None:
+        """
+        One query for the layers of every seed rather than one per seed
+        """
+        digests = sorted({s.manifest for s in seeds})
+        found: T.Dict[str, T.List[descriptor.Descriptor]] = {d: [] for d in digests}
+
+        rows = self._db.execute(
+            """
+            SELECT manifest, digest, media_type, size, annotations FROM layers
+            WHERE manifest IN (SELECT value FROM json_each(?))
+            ORDER BY manifest, position
+            """,
+            (json.dumps(digests),))
+        for manifest, digest, media_type, size, annotations in rows:
+            found[manifest].append(descriptor.Descriptor(
+                descriptor.Digest.from_str(digest), size, media_type, json.loads(annotations)))
+
+        for s in seeds:
+            s.layers = found[s.manifest]
+
+    def _upgrade(self) -> None:
+        """
+        Manifests are dropped along with the tags pointing at them, the next
+        index fetches them again. Configs stay, nothing about them changed.
+        """
+        with self._db:
+            self._db.execute("DELETE FROM tags")
+            self._db.execute("DELETE FROM layers")
+            self._db.execute("DELETE FROM manifests")
+            self._db.execute(f"PRAGMA user_version = {_VERSION}")
+
+    def _has(self, table: str, digest: str) -> bool:
+        row = self._db.execute(f"SELECT 1 FROM {table} WHERE digest = ?", (digest,))
+        return row.fetchone() is not None
+
+
+def _where(registry: str, repository: str, q: Query) -> T.Tuple[str, T.List[T.Any]]:
+    clauses = ["t.registry = ?", "t.repository = ?"]
+    params: T.List[T.Any] = [registry, repository]
+
+    for column, globs in (("t.tag", q.tags), ("c.version", q.versions),
+                          ("c.settings", q.settings), ("c.seed", q.seeds)):
+        if globs:
+            # only a plain comparison can be answered from an index
+            clauses.append(f"({' OR '.join(f'{column} {_operator(g)} ?' for g in globs)})")
+            params.extend(globs)
+
+    if q.spoiler is not None:
+        clauses.append("c.spoiler = ?")
+        params.append(int(q.spoiler))
+
+    return " AND ".join(clauses), params
+
+
+def _operator(value: str) -> str:
+    return "GLOB" if any(c in value for c in "*?[") else "="
@@ -1,5 +1,9 @@
+import contextlib
 import dataclasses as dc
 import io
+import mmap
+import os
+import threading
 import typing as T
 
 
@@ -23,6 +27,11 @@ class Reader(T.Protocol):
         ...
 
 
+class ReaderInto(T.Protocol):
+    def readinto(self, b: memoryview) -> int:
+        ...
+
+
 class Seeker(T.Protocol):
     def seek(self, n: int, origin: int):
         ...
@@ -67,6 +76,18 @@ class TeeReader(Reader):
         return r
 
 
+@dc.dataclass()
+class ChainReader(Reader):
+    rs: T.List[Reader]
+
+    def read(self, s: int = 0) -> bytes:
+        while self.rs:
+            if r := self.rs[0].read(s):
+                return r
+            self.rs.pop(0)
+        return b""
+
+
 @dc.dataclass()
 class _namedreader(NamedReader):
     n: str
@@ -78,6 +99,56 @@ class _namedreader(NamedReader):
     def read(self, s: int = 0) -> bytes:
         return self.r.read(s)
 
+    def readinto(self, b: memoryview) -> int:
+        return readinto(self.r, b)
+
+
+def readinto(r: Reader, b: memoryview) -> int:
+    """
+    Fills as much of b as one read of r does. Readers that can read into a
+    buffer themselves do, anything else is read and copied in.
+    """
+    if (into := getattr(r, "readinto", None)) is not None:
+        return into(b)
+
+    got = r.read(len(b))
+    b[:len(got)] = got
+    return len(got)
+
+
+class BufferPool:
+    """
+    Hands out buffers of the same size and takes them back for the next
+    transfer, instead of allocating for every chunk.
+    """
+
+    def __init__(self, size: int):
+        self._size = size
+        self._free: T.List[bytearray] = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def buffer(self) -> T.Iterator[memoryview]:
+        with self._lock:
+            b = self._free.pop() if self._free else bytearray(self._size)
+
+        try:
+            with memoryview(b) as v:
+                yield v
+        finally:
+            with self._lock:
+                self._free.append(b)
+
+
+def skip(r: Reader, n: int) -> None:
+    """
+    Reads and throws away the next n bytes
+    """
+    while n > 0:
+        if not (b := r.read(min(n, 1024 * 64))):
+            return
+        n -= len(b)
+
 
 def name(n: str, r: Reader) -> NamedReader:
     return _namedreader(n, r)
@@ -100,5 +171,54 @@ class FileReader(MustCloseReader):
     def read(self, s: int = 0) -> bytes:
         return self.fh.read(s)
 
+    def readinto(self, b: memoryview) -> int:
+        return self.fh.readinto(b)
+
     def close(self):
         self.fh.close()
+
+
+class MappedReader(MustCloseReader):
+    """
+    Reads a file through a memory map, every read is a view of the mapped
+    pages so nothing is copied until it's written somewhere.
+    """
+
+    def __init__(self, fh: io.BufferedReader):
+        self.fh = fh
+        self.m = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        self.v = memoryview(self.m)
+        self.pos = 0
+
+    def read(self, s: int = 0) -> bytes:
+        end = len(self.v) if s <= 0 else min(self.pos + s, len(self.v))
+        b, self.pos = self.v[self.pos:end], end
+        return T.cast(bytes, b)
+
+    def readinto(self, b: memoryview) -> int:
+        n = min(len(b), len(self.v) - self.pos)
+        b[:n] = self.v[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+    def close(self):
+        self.v.release()
+        try:
+            self.m.close()
+        except BufferError:
+            # a view is still held somewhere, the map goes once it's dropped
+            pass
+        self.fh.close()
+
+
+def mapped(fh: io.BufferedReader) -> MustCloseReader:
+    """
+    Maps fh when it is a regular file with something in it, empty files and
+    pipes can't be mapped and are read normally.
+    """
+    try:
+        if os.fstat(fh.fileno()).st_size > 0:
+            return MappedReader(fh)
+    except (OSError, ValueError, io.UnsupportedOperation):
+        pass
+    return FileReader(fh)
@@ -1,3 +1,3 @@
 from .artifacts import FileKind, ZootrFile, zootr_files_from_dir
 from .manifest import ZootrManifest, zootr_manifest_from_dir
-from .seeddetails import SeedDetails, seeddetails_from_dict, seeddetails_from_stream, SeedDetailsEncoder
+from .seeddetails import SeedDetails, seeddetails_from_dict, seeddetails_from_stream, seeddetails_from_config, SeedDetailsEncoder
@@ -39,3 +39,16 @@ def seeddetails_from_dict(settings: T.Dict[str, T.Any]) -> SeedDetails:
         settings=settings[":settings_string"],
         spoiler=settings[":enable_distribution_file"],
     )
+
+
+def seeddetails_from_config(config: T.Dict[str, T.Any]) -> SeedDetails:
+    """
+    Reads back what SeedDetailsEncoder wrote, the config blob of a pushed seed
+    """
+    return SeedDetails(
+        version=config["version"],
+        hash=config["hash"],
+        seed=config["seed"],
+        settings=config["settings"],
+        spoiler=config["spoiler"],
+    )